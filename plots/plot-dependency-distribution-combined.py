@@ -9,41 +9,29 @@ import matplotlib.ticker as ticker
 import numpy as np
 
 sys.path.append('../')
-from tools.shared_functions import COLORS, read_to_set
-
-DATA_DELIMITER = ','
+from tools.hegemony import (KIND_IX, HegemonyFilter, add_filter_arguments, filter_from_args, read_valid_ixps,
+                            valid_dependency_mask)
+from tools.hegemony_aggregates import load_aggregates
+from tools.shared_functions import COLORS
 
 
 def load_dependency_counts(score_file: str,
-                           hege_threshold: float = 0,
-                           num_peers_threshold: int = 0,
-                           valid_ixps: set = None) -> Tuple[dict, dict]:
+                           hegemony_filter: HegemonyFilter,
+                           memory_limit: int = None,
+                           processes: int = 1) -> Tuple[dict, dict]:
     as_dependencies = defaultdict(int)
     ixp_dependencies = defaultdict(int)
-    with open(score_file, 'r') as f:
-        f.readline()
-        for line in f:
-            line_split = line.strip().split(DATA_DELIMITER)
-            scope = line_split[0]
-            asn = line_split[1]
-            hege = float(line_split[2])
-            num_peers = int(line_split[3])
-            if (hege < hege_threshold
-                    or num_peers < num_peers_threshold
-                    or scope == asn
-                    or scope == '-1'
-                    or 'ip' in line
-                    or ';' in asn
-                    or hege > 1):
-                continue
-            if asn.startswith('ix|'):
-                ix_id = asn.removeprefix('ix|')
-                if valid_ixps and ix_id not in valid_ixps:
-                    continue
-                ixp_dependencies[ix_id] += 1
-            else:
-                asn = asn.removeprefix('as|')
-                as_dependencies[asn] += 1
+    aggregates = load_aggregates(score_file, hegemony_filter, ('dependency-counts',), processes, memory_limit)
+    kinds = aggregates['dependency-counts.kind']
+    dep_ids = aggregates['dependency-counts.dep_id']
+    keep = valid_dependency_mask(kinds, dep_ids, hegemony_filter.valid_ixps)
+    for kind, dep_id, count in zip(kinds[keep].tolist(),
+                                   dep_ids[keep].tolist(),
+                                   aggregates['dependency-counts.count'][keep].tolist()):
+        if kind == KIND_IX:
+            ixp_dependencies[str(dep_id)] = count
+        else:
+            as_dependencies[str(dep_id)] = count
     return as_dependencies, ixp_dependencies
 
 
@@ -138,6 +126,10 @@ def main() -> None:
     parser.add_argument('atlas_hegemony')
     parser.add_argument('valid_ixps')
     parser.add_argument('output_file')
+    parser.add_argument('--memory-limit', type=int,
+                        help='stream the hegemony files in batches of at most this many MiB')
+    parser.add_argument('--processes', type=int, default=1, help='parse the hegemony file with this many processes')
+    add_filter_arguments(parser)
     args = parser.parse_args()
 
     FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -156,16 +148,19 @@ def main() -> None:
     logging.info(f'Atlas input file: {atlas_hegemony}')
     logging.info(f'Output file: {output_file}')
 
-    valid_ixps = read_to_set(valid_ixps_file)
+    hegemony_filter = filter_from_args(args, read_valid_ixps(valid_ixps_file))
+    memory_limit = None
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 ** 2
 
     ark_as_dependencies, ark_ixp_dependencies = load_dependency_counts(ark_hegemony,
-                                                                       hege_threshold=0.1,
-                                                                       num_peers_threshold=10,
-                                                                       valid_ixps=valid_ixps)
+                                                                       hegemony_filter,
+                                                                       memory_limit=memory_limit,
+                                                                       processes=args.processes)
     atlas_as_dependencies, atlas_ixp_dependencies = load_dependency_counts(atlas_hegemony,
-                                                                           hege_threshold=0.1,
-                                                                           num_peers_threshold=10,
-                                                                           valid_ixps=valid_ixps)
+                                                                           hegemony_filter,
+                                                                           memory_limit=memory_limit,
+                                                                           processes=args.processes)
 
     plot_dependency_cdf(ark_as_dependencies,
                         ark_ixp_dependencies,
@@ -2,7 +2,6 @@ import argparse
 import logging
 import os
 import sys
-from collections import defaultdict
 from typing import Tuple
 
 import matplotlib as mpl
@@ -11,43 +10,26 @@ import matplotlib.ticker as ticker
 import numpy as np
 
 sys.path.append('../')
-from tools.shared_functions import COLORS, read_to_set
-
-DATA_DELIMITER = ','
+from tools.hegemony import KIND_IX, HegemonyFilter, add_filter_arguments, filter_from_args, read_valid_ixps
+from tools.hegemony_aggregates import hegemony_lists, load_aggregates
+from tools.shared_functions import COLORS
 
 mpl.rcParams['xtick.major.pad'] = 6
 
 
 def load_mean_hege(score_file: str,
-                   hege_threshold: float = 0,
-                   num_peers_threshold: int = 0,
-                   valid_ixps: set = None) -> Tuple[dict, dict]:
-    as_hege_lists = defaultdict(list)
-    ixp_hege_lists = defaultdict(list)
-    with open(score_file, 'r') as f:
-        f.readline()
-        for line in f:
-            line_split = line.strip().split(DATA_DELIMITER)
-            scope = line_split[0]
-            asn = line_split[1]
-            hege = float(line_split[2])
-            num_peers = int(line_split[3])
-            if hege < hege_threshold \
-                    or num_peers < num_peers_threshold \
-                    or 'ip' in line \
-                    or scope == asn \
-                    or scope == '-1' \
-                    or ';' in asn \
-                    or hege > 1:
-                continue
-            if asn.startswith('ix|'):
-                ix_id = asn.removeprefix('ix|')
-                if valid_ixps and ix_id not in valid_ixps:
-                    continue
-                ixp_hege_lists[ix_id].append(hege)
-            else:
-                asn = asn.removeprefix('as|')
-                as_hege_lists[asn].append(hege)
+                   hegemony_filter: HegemonyFilter,
+                   memory_limit: int = None,
+                   processes: int = 1) -> Tuple[dict, dict]:
+    as_hege_lists = dict()
+    ixp_hege_lists = dict()
+    aggregates = load_aggregates(score_file, hegemony_filter, ('hegemony-lists',), processes, memory_limit)
+    for kind, dep_id, hege_list in hegemony_lists(aggregates, hegemony_filter.valid_ixps):
+        if kind == KIND_IX:
+            ix_id = str(dep_id)
+            ixp_hege_lists[ix_id] = hege_list
+        else:
+            as_hege_lists[str(dep_id)] = hege_list
     as_mean_heges = {asn: np.mean(hege_list)
                      for asn, hege_list in as_hege_lists.items()}
     ixp_mean_heges = {ix_id: np.mean(hege_list)
@@ -124,6 +106,10 @@ def main() -> None:
     parser.add_argument('atlas_hegemony')
     parser.add_argument('valid_ixps')
     parser.add_argument('output_file')
+    parser.add_argument('--memory-limit', type=int,
+                        help='stream the hegemony file in batches of at most this many MiB')
+    parser.add_argument('--processes', type=int, default=1, help='parse the hegemony files with this many processes')
+    add_filter_arguments(parser)
     args = parser.parse_args()
 
     FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -142,16 +128,23 @@ def main() -> None:
     logging.info(f'Atlas input file: {atlas_hegemony}')
     logging.info(f'Output file: {output_file}')
 
-    valid_ixps = read_to_set(valid_ixps_file)
-
-    ark_as_mean_heges, ark_ixp_mean_heges = load_mean_hege(ark_hegemony,
-                                                           hege_threshold=0.1,
-                                                           num_peers_threshold=10,
-                                                           valid_ixps=valid_ixps)
-    atlas_as_mean_heges, atlas_ixp_mean_heges = load_mean_hege(atlas_hegemony,
-                                                               hege_threshold=0.1,
-                                                               num_peers_threshold=10,
-                                                               valid_ixps=valid_ixps)
+    hegemony_filter = filter_from_args(args, read_valid_ixps(valid_ixps_file))
+
+    memory_limit = None
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 ** 2
+    try:
+        ark_as_mean_heges, ark_ixp_mean_heges = load_mean_hege(ark_hegemony,
+                                                               hegemony_filter,
+                                                               memory_limit=memory_limit,
+                                                               processes=args.processes)
+        atlas_as_mean_heges, atlas_ixp_mean_heges = load_mean_hege(atlas_hegemony,
+                                                                   hegemony_filter,
+                                                                   memory_limit=memory_limit,
+                                                                   processes=args.processes)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
     plot_hegemony_distribution(ark_as_mean_heges,
                                ark_ixp_mean_heges,
                                atlas_as_mean_heges,
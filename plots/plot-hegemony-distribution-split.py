@@ -2,7 +2,6 @@ import argparse
 import logging
 import os
 import sys
-from collections import defaultdict
 from typing import Tuple
 
 import matplotlib as mpl
@@ -11,10 +10,11 @@ import matplotlib.ticker as ticker
 import numpy as np
 
 sys.path.append('../')
+from tools.hegemony import KIND_IX, HegemonyFilter, add_filter_arguments, filter_from_args, read_valid_ixps
+from tools.hegemony_aggregates import hegemony_lists, load_aggregates
 from tools.shared_functions import (COLORS, MEDIUM_AS_THRESHOLD,
                                     MEDIUM_IX_THRESHOLD, SMALL_AS_THRESHOLD,
-                                    SMALL_IX_THRESHOLD, read_to_set,
-                                    sanitize_dir)
+                                    SMALL_IX_THRESHOLD, sanitize_dir)
 
 INPUT_FILE_SUFFIX = '.hegemony.csv'
 OUTPUT_FILE_SUFFIX = '.hegemony_split_cdf'
@@ -43,35 +43,18 @@ def three_way_split(data: dict, thresh_1: int, thresh_2: int) -> Tuple[dict, dic
 
 
 def load_split_mean_hege(score_file: str,
-                         hege_threshold: float = 0,
-                         num_peers_threshold: int = 0,
-                         valid_ixps: set = None) -> Tuple[dict, dict]:
-    as_hege_lists = defaultdict(list)
-    ix_hege_lists = defaultdict(list)
-    with open(score_file, 'r') as f:
-        f.readline()
-        for line in f:
-            line_split = line.strip().split(DATA_DELIMITER)
-            scope = line_split[0]
-            asn = line_split[1]
-            hege = float(line_split[2])
-            num_peers = int(line_split[3])
-            if hege < hege_threshold \
-                    or num_peers < num_peers_threshold \
-                    or 'ip' in line \
-                    or scope == asn \
-                    or scope == '-1' \
-                    or ';' in asn \
-                    or hege > 1:
-                continue
-            if asn.startswith('ix|'):
-                ix_id = asn.removeprefix('ix|')
-                if valid_ixps and ix_id not in valid_ixps:
-                    continue
-                ix_hege_lists[ix_id].append(hege)
-            else:
-                asn = asn.removeprefix('as|')
-                as_hege_lists[asn].append(hege)
+                         hegemony_filter: HegemonyFilter,
+                         memory_limit: int = None,
+                         processes: int = 1) -> Tuple[dict, dict]:
+    as_hege_lists = dict()
+    ix_hege_lists = dict()
+    aggregates = load_aggregates(score_file, hegemony_filter, ('hegemony-lists',), processes, memory_limit)
+    for kind, dep_id, hege_list in hegemony_lists(aggregates, hegemony_filter.valid_ixps):
+        if kind == KIND_IX:
+            ix_id = str(dep_id)
+            ix_hege_lists[ix_id] = hege_list
+        else:
+            as_hege_lists[str(dep_id)] = hege_list
     small_as_mean_heges, medium_as_mean_heges, large_as_mean_heges = three_way_split(
         as_hege_lists, SMALL_AS_THRESHOLD, MEDIUM_AS_THRESHOLD)
     small_ix_mean_heges, medium_ix_mean_heges, large_ix_mean_heges = three_way_split(
@@ -204,6 +187,10 @@ def main() -> None:
     parser.add_argument('input_hegemony_file')
     parser.add_argument('valid_ixps')
     parser.add_argument('output_dir')
+    parser.add_argument('--memory-limit', type=int,
+                        help='stream the hegemony file in batches of at most this many MiB')
+    parser.add_argument('--processes', type=int, default=1, help='parse the hegemony file with this many processes')
+    add_filter_arguments(parser)
     args = parser.parse_args()
 
     FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -223,13 +210,20 @@ def main() -> None:
     logging.info(f'Input file: {input_file}')
     logging.info(f'Output file: {output_file_prefix}')
 
-    valid_ixps = read_to_set(valid_ixps_file)
-
-    small_as_mean_heges, medium_as_mean_heges, large_as_mean_heges, \
-        small_ix_mean_heges, medium_ix_mean_heges, large_ix_mean_heges = \
-        load_split_mean_hege(input_file, hege_threshold=0.1,
-                             num_peers_threshold=10,
-                             valid_ixps=valid_ixps)
+    hegemony_filter = filter_from_args(args, read_valid_ixps(valid_ixps_file))
+
+    memory_limit = None
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 ** 2
+    try:
+        small_as_mean_heges, medium_as_mean_heges, large_as_mean_heges, \
+            small_ix_mean_heges, medium_ix_mean_heges, large_ix_mean_heges = \
+            load_split_mean_hege(input_file, hegemony_filter,
+                                 memory_limit=memory_limit,
+                                 processes=args.processes)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
 
     plot_dependency_distribution(small_as_mean_heges,
                                  medium_as_mean_heges,
@@ -1,7 +1,5 @@
 import argparse
-import bz2
 import logging
-import pickle
 import sys
 from collections import defaultdict
 from itertools import combinations
@@ -11,6 +9,7 @@ import pandas as pd
 import seaborn as sns
 
 sys.path.append('..')
+from tools.scope_details import ScopeDetails
 from tools.shared_functions import sanitize_dir
 
 DATA_DELIMITER = ','
@@ -20,21 +19,18 @@ BOLD_THRESHOLD = 10
 HIDE_NON_BOLD_ENTRIES = False
 
 
-def load_ix_data(per_scope_details: str, ix_id: str) -> dict:
-    with bz2.open(per_scope_details, 'rb') as f:
-        data = pickle.load(f)
-    if ix_id not in data:
+def load_ix_data(details: ScopeDetails, ix_id: str) -> dict:
+    ret = details.ix(ix_id)
+    if not ret:
         logging.error(f'Failed to find IXP with id {ix_id} in data.')
-        return dict()
-    return data[ix_id]
+    return ret
 
 
-def make_matrix(cc_data: dict) -> pd.DataFrame:
+def make_matrix(cc_data: dict, details: ScopeDetails) -> pd.DataFrame:
+    # Each participant set is expanded once, weighted by its scopes.
     m = defaultdict(lambda: defaultdict(int))
-    for participant_tuple, scope_list in cc_data.items():
-        for p1, p2 in combinations(participant_tuple, 2):
-            p1 = int(p1)
-            p2 = int(p2)
+    for set_id, scope_list in cc_data.items():
+        for p1, p2 in combinations(details.participants(set_id), 2):
             m[p1][p2] += len(scope_list)
             m[p2][p1] += len(scope_list)
     df = pd.DataFrame(m)
@@ -102,7 +98,8 @@ def main() -> None:
     per_scope_details = args.per_scope_details
     ix_id = args.ix_id
 
-    ix_data = load_ix_data(per_scope_details, ix_id)
+    details = ScopeDetails(per_scope_details)
+    ix_data = load_ix_data(details, ix_id)
     if not ix_data:
         sys.exit(1)
 
@@ -117,7 +114,7 @@ def main() -> None:
             continue
         logging.info(cc)
         output_file_prefix = f'{output_dir}{ix_id}.{cc}'
-        matrix = make_matrix(multiples)
+        matrix = make_matrix(multiples, details)
         plot_heatmap(matrix, f'{output_file_prefix}.heatmap.pdf')
         matrix_output_file = f'{output_dir}fig-stats/{ix_id}.{cc}.matrix.csv'
         matrix.to_csv(matrix_output_file)
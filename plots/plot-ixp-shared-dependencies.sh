@@ -2,7 +2,7 @@
 set -euo pipefail
 
 readonly STATS="../stats"
-readonly SCOPE_DETAILS="${STATS}/per-as-ixp-dependencies/ark.2022-09-19.per_scope_details.pickle.bz2"
+readonly SCOPE_DETAILS="${STATS}/per-as-ixp-dependencies/ark.2022-09-19.per_scope_details.bin"
 readonly FIGS="../figs/ixp-shared-dependencies/"
 
 if [ ! $# -eq 1 ]; then
@@ -0,0 +1,67 @@
+import argparse
+import logging
+import sys
+
+sys.path.append('../')
+from tools.hegemony import add_filter_arguments, filter_from_args
+from tools.hegemony_aggregates import METRICS, aggregate_entry_name, load_aggregates
+from tools.hegemony_cache import find_entry, read_manifest
+
+INPUT_FILE_SUFFIX = '.hegemony.csv'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Compute the per-IXP and per-AS aggregates used by the IXP table, '
+                    'regionality, and dependency/hegemony distribution scripts in a single '
+                    'pass over a hegemony file.')
+    parser.add_argument('input_file')
+    parser.add_argument('--processes', type=int, default=1, help='parse the hegemony file with this many processes')
+    parser.add_argument('--memory-limit', type=int,
+                        help='stream the hegemony file in batches of at most this many MiB')
+    parser.add_argument('--cache-dir', help='store aggregates here instead of next to the input file')
+    parser.add_argument('--metric', choices=list(METRICS), action='append',
+                        help='only compute this metric (can be repeated, default: all)')
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(
+        format=FORMAT,
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    input_file = args.input_file
+    if not input_file.endswith(INPUT_FILE_SUFFIX):
+        logging.error(f'Expected input file with "{INPUT_FILE_SUFFIX}" file '
+                      f'ending.')
+        sys.exit(1)
+
+    memory_limit = None
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 ** 2
+    metrics = tuple(args.metric or METRICS)
+    hegemony_filter = filter_from_args(args)
+    try:
+        load_aggregates(input_file,
+                        hegemony_filter,
+                        metrics,
+                        args.processes,
+                        memory_limit,
+                        args.cache_dir)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    for name in metrics:
+        entry_dir = find_entry(input_file, args.cache_dir, aggregate_entry_name(name, hegemony_filter))
+        if entry_dir is None:
+            logging.error(f'Failed to store {name} in cache.')
+            sys.exit(1)
+        sizes = ' '.join(f'{field}:{size}' for field, size in read_manifest(entry_dir)['fields'].items())
+        logging.info(f'{name}: {sizes} ({entry_dir})')
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,9 @@
+#!/bin/bash
+set -euo pipefail
+
+readonly STATS="../stats"
+
+for F in "${STATS}"/hegemony/*hegemony.csv; do
+    echo "${F}"
+    python3 ./aggregate-hegemony.py "${F}"
+done
@@ -7,12 +7,21 @@ from collections import defaultdict, namedtuple
 from datetime import datetime
 from math import log2
 from typing import Tuple
-from socket import AF_INET
+from socket import AF_INET, AF_INET6, inet_pton
 
+import numpy as np
 import radix
 from numpy import round
 
 Prefix = namedtuple('Prefix', 'prefix type rir cc status id')
+PrefixIntervals = namedtuple('PrefixIntervals', 'start end length parent info')
+PrefixIntervals.__doc__ = """Prefixes of one address family sorted by (start, length), which is
+the order of a pre-order walk of a radix tree. Addresses are stored
+left-aligned as two uint64 words (arrays of shape (n, 2)), so IPv4 and
+IPv6 prefixes are handled alike. end is the last address of each
+prefix, parent the position of the most specific other prefix that
+covers it (-1 if there is none), and info the data of each prefix
+(list)."""
 
 DSF_DELIMITER = '|'
 DSF_VERSION_LINE_FIELD_COUNT = 7
@@ -20,6 +29,9 @@ DSF_SUMMARY_LINE_FIELD_COUNT = 6
 DSF_RECORD_LINE_MIN_FIELD_COUNT = 8
 DSF_DATE_FMT = '%Y%m%d%z'
 PP_DATE_FMT = '%Y-%m-%d%z'
+WORD_BITS = 64
+MAX_PREFIX_LENGTH = 2 * WORD_BITS
+ALL_ONES = np.uint64(np.iinfo(np.uint64).max)
 
 
 def load_rib(rib_file: str) -> radix.Radix:
@@ -27,6 +39,84 @@ def load_rib(rib_file: str) -> radix.Radix:
         return pickle.load(f)
 
 
+def address_words(packed: bytes, family: int) -> np.ndarray:
+    """Return the addresses in packed (concatenated, in network byte
+    order) as left-aligned (n, 2) uint64 words."""
+    if family == AF_INET:
+        ret = np.zeros((len(packed) // 4, 2), dtype=np.uint64)
+        ret[:, 0] = np.frombuffer(packed, dtype='>u4').astype(np.uint64) << np.uint64(32)
+        return ret
+    return np.frombuffer(packed, dtype='>u8').reshape(-1, 2).astype(np.uint64)
+
+
+def host_masks(length: np.ndarray) -> np.ndarray:
+    """Return the (n, 2) words with the host bits of prefixes of length
+    set."""
+    network_bits = np.stack((np.minimum(length, WORD_BITS), np.clip(length - WORD_BITS, 0, WORD_BITS)), axis=1)
+    # numpy shifts by the word size to 0.
+    return ALL_ONES >> network_bits.astype(np.uint64)
+
+
+def words_less(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a[:, 0] < b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] < b[:, 1]))
+
+
+def merge_counts(columns: list, query_columns: list, right: bool = True) -> np.ndarray:
+    """Return the number of sorted rows (columns, most significant first)
+    that are less than (or equal to, if right) each query row, by
+    merging both."""
+    num_rows = len(columns[0])
+    is_query = np.r_[np.zeros(num_rows, dtype=bool), np.ones(len(query_columns[0]), dtype=bool)]
+    merged = [np.r_[column, query_column] for column, query_column in zip(columns, query_columns)]
+    order = np.lexsort([is_query if right else ~is_query] + merged[::-1])
+    merged_query = is_query[order]
+    ret = np.empty(len(query_columns[0]), dtype=np.int64)
+    ret[order[merged_query] - num_rows] = np.cumsum(~merged_query)[merged_query]
+    return ret
+
+
+def prefix_parents(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Return the parent of each prefix (sorted by (start, length)).
+
+    Prefixes are either nested or disjoint, so the previous prefixes
+    that do not end before a prefix are the ones that cover it, and its
+    parent is the last previous prefix with one cover less."""
+    num_prefixes = len(start)
+    position = np.arange(num_prefixes)
+    sorted_end = end[np.lexsort((end[:, 1], end[:, 0]))]
+    depth = position - merge_counts([sorted_end[:, 0], sorted_end[:, 1]], [start[:, 0], start[:, 1]], right=False)
+    keys = depth * num_prefixes + position
+    order = np.argsort(keys)
+    candidate = np.searchsorted(keys[order], (depth - 1) * num_prefixes + position) - 1
+    return np.where(depth > 0, order[candidate], -1)
+
+
+def prefix_intervals(start: np.ndarray, length: np.ndarray, info: list) -> PrefixIntervals:
+    """Return prefixes (start words, length) with info as
+    PrefixIntervals. Host bits of start are cleared and only the last
+    of equal prefixes is kept, like when adding the prefixes to a radix
+    tree."""
+    masks = host_masks(length)
+    start = start & ~masks
+    # lexsort is stable, so equal prefixes stay in record order.
+    order = np.lexsort((length, start[:, 1], start[:, 0]))
+    start, length = start[order], length[order]
+    last = np.ones(len(length), dtype=bool)
+    last[:-1] = np.any(start[1:] != start[:-1], axis=1) | (length[1:] != length[:-1])
+    order, start, length = order[last], start[last], length[last]
+    end = start | masks[order]
+    return PrefixIntervals(start, end, length, prefix_parents(start, end), [info[idx] for idx in order.tolist()])
+
+
+def rib_prefixes(nodes: list, family: int) -> Tuple[list, np.ndarray, np.ndarray]:
+    """Return the positions of the RIB nodes (radix.RadixNode) of family
+    in nodes, and their start words and lengths."""
+    positions = [idx for idx, node in enumerate(nodes) if node.family == family]
+    start = address_words(b''.join([nodes[idx].packed for idx in positions]), family)
+    length = np.array([nodes[idx].prefixlen for idx in positions], dtype=np.int64)
+    return positions, start, length
+
+
 def parse_version_line(line: str) -> None:
     line_strip = line.strip()
     line_split = line_strip.split(DSF_DELIMITER)
@@ -105,9 +195,17 @@ def parse_record_line(record_line: str) -> Prefix:
     return Prefix(f'{start}/{netmask}', type, registry, cc, status, id)
 
 
-def load_prefix_map(delegated_stats: str) -> Tuple[radix.Radix, radix.Radix]:
-    ipv4 = radix.Radix()
-    ipv6 = radix.Radix()
+def build_prefix_map(records: tuple, family: int) -> PrefixIntervals:
+    """Return the records (packed addresses, prefix lengths, Prefix) of
+    family as PrefixIntervals."""
+    packed, lengths, info = records
+    return prefix_intervals(address_words(b''.join(packed), family), np.array(lengths, dtype=np.int64), info)
+
+
+def load_prefix_map(delegated_stats: str) -> Tuple[PrefixIntervals, PrefixIntervals]:
+    # Packed addresses, prefix lengths, and records.
+    ipv4 = (list(), list(), list())
+    ipv6 = (list(), list(), list())
     ipv4_records = 0
     ipv6_records = 0
     logging.info(f'Delegated stats: {delegated_stats}')
@@ -117,19 +215,22 @@ def load_prefix_map(delegated_stats: str) -> Tuple[radix.Radix, radix.Radix]:
         ipv4_count = parse_summary_line(f.readline())
         ipv6_count = parse_summary_line(f.readline())
         if any([c < 0 for c in (asn_count, ipv4_count, ipv6_count)]):
-            return dict(), dict()
+            return build_prefix_map(ipv4, AF_INET), build_prefix_map(ipv6, AF_INET6)
         for line in f:
             prefix = parse_record_line(line)
             if prefix is None:
                 continue
+            address, length = prefix.prefix.split('/')
             if prefix.type == 'ipv4':
-                n = ipv4.add(prefix.prefix)
-                n.data['info'] = prefix
+                packed, lengths, info = ipv4
+                packed.append(inet_pton(AF_INET, address))
                 ipv4_records += 1
             elif prefix.type == 'ipv6':
-                n = ipv6.add(prefix.prefix)
-                n.data['info'] = prefix
+                packed, lengths, info = ipv6
+                packed.append(inet_pton(AF_INET6, address))
                 ipv6_records += 1
+            lengths.append(int(length))
+            info.append(prefix)
     if ipv4_records != ipv4_count:
         logging.error(f'Number of IPv4 records does not match.')
         logging.error(f'Summary: {ipv4_count}')
@@ -138,24 +239,47 @@ def load_prefix_map(delegated_stats: str) -> Tuple[radix.Radix, radix.Radix]:
         logging.error(f'Number of IPv6 records does not match.')
         logging.error(f'Summary: {ipv6_count}')
         logging.error(f'Records: {ipv6_records}')
-    return ipv4, ipv6
+    return build_prefix_map(ipv4, AF_INET), build_prefix_map(ipv6, AF_INET6)
+
 
+def match_prefixes(start: np.ndarray, length: np.ndarray, prefix_map: PrefixIntervals,
+                   include_covered: bool = False) -> list:
+    """Return the matching prefixes of prefix_map for each RIB prefix
+    (start words, length): the most specific prefix that covers it (like
+    radix.Radix.search_best()) or, if there is none and include_covered
+    is set, all prefixes that it covers (in the order of
+    radix.Radix.search_covered()).
 
-def get_prefix_match(prefix: str, prefix_map: radix.Radix, include_covered: bool = False) -> list:
-    n = prefix_map.search_best(prefix)
-    if n:
-        return [n.data['info']]
+    The RIB prefixes are merged into the sorted prefixes of prefix_map.
+    The last prefix that sorts before a RIB prefix either covers it or
+    has all prefixes that cover it as ancestors, so the most specific
+    one is found by following the parents."""
+    idx = merge_counts([prefix_map.start[:, 0], prefix_map.start[:, 1], prefix_map.length],
+                       [start[:, 0], start[:, 1], length])
+    end = start | host_masks(length)
+    best = idx - 1
+    pending = np.flatnonzero(best >= 0)
+    while len(pending):
+        pending = pending[words_less(prefix_map.end[best[pending]], end[pending])]
+        best[pending] = prefix_map.parent[best[pending]]
+        pending = pending[best[pending] >= 0]
+    ret = [[prefix_map.info[i]] if i >= 0 else list() for i in best.tolist()]
     if not include_covered:
-        return list()
-    covered = prefix_map.search_covered(prefix)
-    if not covered:
-        logging.debug(f'{prefix} is BOGON')
-        return list()
-    prefixes = list()
-    for node in covered:
-        node_prefix = node.data['info']
-        prefixes.append(node_prefix)
-    return prefixes
+        return ret
+    # Without a covering prefix, the covered prefixes are the next ones
+    # that start within the RIB prefix. The radix tree lists them in
+    # post-order.
+    uncovered = np.flatnonzero(best < 0)
+    stop = merge_counts([prefix_map.start[:, 0], prefix_map.start[:, 1], prefix_map.length],
+                        [end[uncovered, 0], end[uncovered, 1], np.full(len(uncovered), MAX_PREFIX_LENGTH)])
+    order = np.lexsort((-prefix_map.length, prefix_map.end[:, 1], prefix_map.end[:, 0]))
+    post_order = np.empty(len(order), dtype=np.int64)
+    post_order[order] = np.arange(len(order))
+    post_order = post_order.tolist()
+    for i, first, last in zip(uncovered.tolist(), idx[uncovered].tolist(), stop.tolist()):
+        ret[i] = [prefix_map.info[j] for j in sorted(range(first, last), key=post_order.__getitem__)]
+    return ret
+
 
 def main() -> None:
     parser = argparse.ArgumentParser()
@@ -183,22 +307,31 @@ def main() -> None:
 
     delegated_stats = args.delegated_stats
     ipv4, ipv6 = load_prefix_map(delegated_stats)
-    if not ipv4:
+    if not ipv4.info:
         sys.exit(1)
 
-    asn_prefixes = defaultdict(lambda: {'cc': set(), 'prefixes': list()})
-    unallocated_prefixes = list()
+    nodes = list()
     for node in rtree.nodes():
         asn = node.data['as'].strip('{}')
         if ',' in asn:
             # AS set -> ignore...
             continue
-        prefix = node.prefix
-        if node.family == AF_INET:
-            prefix_info = get_prefix_match(prefix, ipv4, include_covered)
-        else:
-            prefix_info = get_prefix_match(prefix, ipv6, include_covered)
+        nodes.append((asn, node))
+    # Match the RIB and delegated prefixes of each address family in one
+    # merge instead of searching the tree for each RIB prefix.
+    rib_nodes = [node for _, node in nodes]
+    matches = [None] * len(nodes)
+    for family, prefix_map in ((AF_INET, ipv4), (AF_INET6, ipv6)):
+        positions, start, length = rib_prefixes(rib_nodes, family)
+        for position, prefix_info in zip(positions, match_prefixes(start, length, prefix_map, include_covered)):
+            matches[position] = prefix_info
+
+    asn_prefixes = defaultdict(lambda: {'cc': set(), 'prefixes': list()})
+    unallocated_prefixes = list()
+    for (asn, node), prefix_info in zip(nodes, matches):
         if not prefix_info:
+            if include_covered:
+                logging.debug(f'{node.prefix} is BOGON')
             continue
 
         used_prefixes = list()
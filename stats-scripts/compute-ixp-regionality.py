@@ -2,9 +2,14 @@ import argparse
 import logging
 import os
 import sys
-from collections import defaultdict, namedtuple
+from collections import namedtuple
+
+import numpy as np
 
 sys.path.append('../')
+from tools.hegemony import HegemonyFilter, add_filter_arguments, filter_from_args
+from tools.hegemony_aggregates import load_aggregates
+from tools.interning import NO_ID, Interner, lookup_array, read_asn_country_ids
 from tools.shared_functions import sanitize_dir
 
 INPUT_FILE_SUFFIX = '.hegemony.csv'
@@ -13,18 +18,6 @@ DATA_DELIMITER = ','
 IxpInfo = namedtuple('IxpInfo', 'name name_long cc peers')
 
 
-def read_asn_country_map(asn_cc_map: str) -> dict:
-    ret = dict()
-    with open(asn_cc_map, 'r') as f:
-        f.readline()
-        for line in f:
-            asn, count, cc = line.strip().split(DATA_DELIMITER)
-            if int(count) > 1:
-                cc = '**'
-            ret[asn] = cc
-    return ret
-
-
 def read_ixp_info(ixp_info_file: str) -> dict:
     ret = dict()
     with open(ixp_info_file, 'r') as f:
@@ -41,39 +34,43 @@ def read_ixp_info(ixp_info_file: str) -> dict:
 
 
 def read_hegemony_file(input_file: str,
-                       asn_country: dict,
+                       interner: Interner,
+                       asn_ids: np.ndarray,
+                       cc_ids: np.ndarray,
                        ixp_info: dict,
-                       min_hegemony_threshold: float = 0,
-                       min_peer_threshold: int = 0) -> dict:
-    ret = defaultdict(lambda: {'same': 0, 'other': 0})
-    with open(input_file, 'r') as f:
-        f.readline()
-        for line in f:
-            line_split = line.strip().split(DATA_DELIMITER)
-            scope = line_split[0]
-            asn = line_split[1]
-            hegemony = float(line_split[2])
-            peers = int(line_split[3])
-            if not asn.startswith('ix|') \
-                    or hegemony < min_hegemony_threshold \
-                    or peers < min_peer_threshold \
-                    or not scope.startswith('as|') \
-                    or ';' in asn \
-                    or hegemony > 1:
-                continue
-            ix_id = asn.removeprefix('ix|')
-            if ix_id not in ixp_info:
-                logging.warning(f'Failed to find info for IXP {ix_id}')
-                continue
-            scope = scope.removeprefix('as|')
-            if scope not in asn_country:
-                logging.warning(
-                    f'Failed to find country mapping for AS {scope}')
-                continue
-            if ixp_info[ix_id].cc == asn_country[scope]:
-                ret[ix_id]['same'] += 1
-            else:
-                ret[ix_id]['other'] += 1
+                       hegemony_filter: HegemonyFilter,
+                       memory_limit: int = None,
+                       processes: int = 1) -> dict:
+    """Return a map from ix_id to the number of dependent (scope, IXP)
+    rows where the scope is in the same country as the IXP and where it
+    is not. asn_ids and cc_ids are the interned AS -> country map."""
+    ret = dict()
+    aggregates = load_aggregates(input_file, hegemony_filter, ('ix-scopes',), processes, memory_limit)
+    ix_ids = aggregates['ix-scopes.ix_id']
+    scopes = aggregates['ix-scopes.scope']
+    counts = aggregates['ix-scopes.count']
+    info_ix_ids = interner.intern_array('ix', list(ixp_info.keys()))
+    info_cc_ids = interner.intern_array('cc', [info.cc for info in ixp_info.values()])
+    pair_ix_ids = interner.intern_array('ix', ix_ids)
+    pair_scope_ids = interner.intern_array('asn', scopes)
+    ix_cc = lookup_array(info_ix_ids, info_cc_ids, interner.size('ix'))[pair_ix_ids]
+    scope_cc = lookup_array(asn_ids, cc_ids, interner.size('asn'))[pair_scope_ids]
+    known = (ix_cc != NO_ID) & (scope_cc != NO_ID)
+    for idx in np.flatnonzero(~known).tolist():
+        if ix_cc[idx] == NO_ID:
+            logging.warning(f'Failed to find info for IXP {ix_ids[idx]}')
+        else:
+            logging.warning(
+                f'Failed to find country mapping for AS {scopes[idx]}')
+    same = (ix_cc == scope_cc)[known]
+    counts = counts[known]
+    unique_ix_ids, inverse = np.unique(ix_ids[known], return_inverse=True)
+    same_counts = np.bincount(inverse, weights=np.where(same, counts, 0), minlength=len(unique_ix_ids))
+    total_counts = np.bincount(inverse, weights=counts, minlength=len(unique_ix_ids))
+    for ix_id, same_count, total_count in zip(unique_ix_ids.tolist(),
+                                              same_counts.astype(np.int64).tolist(),
+                                              total_counts.astype(np.int64).tolist()):
+        ret[str(ix_id)] = {'same': same_count, 'other': total_count - same_count}
     return ret
 
 
@@ -83,6 +80,11 @@ def main() -> None:
     parser.add_argument('asn_map_file')
     parser.add_argument('ixp_info_file')
     parser.add_argument('output_dir')
+    parser.add_argument('--interner-file', help='load/store interned ids from/to this file')
+    parser.add_argument('--memory-limit', type=int,
+                        help='stream the hegemony file in batches of at most this many MiB')
+    parser.add_argument('--processes', type=int, default=1, help='parse the hegemony file with this many processes')
+    add_filter_arguments(parser)
     args = parser.parse_args()
 
     FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -92,9 +94,11 @@ def main() -> None:
         datefmt='%Y-%m-%d %H:%M:%S',
     )
 
+    interner = Interner.load(args.interner_file)
+
     asn_file = args.asn_map_file
     logging.info(f'Reading AS -> country map from file: {asn_file}')
-    asn_country = read_asn_country_map(asn_file)
+    asn_ids, cc_ids = read_asn_country_ids(asn_file, interner)
 
     ixp_file = args.ixp_info_file
     logging.info(f'Reading IXP info from file: {ixp_file}')
@@ -106,11 +110,17 @@ def main() -> None:
                       f'ending.')
         sys.exit(1)
 
+    memory_limit = None
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 ** 2
     ixp_scope_region = read_hegemony_file(input_file,
-                                          asn_country,
+                                          interner,
+                                          asn_ids,
+                                          cc_ids,
                                           ixp_info,
-                                          0.1,
-                                          10)
+                                          filter_from_args(args),
+                                          memory_limit,
+                                          args.processes)
 
     output_dir = sanitize_dir(args.output_dir)
     output_file = f'{output_dir}' \
@@ -134,6 +144,9 @@ def main() -> None:
                     curr_ixp_info.name, curr_ixp_info.name_long)
             f.write(f'{DATA_DELIMITER.join(map(str, line))}\n')
 
+    if args.interner_file:
+        interner.save(args.interner_file)
+
 
 if __name__ == '__main__':
     main()
@@ -5,7 +5,12 @@ import sys
 from collections import defaultdict, namedtuple
 from typing import Tuple
 
+import numpy as np
+
 sys.path.append('../')
+from tools.hegemony import HegemonyFilter, add_filter_arguments, filter_from_args
+from tools.hegemony_aggregates import load_aggregates
+from tools.interning import NO_ID, Interner, lookup_array, read_asn_country_ids
 from tools.shared_functions import sanitize_dir
 
 Ixp = namedtuple('Ixp', 'id org_id name name_long cc peers')
@@ -78,40 +83,26 @@ def read_interfaces_file(interfaces_file: str) -> dict:
 
 
 def read_hegemony_file(hegemony_file: str,
-                       min_hegemony_threshold: float,
-                       min_peer_threshold: int) -> dict:
-    ret = defaultdict(set)
+                       interner: Interner,
+                       hegemony_filter: HegemonyFilter,
+                       memory_limit: int = None,
+                       processes: int = 1) -> dict:
+    """Return a map from ix_id to a sorted array of (interned) ASNs that
+    depend on the IXP."""
+    ret = defaultdict(lambda: np.empty(0, dtype=np.int32))
     logging.info(f'Reading hegemony scores from {hegemony_file}')
-    with open(hegemony_file, 'r') as f:
-        f.readline()
-        for line in f:
-            line_split = line.strip().split(DATA_DELIMITER)
-            scope = line_split[0]
-            asn = line_split[1]
-            hegemony = float(line_split[2])
-            nb_peers = int(line_split[3])
-            if (not asn.startswith('ix|')
-                or not scope.startswith('as|')
-                    or hegemony < min_hegemony_threshold
-                    or nb_peers < min_peer_threshold
-                    or 'ip' in line
-                    or ';' in asn
-                    or hegemony > 1):
-                continue
-            ix_id = asn.removeprefix('ix|')
-            ret[ix_id].add(scope.removeprefix('as|'))
-    return ret
-
-
-def read_asn_country_map(asn_cc_map: str) -> dict:
-    ret = dict()
-    with open(asn_cc_map, 'r') as f:
-        f.readline()
-        for line in f:
-            asn, count, cc = line.strip().split(DATA_DELIMITER)
-            if int(count) > 1:
-                cc = '**'
-            ret[asn] = cc
+    aggregates = load_aggregates(hegemony_file, hegemony_filter, ('ix-scopes',), processes, memory_limit)
+    # (ix_id, scope) pairs are already distinct.
+    ix_ids = aggregates['ix-scopes.ix_id']
+    scopes = interner.intern_array('asn', aggregates['ix-scopes.scope'])
+    if len(ix_ids) == 0:
+        return ret
+    order = np.lexsort((scopes, ix_ids))
+    ix_ids = ix_ids[order]
+    scopes = scopes[order]
+    bounds = np.flatnonzero(ix_ids[1:] != ix_ids[:-1]) + 1
+    for ix_id, ix_scopes in zip(ix_ids[np.r_[0, bounds]].tolist(), np.split(scopes, bounds)):
+        ret[str(ix_id)] = ix_scopes
     return ret
 
 
@@ -137,20 +128,16 @@ def count_national_peers(peers: dict) -> Tuple[int, int, int]:
     return national, international, unknown
 
 
-def map_national(ixp_cc: str,
-                 dependencies: set,
-                 asn_cc: dict) -> Tuple[int, int, int]:
-    national = 0
-    international = 0
-    unknown = 0
-    for asn in dependencies:
-        if asn not in asn_cc:
-            unknown += 1
-            continue
-        if asn_cc[asn] == ixp_cc:
-            national += 1
-        else:
-            international += 1
+def map_national(ixp_cc: int,
+                 dependencies: np.ndarray,
+                 asn_cc: np.ndarray) -> Tuple[int, int, int]:
+    """Count how many of the (interned) dependencies are located in the
+    same country as the IXP, in a different country, or have no country
+    mapping."""
+    dependency_ccs = asn_cc[dependencies]
+    unknown = int(np.count_nonzero(dependency_ccs == NO_ID))
+    national = int(np.count_nonzero(dependency_ccs == ixp_cc))
+    international = len(dependencies) - national - unknown
     return national, international, unknown
 
 
@@ -170,6 +157,11 @@ def main() -> None:
     parser.add_argument('hegemony_file')
     parser.add_argument('asn_map_file')
     parser.add_argument('output_dir')
+    parser.add_argument('--interner-file', help='load/store interned ids from/to this file')
+    parser.add_argument('--memory-limit', type=int,
+                        help='stream the hegemony file in batches of at most this many MiB')
+    parser.add_argument('--processes', type=int, default=1, help='parse the hegemony file with this many processes')
+    add_filter_arguments(parser)
     args = parser.parse_args()
 
     FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -193,11 +185,19 @@ def main() -> None:
         os.path.basename(hegemony_file)[:-len(HEGEMONY_FILE_SUFFIX)]
     output_file = f'{output_dir}{output_file_prefix}{OUTPUT_FILE_SUFFIX}'
 
+    interner = Interner.load(args.interner_file)
     ixp = read_ixp_file(ixp_file)
     ixp_peers = read_ixp_peers_file(ixp_peers_file)
+    ixp_peer_ids = defaultdict(lambda: np.empty(0, dtype=np.int32))
+    for ix_id, peers in ixp_peers.items():
+        ixp_peer_ids[ix_id] = np.unique(interner.intern_array('asn', list(peers.keys())))
     interfaces = read_interfaces_file(interfaces_file)
-    hegemony = read_hegemony_file(hegemony_file, 0.1, 10)
-    asn_cc = read_asn_country_map(asn_map_file)
+    memory_limit = None
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 ** 2
+    hegemony = read_hegemony_file(hegemony_file, interner, filter_from_args(args), memory_limit, args.processes)
+    asn_ids, cc_ids = read_asn_country_ids(asn_map_file, interner)
+    asn_cc = lookup_array(asn_ids, cc_ids, interner.size('asn'))
     decix_lg_asns = read_lg_member_asns(DECIX_LG)
     ixbr_lg_asns = read_lg_member_asns(IXBR_LG)
     linx_lg_asns = read_lg_member_asns(LINX_LG)
@@ -216,9 +216,10 @@ def main() -> None:
         f.write(DATA_DELIMITER.join(headers) + '\n')
         for ix_id, ixp_info in ixp.items():
             peers = count_national_peers(ixp_peers[ix_id])
-            deps = map_national(ixp_info.cc, hegemony[ix_id], asn_cc)
-            dependent_peers = set(ixp_peers[ix_id].keys()).intersection(hegemony[ix_id])
-            dep_peers = map_national(ixp_info.cc, dependent_peers, asn_cc)
+            ixp_cc = interner.intern('cc', ixp_info.cc)
+            deps = map_national(ixp_cc, hegemony[ix_id], asn_cc)
+            dependent_peers = np.intersect1d(ixp_peer_ids[ix_id], hegemony[ix_id], assume_unique=True)
+            dep_peers = map_national(ixp_cc, dependent_peers, asn_cc)
 
             ixp_peers_count = sum(peers)
             if ixp_peers_count != ixp_info.peers:
@@ -284,6 +285,9 @@ def main() -> None:
                     dependent_peers_national_r)
             f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
 
+    if args.interner_file:
+        interner.save(args.interner_file)
+
 
 if __name__ == '__main__':
     main()
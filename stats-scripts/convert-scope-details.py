@@ -0,0 +1,44 @@
+import argparse
+import bz2
+import logging
+import pickle
+import sys
+
+sys.path.append('../')
+from tools.scope_details import convert_pickle_details, write_scope_details
+
+INPUT_FILE_SUFFIX = '.per_scope_details.pickle.bz2'
+OUTPUT_FILE_SUFFIX = '.per_scope_details.bin'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Convert a per-scope details file written by earlier versions of '
+                    'extract-per-as-ixp-dependencies.py to the indexed format.')
+    parser.add_argument('input_file')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(
+        format=FORMAT,
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    input_file = args.input_file
+    if not input_file.endswith(INPUT_FILE_SUFFIX):
+        logging.error(f'Expected input file with "{INPUT_FILE_SUFFIX}" file ending.')
+        sys.exit(1)
+    output_file = f'{input_file[:-len(INPUT_FILE_SUFFIX)]}{OUTPUT_FILE_SUFFIX}'
+
+    logging.info(f'Reading details from: {input_file}')
+    with bz2.open(input_file, 'rb') as f:
+        details = pickle.load(f)
+    details, participant_sets = convert_pickle_details(details)
+    logging.info(f'Writing {len(participant_sets.offsets) - 1} participant sets to: {output_file}')
+    write_scope_details(output_file, details, participant_sets)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
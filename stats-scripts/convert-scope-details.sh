@@ -0,0 +1,9 @@
+#!/bin/bash
+set -euo pipefail
+
+readonly STATS="../stats"
+
+for F in "${STATS}"/per-as-ixp-dependencies/*.per_scope_details.pickle.bz2; do
+    echo "${F}"
+    python3 ./convert-scope-details.py "${F}"
+done
@@ -3,6 +3,9 @@ set -euo pipefail
 
 readonly STATS="../stats"
 readonly ASN_MAP="${STATS}/nro/asn-cc-best.csv"
+readonly STATE_DIR="${STATS}/per-as-ixp-dependencies/state"
+
+mkdir -p "${STATE_DIR}"
 
 for F in "${STATS}"/hegemony/*hegemony.csv; do
     BASE=$(basename -s .hegemony.csv "${F}")
@@ -13,10 +16,19 @@ for F in "${STATS}"/hegemony/*hegemony.csv; do
         echo "No per-scope interfaces found. Skipping."
         continue
     fi
+    # Snapshots of the same platform only differ in a few scopes, so each
+    # run starts from the state of the previous one.
+    STATE="${STATE_DIR}/${BASE%%.*}.state.npz"
+    PREVIOUS_STATE=()
+    if [ -f "${STATE}" ]; then
+        PREVIOUS_STATE=(--previous-state "${STATE}")
+    fi
     python3 ./extract-per-as-ixp-dependencies.py \
         "${F}" \
         "${PER_SCOPE}" \
         "${ASN_MAP}" \
-        "${STATS}/per-as-ixp-dependencies/"
+        "${STATS}/per-as-ixp-dependencies/" \
+        ${PREVIOUS_STATE[@]+"${PREVIOUS_STATE[@]}"} \
+        --save-state "${STATE}"
 done
 
@@ -5,6 +5,9 @@ import pickle
 import sys
 from collections import defaultdict
 
+sys.path.append('../')
+from tools.interning import NO_ID, Interner, lookup_array, read_asn_country_ids
+
 DATA_DELIMITER = ','
 
 
@@ -26,18 +29,6 @@ def read_netixlan_file(netixlan_file: str) -> list:
     return data
 
 
-def read_asn_country_map(asn_cc_map: str) -> dict:
-    ret = dict()
-    with open(asn_cc_map, 'r') as f:
-        f.readline()
-        for line in f:
-            asn, count, cc = line.strip().split(DATA_DELIMITER)
-            if int(count) > 1:
-                cc = '**'
-            ret[int(asn)] = cc
-    return ret
-
-
 def main() -> None:
     desc = """Convert data from raw PeeringDB dumps to CSV.
               The CSV contains one row per IXP, with information about the
@@ -51,6 +42,7 @@ def main() -> None:
     parser.add_argument('netixlan_file')
     parser.add_argument('asn_map_file')
     parser.add_argument('output_file')
+    parser.add_argument('--interner-file', help='load/store interned ids from/to this file')
     args = parser.parse_args()
 
     FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -65,9 +57,10 @@ def main() -> None:
     asn_map_file = args.asn_map_file
     output_file = args.output_file
 
+    interner = Interner.load(args.interner_file)
     ix = read_ixp_file(ixp_file)
     netixlan = read_netixlan_file(netixlan_file)
-    asn_cc = read_asn_country_map(asn_map_file)
+    asn_ids, cc_ids = read_asn_country_ids(asn_map_file, interner)
 
     # Map ix_id -> IPv4 peers.
     # Peers are represented by AS sets.
@@ -77,6 +70,9 @@ def main() -> None:
         asn = entry['asn']
         if entry['ipaddr4']:
             ix_peers[ix_id].add(asn)
+    ix_peers = {ix_id: sorted(peer_asns) for ix_id, peer_asns in ix_peers.items()}
+    ix_peer_ids = {ix_id: interner.intern_array('asn', peer_asns) for ix_id, peer_asns in ix_peers.items()}
+    asn_cc = lookup_array(asn_ids, cc_ids, interner.size('asn'))
 
     failed_cc_mappings = 0
     logging.info(f'Writing to output file {output_file}')
@@ -87,9 +83,9 @@ def main() -> None:
         for ix_id, peer_asns in ix_peers.items():
             org_id = ix[ix_id]['org_id']
             ix_cc = ix[ix_id]['country']
-            for asn in sorted(peer_asns):
-                if asn in asn_cc:
-                    peer_cc = asn_cc[asn]
+            for asn, peer_cc_id in zip(peer_asns, asn_cc[ix_peer_ids[ix_id]].tolist()):
+                if peer_cc_id != NO_ID:
+                    peer_cc = interner.value('cc', peer_cc_id)
                 else:
                     logging.warning(f'Failed to find country mapping for ASN '
                                     f'{asn}')
@@ -105,6 +101,9 @@ def main() -> None:
                 f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
     logging.info(f'Country mapping of {failed_cc_mappings} ASNs failed.')
 
+    if args.interner_file:
+        interner.save(args.interner_file)
+
 
 if __name__ == '__main__':
     main()
@@ -5,6 +5,9 @@ import sys
 from collections import defaultdict
 from typing import Tuple
 
+import numpy as np
+
+from tools.interning import Interner
 from tools.shared_functions import sanitize_dir
 
 sys.path.append('../')
@@ -19,10 +22,24 @@ DECIX_LG = '../stats/peeringdb/de-cix-fra-combined-member-asns.csv'
 IXBR_LG = '../stats/peeringdb/ix-br-sp-combined-member-asns.csv'
 
 
-def read_ixp_peers_file(input_file: str) -> Tuple[dict, dict, dict]:
+def group_ccs(ix_ids: list, ccs: list, interner: Interner) -> dict:
+    """Return a map from ix_id to the sorted array of distinct (interned)
+    country codes."""
+    ret = defaultdict(lambda: np.empty(0, dtype=np.int32))
+    if not ix_ids:
+        return ret
+    pairs = np.unique(np.column_stack((ix_ids, interner.intern_array('cc', ccs))), axis=0)
+    bounds = np.flatnonzero(np.diff(pairs[:, 0])) + 1
+    for group in np.split(pairs, bounds):
+        ret[int(group[0, 0])] = group[:, 1].astype(np.int32)
+    return ret
+
+
+def read_ixp_peers_file(input_file: str, interner: Interner) -> Tuple[dict, dict, dict]:
     ixp_peer_count = defaultdict(int)
     ixp_cc = dict()
-    ixp_peer_cc = defaultdict(set)
+    peer_ix_ids = list()
+    peer_ccs = list()
     with open(input_file, 'r') as f:
         f.readline()
         for line in f:
@@ -35,14 +52,18 @@ def read_ixp_peers_file(input_file: str) -> Tuple[dict, dict, dict]:
             peer_cc = line_split[4]
             if peer_cc == 'None' or peer_cc == CC_INTERNATIONAL:
                 continue
-            ixp_peer_cc[ix_id].add(peer_cc)
+            peer_ix_ids.append(ix_id)
+            peer_ccs.append(peer_cc)
+    ixp_peer_cc = group_ccs(peer_ix_ids, peer_ccs, interner)
     return ixp_peer_count, ixp_cc, ixp_peer_cc
 
 
-def read_per_as_ixp_dependencies_file(input_file: str) -> Tuple[dict, dict, dict]:
+def read_per_as_ixp_dependencies_file(input_file: str, interner: Interner) -> Tuple[dict, dict]:
+    """Return the number of dependent scopes per IXP and per IXP a pair
+    of aligned arrays with the (interned) countries of the dependent
+    scopes and the number of scopes per country."""
     ix_dep_count = dict()
-    ix_dep_cc = defaultdict(set)
-    ix_cc_dep = defaultdict(dict)
+    ix_cc_dep = defaultdict(lambda: ([], []))
     with open(input_file, 'r') as f:
         f.readline()
         for line in f:
@@ -56,12 +77,15 @@ def read_per_as_ixp_dependencies_file(input_file: str) -> Tuple[dict, dict, dict
             if cc == 'overview':
                 ix_dep_count[ix_id] = dependencies
                 continue
-            ix_dep_cc[ix_id].add(cc)
-            ix_cc_dep[ix_id][cc] = dependencies
-    return ix_dep_count, ix_dep_cc, ix_cc_dep
+            ix_cc_dep[ix_id][0].append(cc)
+            ix_cc_dep[ix_id][1].append(dependencies)
+    ret = dict()
+    for ix_id, (ccs, dependencies) in ix_cc_dep.items():
+        ret[ix_id] = (interner.intern_array('cc', ccs), np.array(dependencies, dtype=np.int64))
+    return ix_dep_count, ret
 
 
-def read_lg_member_asns(input_file: str) -> Tuple[int, set]:
+def read_lg_member_asns(input_file: str, interner: Interner) -> Tuple[int, np.ndarray]:
     peer_count = 0
     peer_cc = set()
     with open(input_file, 'r') as f:
@@ -71,7 +95,7 @@ def read_lg_member_asns(input_file: str) -> Tuple[int, set]:
             peer_cc.add(line.strip().split(DATA_DELIMITER)[1])
     if CC_INTERNATIONAL in peer_cc:
         peer_cc.remove(CC_INTERNATIONAL)
-    return peer_count, peer_cc
+    return peer_count, np.sort(interner.intern_array('cc', list(peer_cc)))
 
 
 def main() -> None:
@@ -79,6 +103,7 @@ def main() -> None:
     parser.add_argument('ixp_peers_file')
     parser.add_argument('per_as_ixp_dependencies_file')
     parser.add_argument('output_dir')
+    parser.add_argument('--interner-file', help='load/store interned ids from/to this file')
     args = parser.parse_args()
 
     FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -91,8 +116,9 @@ def main() -> None:
     ixp_peers_file = args.ixp_peers_file
     per_as_dependencies_file = args.per_as_ixp_dependencies_file
 
-    lg_asns = {31: read_lg_member_asns(DECIX_LG),
-               171: read_lg_member_asns(IXBR_LG)}
+    interner = Interner.load(args.interner_file)
+    lg_asns = {31: read_lg_member_asns(DECIX_LG, interner),
+               171: read_lg_member_asns(IXBR_LG, interner)}
 
     output_dir = sanitize_dir(args.output_dir)
     output_file_prefix = \
@@ -100,9 +126,9 @@ def main() -> None:
     output_file = f'{output_dir}{output_file_prefix}{OUTPUT_FILE_SUFFIX}'
 
     ixp_peer_count, ixp_cc, ixp_peer_countries = \
-        read_ixp_peers_file(ixp_peers_file)
-    ixp_dep_count, ixp_dep_countries, ixp_countries_dep = \
-        read_per_as_ixp_dependencies_file(per_as_dependencies_file)
+        read_ixp_peers_file(ixp_peers_file, interner)
+    ixp_dep_count, ixp_countries_dep = \
+        read_per_as_ixp_dependencies_file(per_as_dependencies_file, interner)
 
     with open(output_file, 'w') as f:
         headers = ('ix_id', 'cc', 'num_peers', 'peer_countries', 'num_deps', 'num_deps_dep_no_peer',
@@ -125,19 +151,20 @@ def main() -> None:
             dep_no_peer = 0
             if ix_id in ixp_dep_count:
                 num_deps = ixp_dep_count[ix_id]
-                dep_cc = ixp_dep_countries[ix_id]
+                dep_cc, cc_deps = ixp_countries_dep.get(ix_id, (np.empty(0, dtype=np.int32), np.empty(0)))
                 dependency_countries = len(dep_cc)
-                both = len(peer_cc.intersection(dep_cc))
-                peer_no_dep = len(peer_cc - dep_cc)
-                dep_no_peer_set = dep_cc - peer_cc
-                dep_no_peer = len(dep_no_peer_set)
-                for cc in dep_no_peer_set:
-                    if cc in ixp_countries_dep[ix_id]:
-                        num_deps_dep_no_peer += ixp_countries_dep[ix_id][cc]
+                both = int(np.count_nonzero(np.isin(peer_cc, dep_cc)))
+                peer_no_dep = len(peer_cc) - both
+                dep_no_peer_mask = ~np.isin(dep_cc, peer_cc)
+                dep_no_peer = int(np.count_nonzero(dep_no_peer_mask))
+                num_deps_dep_no_peer = int(cc_deps[dep_no_peer_mask].sum())
             line = (ix_id, ix_cc, num_peers, peer_countries, num_deps, num_deps_dep_no_peer,
                     dependency_countries, both, peer_no_dep, dep_no_peer)
             f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
 
+    if args.interner_file:
+        interner.save(args.interner_file)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,72 @@
+import argparse
+import logging
+import sys
+
+sys.path.append('../')
+from tools.hegemony import DATA_DELIMITER, KIND_IX, KIND_IX_AS, HegemonyColumns, format_dependency, format_scope
+from tools.hegemony_index import INDEX_ORDERS, dependency_key, load_index
+
+INPUT_FILE_SUFFIX = '.hegemony.csv'
+
+
+def write_rows(hegemony: HegemonyColumns) -> None:
+    for scope, kind, dep_id, member, hegemony_value, peers in zip(hegemony.scope.tolist(),
+                                                                  hegemony.kind.tolist(),
+                                                                  hegemony.dep_id.tolist(),
+                                                                  hegemony.member.tolist(),
+                                                                  hegemony.hegemony.tolist(),
+                                                                  hegemony.nb_peers.tolist()):
+        line = (format_scope(scope), format_dependency(kind, dep_id, member, hegemony.ips), hegemony_value, peers)
+        sys.stdout.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Build indexes of a hegemony file sorted by scope and by dependency, so that the '
+                    'rows of a single scope or IXP can be read without scanning the file. Optionally '
+                    'print these rows.')
+    parser.add_argument('input_file')
+    parser.add_argument('--cache-dir', help='store the indexes here instead of next to the input file')
+    parser.add_argument('--memory-limit', type=int,
+                        help='sort the rows in batches of at most this many MiB')
+    parser.add_argument('--scope', type=int, action='append', default=list(),
+                        help='print the dependencies of this scope (can be repeated)')
+    parser.add_argument('--ixp', type=int, action='append', default=list(),
+                        help='print the dependencies on this IXP (can be repeated)')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(
+        format=FORMAT,
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    input_file = args.input_file
+    if not input_file.endswith(INPUT_FILE_SUFFIX):
+        logging.error(f'Expected input file with "{INPUT_FILE_SUFFIX}" file '
+                      f'ending.')
+        sys.exit(1)
+
+    memory_limit = None
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 ** 2
+    indexes = dict()
+    for order in INDEX_ORDERS:
+        indexes[order] = load_index(input_file, order, memory_limit, args.cache_dir)
+        logging.info(f'{order} index: {len(indexes[order])} keys')
+
+    if not args.scope and not args.ixp:
+        return
+    headers = ('scope', 'asn', 'hege', 'nb_peers')
+    sys.stdout.write(DATA_DELIMITER.join(headers) + '\n')
+    for scope in args.scope:
+        write_rows(indexes['scope'].lookup(scope))
+    for ix_id in args.ixp:
+        write_rows(indexes['dependency'].lookup(dependency_key(KIND_IX, ix_id)))
+        write_rows(indexes['dependency'].lookup(dependency_key(KIND_IX_AS, ix_id)))
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
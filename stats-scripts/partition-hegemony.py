@@ -0,0 +1,49 @@
+import argparse
+import json
+import logging
+import sys
+
+sys.path.append('../')
+from tools.hegemony import KIND_NAMES, PARTITION_ENTRY, PARTITION_NAMES, load_partitions
+from tools.hegemony_cache import find_entry, read_manifest
+
+INPUT_FILE_SUFFIX = '.hegemony.csv'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Split a hegemony file into one partition per dependency kind, so that '
+                    'later scripts only read the kinds they need.')
+    parser.add_argument('input_file')
+    parser.add_argument('--cache-dir', help='store partitions here instead of next to the input file')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(
+        format=FORMAT,
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    input_file = args.input_file
+    if not input_file.endswith(INPUT_FILE_SUFFIX):
+        logging.error(f'Expected input file with "{INPUT_FILE_SUFFIX}" file '
+                      f'ending.')
+        sys.exit(1)
+
+    load_partitions(input_file, tuple(PARTITION_NAMES), cache_dir=args.cache_dir)
+    entry_dir = find_entry(input_file, args.cache_dir, PARTITION_ENTRY)
+    if entry_dir is None:
+        logging.error('Failed to store partitions in cache.')
+        sys.exit(1)
+    logging.info(f'Partitions stored in {entry_dir}')
+    manifest = read_manifest(entry_dir)
+    for name, partition in manifest['partitions'].items():
+        logging.info(f'{name} ({KIND_NAMES[partition["kind"]]}): {partition["rows"]} rows, '
+                     f'{partition["dependencies"]} dependencies')
+    logging.debug(json.dumps(manifest))
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,89 @@
+import argparse
+import logging
+import sys
+
+sys.path.append('../')
+from tools.ixp_dependencies import CATEGORY_MIXED, CATEGORY_MULTIPLE, CATEGORY_NAMES, CATEGORY_SINGLE
+from tools.member_index import MemberIndex, load_member_index
+
+INPUT_FILE_SUFFIX = '.per_member_dependencies.npz'
+DATA_DELIMITER = ','
+MEMBER_CATEGORIES = (CATEGORY_SINGLE, CATEGORY_MULTIPLE, CATEGORY_MIXED)
+
+
+def write_members(index: MemberIndex, members: list) -> None:
+    counts = [index.counts(category) for category in MEMBER_CATEGORIES]
+    for idx in members:
+        line = (index.ix_id[idx], index.asn[idx], index.offsets[idx + 1] - index.offsets[idx],
+                *(category_counts[idx] for category_counts in counts))
+        sys.stdout.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+
+
+def write_scopes(index: MemberIndex, members: list) -> None:
+    for idx in members:
+        scopes, categories = index.scopes(idx)
+        for scope, category in zip(scopes.tolist(), categories.tolist()):
+            line = (index.ix_id[idx], index.asn[idx], scope, CATEGORY_NAMES[category])
+            sys.stdout.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Look up the scopes that depend on IXP members in the output of '
+                    'extract-per-as-ixp-dependencies.py.')
+    parser.add_argument('input_file')
+    parser.add_argument('--member', type=int, nargs=2, metavar=('IX_ID', 'ASN'), action='append', default=list(),
+                        help='print the member ASN at IXP IX_ID (can be repeated)')
+    parser.add_argument('--asn', type=int, action='append', default=list(),
+                        help='print this ASN at all IXPs it is a member of (can be repeated)')
+    parser.add_argument('--top', type=int, help='print the members with the most dependent scopes')
+    parser.add_argument('--category', choices=[CATEGORY_NAMES[category] for category in MEMBER_CATEGORIES],
+                        help='only count dependencies of this category for --top')
+    parser.add_argument('--list-scopes', action='store_true',
+                        help='print the dependent scopes of the members instead of their counts')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(
+        format=FORMAT,
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    input_file = args.input_file
+    if not input_file.endswith(INPUT_FILE_SUFFIX):
+        logging.error(f'Expected input file with "{INPUT_FILE_SUFFIX}" file ending.')
+        sys.exit(1)
+
+    index = load_member_index(input_file)
+    members = list()
+    for ix_id, asn in args.member:
+        idx = index.member(ix_id, asn)
+        if idx is None:
+            logging.warning(f'No dependent scopes for member AS{asn} at IXP {ix_id}')
+            continue
+        members.append(idx)
+    for asn in args.asn:
+        asn_members = index.asn_members(asn).tolist()
+        if not asn_members:
+            logging.warning(f'No dependent scopes for AS{asn} at any IXP')
+        members.extend(asn_members)
+    if args.top:
+        category = None
+        if args.category:
+            category = CATEGORY_NAMES.index(args.category)
+        members.extend(index.top_members(args.top, category).tolist())
+
+    if args.list_scopes:
+        headers = ('ix_id', 'asn', 'scope', 'category')
+        sys.stdout.write(DATA_DELIMITER.join(headers) + '\n')
+        write_scopes(index, members)
+    else:
+        headers = ('ix_id', 'asn', 'scopes') + tuple(CATEGORY_NAMES[category] for category in MEMBER_CATEGORIES)
+        sys.stdout.write(DATA_DELIMITER.join(headers) + '\n')
+        write_members(index, members)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
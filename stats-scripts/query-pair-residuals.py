@@ -0,0 +1,89 @@
+import argparse
+import logging
+import sys
+
+import numpy as np
+
+sys.path.append('../')
+from tools.ixp_dependencies import CATEGORY_NAMES, NO_CATEGORY
+from tools.residual_index import SUMMARY_DTYPE, ResidualIndex, load_residual_index
+
+INPUT_FILE_SUFFIX = '.per_pair_residuals.npz'
+DATA_DELIMITER = ','
+
+
+def write_summaries(index: ResidualIndex, ixps: np.ndarray) -> None:
+    sys.stdout.write(DATA_DELIMITER.join(SUMMARY_DTYPE.names) + '\n')
+    for row in index.summary[ixps].tolist():
+        sys.stdout.write(DATA_DELIMITER.join(f'{value:.6g}' if isinstance(value, float) else str(value)
+                                             for value in row) + '\n')
+
+
+def write_pairs(index: ResidualIndex, positions: np.ndarray) -> None:
+    headers = ('ix_id', 'scope', 'category', 'general_residual', 'interface_residual')
+    sys.stdout.write(DATA_DELIMITER.join(headers) + '\n')
+    ix_ids = np.repeat(index.ix_id, np.diff(index.offsets))
+    for idx in positions.tolist():
+        category = index.category[idx]
+        line = (ix_ids[idx],
+                index.scope[idx],
+                'none' if category == NO_CATEGORY else CATEGORY_NAMES[category],
+                index.general[idx],
+                index.interface[idx])
+        sys.stdout.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Print the residuals of the decomposition of the general IXP dependencies in the output '
+                    'of extract-per-as-ixp-dependencies.py, summarized per IXP or per (ix_id, scope) pair.')
+    parser.add_argument('input_file')
+    parser.add_argument('--ix', type=int, action='append', default=list(),
+                        help='only print this IXP (can be repeated)')
+    parser.add_argument('--sort', choices=SUMMARY_DTYPE.names[1:],
+                        help='sort the IXP summaries by this field (descending)')
+    parser.add_argument('--top', type=int, help='only print this many IXP summaries')
+    parser.add_argument('--pairs', action='store_true', help='print the pairs instead of the IXP summaries')
+    parser.add_argument('--min-residual', type=float,
+                        help='only print pairs with an absolute residual of at least this value')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(
+        format=FORMAT,
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    input_file = args.input_file
+    if not input_file.endswith(INPUT_FILE_SUFFIX):
+        logging.error(f'Expected input file with "{INPUT_FILE_SUFFIX}" file ending.')
+        sys.exit(1)
+
+    index = load_residual_index(input_file)
+    ixps = np.arange(len(index.ix_id))
+    if args.ix:
+        ixps = np.flatnonzero(np.isin(index.ix_id, args.ix))
+        for ix_id in sorted(set(args.ix) - set(index.ix_id[ixps].tolist())):
+            logging.warning(f'No pairs for IXP {ix_id}')
+
+    if args.pairs or args.min_residual is not None:
+        positions = np.concatenate([np.empty(0, dtype=np.int64)]
+                                   + [np.arange(index.offsets[ix], index.offsets[ix + 1]) for ix in ixps.tolist()])
+        if args.min_residual is not None:
+            positions = index.outliers(args.min_residual, positions)
+        write_pairs(index, positions)
+        return
+
+    if args.sort:
+        # NaNs (IXPs without residuals) last.
+        values = index.summary[args.sort][ixps]
+        ixps = ixps[np.lexsort((index.summary['ix_id'][ixps], -np.nan_to_num(values, nan=-np.inf)))]
+    if args.top:
+        ixps = ixps[:args.top]
+    write_summaries(index, ixps)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,112 @@
+import argparse
+import logging
+import sys
+
+import numpy as np
+
+sys.path.append('../')
+from tools.hegemony import GLOBAL_SCOPE
+from tools.interning import Interner
+from tools.ixp_dependencies import load_tables, merge_tables, summarize_tables, write_dependencies
+from tools.shared_functions import sanitize_dir
+
+INPUT_FILE_SUFFIX = '.hegemony.csv'
+OUTPUT_FILE_SUFFIX = '.per_as_ixp_dependencies.csv'
+DETAIL_OUTPUT_FILE_SUFFIX = '.per_scope_details.bin'
+MEMBER_OUTPUT_FILE_SUFFIX = '.per_member_dependencies.npz'
+RESIDUAL_OUTPUT_FILE_SUFFIX = '.per_pair_residuals.npz'
+# Scopes are 32-bit ASNs.
+MAX_SCOPE = 2 ** 32 - 1
+
+
+def check_scope_ranges(scope_ranges: list, include_global: bool) -> list:
+    """Return a description of each problem with the scope ranges of the
+    partial results (None if a partial result covers all scopes), i.e.,
+    scopes that are in no or in more than one partial result."""
+    if None in scope_ranges:
+        if len(scope_ranges) > 1:
+            return ['a partial result of all scopes can not be combined with others']
+        return list()
+    errors = list()
+    # Last scope covered by the ranges so far.
+    covered = (GLOBAL_SCOPE if include_global else 0) - 1
+    previous_last = None
+    for first, last in sorted(scope_ranges):
+        if previous_last is not None and first <= previous_last:
+            errors.append(f'scopes {first} to {min(last, previous_last)} are in more than one partial result')
+        if first > covered + 1:
+            errors.append(f'scopes {covered + 1} to {first - 1} are in no partial result')
+        covered = max(covered, last)
+        previous_last = covered
+    if covered < MAX_SCOPE:
+        errors.append(f'scopes {covered + 1} to {MAX_SCOPE} are in no partial result')
+    return errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Combine partial results of extract-per-as-ixp-dependencies.py --partial (e.g., for '
+                    'different scope ranges) into the final output.')
+    parser.add_argument('output_dir')
+    parser.add_argument('partial_files', nargs='+')
+    parser.add_argument('--interner-file', help='load/store interned ids from/to this file')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    logging.basicConfig(
+        format=FORMAT,
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    interner = Interner.load(args.interner_file)
+
+    tables = list()
+    scope_ranges = list()
+    source = None
+    hegemony_filter = None
+    for partial_file in args.partial_files:
+        logging.info(f'Reading partial result: {partial_file}')
+        partial_tables, metadata = load_tables(partial_file, interner)
+        if source is None:
+            source = metadata['source']
+            hegemony_filter = metadata['filter']
+        if metadata['source'] != source or metadata['filter'] != hegemony_filter:
+            logging.error(f'Partial result {partial_file} is for {metadata["source"]} with filter '
+                          f'{metadata["filter"]}, expected {source} with filter {hegemony_filter}')
+            sys.exit(1)
+        tables.append(partial_tables)
+        scope_range = metadata['scope_range']
+        scope_ranges.append(tuple(scope_range) if scope_range is not None else None)
+    # Without all scopes, the output would silently lack the missing ones.
+    errors = check_scope_ranges(scope_ranges, hegemony_filter['include_global'])
+    if errors:
+        for error in errors:
+            logging.error(f'Partial results do not cover all scopes exactly once: {error}')
+        sys.exit(1)
+    merged = merge_tables(tables)
+
+    # Pairs are identified by their first row, so pairs that are in more
+    # than one partial result would be counted twice.
+    num_duplicates = len(merged.pair_first) - len(np.unique(merged.pair_first))
+    if num_duplicates > 0:
+        logging.error(f'Partial results overlap: {num_duplicates} (ix_id, scope) pairs appear more than once')
+        sys.exit(1)
+    logging.info(f'Merged {len(merged.pair_first)} (ix_id, scope) pairs from {len(tables)} partial results')
+
+    output_dir = sanitize_dir(args.output_dir)
+    output_file = f'{output_dir}{source[:-len(INPUT_FILE_SUFFIX)]}{OUTPUT_FILE_SUFFIX}'
+    detail_output_file = f'{output_dir}{source[:-len(INPUT_FILE_SUFFIX)]}{DETAIL_OUTPUT_FILE_SUFFIX}'
+    member_output_file = f'{output_dir}{source[:-len(INPUT_FILE_SUFFIX)]}{MEMBER_OUTPUT_FILE_SUFFIX}'
+    residual_output_file = f'{output_dir}{source[:-len(INPUT_FILE_SUFFIX)]}{RESIDUAL_OUTPUT_FILE_SUFFIX}'
+    ixp_dependencies, ixp_overview, ixp_details = summarize_tables(merged)
+    write_dependencies(output_file, detail_output_file, member_output_file, residual_output_file,
+                       ixp_dependencies, ixp_overview, ixp_details, interner)
+
+    if args.interner_file:
+        interner.save(args.interner_file)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
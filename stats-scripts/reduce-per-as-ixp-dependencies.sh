@@ -0,0 +1,39 @@
+#!/bin/bash
+set -euo pipefail
+
+readonly STATS="../stats"
+readonly ASN_MAP="${STATS}/nro/asn-cc-best.csv"
+readonly PARTIALS="${STATS}/per-as-ixp-dependencies/partial/"
+# Scope ranges that are processed as separate (parallel) map steps. On
+# multiple machines, run one extract-per-as-ixp-dependencies.py --partial
+# per range on each machine and copy the partial results to one place.
+readonly SCOPE_RANGES=("0 9999" "10000 49999" "50000 199999" "200000 4294967295")
+
+for F in "${STATS}"/hegemony/*hegemony.csv; do
+    BASE=$(basename -s .hegemony.csv "${F}")
+    PER_SCOPE="${STATS}/per-scope-interfaces/${BASE}.per_scope_interfaces.csv.bz2"
+    echo "${F}"
+    echo "${PER_SCOPE}"
+    if [ ! -f "${PER_SCOPE}" ]; then
+        echo "No per-scope interfaces found. Skipping."
+        continue
+    fi
+    PIDS=()
+    for RANGE in "${SCOPE_RANGES[@]}"; do
+        # shellcheck disable=SC2086
+        python3 ./extract-per-as-ixp-dependencies.py \
+            "${F}" \
+            "${PER_SCOPE}" \
+            "${ASN_MAP}" \
+            "${PARTIALS}" \
+            --partial \
+            --scope-range ${RANGE} &
+        PIDS+=($!)
+    done
+    for PID in "${PIDS[@]}"; do
+        wait "${PID}"
+    done
+    python3 ./reduce-per-as-ixp-dependencies.py \
+        "${STATS}/per-as-ixp-dependencies/" \
+        "${PARTIALS}${BASE}".*.per_as_ixp_dependencies.partial.npz
+done
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+
+def current_umask() -> int:
+    # The umask can only be read by replacing it.
+    umask = os.umask(0o077)
+    os.umask(umask)
+    return umask
+
+
+def default_mode(directory: bool = False) -> int:
+    """Return the permissions that open() (or os.mkdir() if directory)
+    would give a new file under the current umask."""
+    return (0o777 if directory else 0o666) & ~current_umask()
+
+
+@contextmanager
+def atomic_open(output_file: str, mode: str = 'w') -> Iterator[IO]:
+    """Open a temporary file next to output_file for writing and move it
+    to output_file when the block exits without an error, so readers
+    never see a partially written file. Missing directories are
+    created.
+
+    tempfile.mkstemp() creates files that only the owner can read, so
+    the file gets the permissions of a file created with open() before
+    it is moved."""
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(output_dir, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(tmp_file, default_mode())
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+
+from tools.hegemony import HegemonyFilter
+from tools.interning import Interner
+from tools.ixp_dependencies import DependencyRows, DependencyTables, interface_keys, iter_dependency_rows
+from tools.ixp_dependency_state import mix
+from tools.per_scope_interfaces import (DATA_DELIMITER, INTERFACE_CHUNK_SIZE, PerScopeInterfaces, read_csv_chunks,
+                                        read_per_scope_interfaces)
+
+# Number of runs the inputs are hash-partitioned into (by scope). Runs
+# are combined into partitions that fit the memory budget.
+NUM_RUNS = 64
+# Rough peak memory per DependencyRows row while a partition is grouped,
+# validated, and classified.
+BYTES_PER_DEPENDENCY_ROW = 512
+# Rows are stored with their position in all rows of the file.
+ROW_RUN_DTYPE = np.dtype([('row', '<i8'),
+                          ('scope', '<i8'),
+                          ('kind', 'i1'),
+                          ('ix_id', '<i4'),
+                          ('member', '<i8'),
+                          ('ip', '<i4'),
+                          ('hegemony', '<f8')])
+INTERFACE_COLUMNS = ('ix_id', 'asn', 'ip', 'scope')
+
+
+def scope_runs(scope: np.ndarray) -> np.ndarray:
+    """Return the run of each scope."""
+    return (mix(scope.astype(np.int64).view(np.uint64)) % np.uint64(NUM_RUNS)).astype(np.int64)
+
+
+def row_run_file(run_dir: str, run: int) -> str:
+    return os.path.join(run_dir, f'rows.{run}.bin')
+
+
+def interface_run_file(run_dir: str, run: int) -> str:
+    return os.path.join(run_dir, f'interfaces.{run}.csv')
+
+
+def table_file(run_dir: str, partition: int) -> str:
+    return os.path.join(run_dir, f'tables.{partition}.npz')
+
+
+def spill_dependency_rows(input_file: str,
+                          interner: Interner,
+                          hegemony_filter: HegemonyFilter,
+                          run_dir: str,
+                          memory_limit: int = None,
+                          scope_range: tuple = None) -> np.ndarray:
+    """Hash-partition the DependencyRows of a hegemony file (see
+    iter_dependency_rows()) by scope into NUM_RUNS files in run_dir and
+    return the number of rows per run.
+
+    All rows of a scope end up in the same run, in file order. If
+    scope_range (FIRST, LAST) is given, only the rows of these scopes
+    are kept, but rows keep their position among all rows."""
+    counts = np.zeros(NUM_RUNS, dtype=np.int64)
+    offset = 0
+    for rows in iter_dependency_rows(input_file, interner, hegemony_filter, memory_limit):
+        records = np.empty(len(rows.scope), dtype=ROW_RUN_DTYPE)
+        records['row'] = offset + np.arange(len(records))
+        offset += len(records)
+        for field, values in rows._asdict().items():
+            records[field] = values
+        if scope_range is not None:
+            first, last = scope_range
+            records = records[(records['scope'] >= first) & (records['scope'] <= last)]
+        runs = scope_runs(records['scope'])
+        order = np.argsort(runs, kind='stable')
+        bounds = np.searchsorted(runs[order], np.arange(NUM_RUNS + 1))
+        for run in np.flatnonzero(np.diff(bounds)).tolist():
+            with open(row_run_file(run_dir, run), 'ab') as f:
+                records[order[bounds[run]:bounds[run + 1]]].tofile(f)
+        counts += np.diff(bounds)
+    return counts
+
+
+def spill_interfaces(input_file: str, run_dir: str, chunksize: int = INTERFACE_CHUNK_SIZE) -> np.ndarray:
+    """Hash-partition a per-scope interfaces file by scope into NUM_RUNS
+    per-scope interfaces files in run_dir and return the number of rows
+    per run. The file is streamed in chunks of chunksize rows and the
+    rows of a scope keep their order."""
+    counts = np.zeros(NUM_RUNS, dtype=np.int64)
+    for run in range(NUM_RUNS):
+        with open(interface_run_file(run_dir, run), 'w') as f:
+            f.write(DATA_DELIMITER.join(INTERFACE_COLUMNS) + '\n')
+    with read_csv_chunks(input_file, chunksize) as reader:
+        for df in reader:
+            for run, run_df in df.groupby(scope_runs(df['scope'].to_numpy()), sort=False):
+                run_df.to_csv(interface_run_file(run_dir, run),
+                              sep=DATA_DELIMITER,
+                              mode='a',
+                              header=False,
+                              index=False)
+                counts[run] += len(run_df)
+    return counts
+
+
+def plan_partitions(row_counts: np.ndarray, memory_budget: int) -> list:
+    """Group the runs into partitions (lists of consecutive runs) whose
+    rows fit into memory_budget bytes (see BYTES_PER_DEPENDENCY_ROW). A
+    run that does not fit on its own is a partition of its own."""
+    capacity = max(1, memory_budget // BYTES_PER_DEPENDENCY_ROW)
+    ret = [list()]
+    size = 0
+    for run, count in enumerate(row_counts.tolist()):
+        if ret[-1] and size + count > capacity:
+            ret.append(list())
+            size = 0
+        ret[-1].append(run)
+        size += count
+    return ret
+
+
+def load_partition(run_dir: str, runs: list, interner: Interner) -> tuple:
+    """Return the DependencyRows of runs (in file order), the position of
+    each row among all rows, and the PerScopeInterfaces that the rows
+    need (see interface_keys())."""
+    records = np.concatenate([np.empty(0, dtype=ROW_RUN_DTYPE)]
+                             + [np.fromfile(row_run_file(run_dir, run), dtype=ROW_RUN_DTYPE)
+                                for run in runs if os.path.exists(row_run_file(run_dir, run))])
+    records = records[np.argsort(records['row'])]
+    rows = DependencyRows(*(np.ascontiguousarray(records[field]) for field in DependencyRows._fields))
+    ix_keys, ip_keys = interface_keys(rows)
+    parts = [read_per_scope_interfaces(interface_run_file(run_dir, run), interner, ix_keys, ip_keys)
+             for run in runs]
+    interfaces = PerScopeInterfaces(*(np.concatenate(columns) for columns in zip(*parts)))
+    return rows, np.ascontiguousarray(records['row']), interfaces
+
+
+def save_partition_tables(run_dir: str, partition: int, tables: DependencyTables) -> None:
+    np.savez(table_file(run_dir, partition), **tables._asdict())
+
+
+def load_partition_tables(run_dir: str, partition: int) -> DependencyTables:
+    with np.load(table_file(run_dir, partition)) as f:
+        return DependencyTables(**{field: f[field] for field in DependencyTables._fields})
@@ -0,0 +1,528 @@
+import argparse
+import io
+import logging
+import math
+import multiprocessing
+import os
+from collections import namedtuple
+from functools import partial
+from typing import Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from tools.hegemony_cache import (DEFAULT_MAX_CACHE_SIZE, cached_arrays, entry_length, find_entry, iter_entry_rows,
+                                  load_entry, read_entry_rows)
+
+DATA_DELIMITER = ','
+
+# Dependency kinds, derived from the second column of a hegemony file:
+#   as|M         -> KIND_AS     (dep_id = M)
+#   ix|N         -> KIND_IX     (dep_id = N)
+#   ix|N;as|M    -> KIND_IX_AS  (dep_id = N, member = M)
+#   ip|addr      -> KIND_IP     (dep_id = index into ips)
+KIND_AS = 0
+KIND_IX = 1
+KIND_IX_AS = 2
+KIND_IP = 3
+KIND_NAMES = ('as', 'ix', 'ix;as', 'ip')
+
+# Scope of the global hegemony scores ('-1' in the file).
+GLOBAL_SCOPE = -1
+# Member value for rows that are not per-member IXP dependencies.
+NO_MEMBER = -1
+
+# Upper bound of the memory required per row while a batch is parsed
+# (raw pandas string columns plus the typed columns). Used to derive
+# the batch size from a memory limit.
+BYTES_PER_ROW = 512
+ROW_FIELDS = ('scope', 'kind', 'dep_id', 'member', 'hegemony', 'nb_peers')
+
+# Per-kind partitions of a hegemony file (see partition_hegemony()).
+PARTITION_ENTRY = 'partitions'
+PARTITION_NAMES = {KIND_AS: 'as', KIND_IX: 'ix', KIND_IX_AS: 'ix-as', KIND_IP: 'ip'}
+# Only per-member IXP dependencies have a member. row is the index of
+# the row in the original file.
+PARTITION_FIELDS = {kind: ('row', 'scope', 'dep_id', 'hegemony', 'nb_peers')
+                    + (('member',) if kind == KIND_IX_AS else ())
+                    for kind in PARTITION_NAMES}
+# Number of ranges per process for parallel parsing. More ranges than
+# processes even out differences in parsing speed between ranges.
+RANGES_PER_PROCESS = 4
+# Bytes read from the start of a file to estimate its number of rows.
+ROW_SAMPLE_SIZE = 1024 ** 2
+
+# Default thresholds for dependencies used in the paper.
+DEFAULT_MIN_HEGEMONY = 0.1
+DEFAULT_MAX_HEGEMONY = 1
+DEFAULT_MIN_PEERS = 10
+
+HegemonyColumns = namedtuple('HegemonyColumns', 'scope kind dep_id member hegemony nb_peers ips')
+HegemonyColumns.__doc__ = """Parsed hegemony file, one array entry per row (in file order).
+
+scope, dep_id, and member are int64, kind is int8, hegemony is float64,
+and nb_peers is int32. For KIND_IP rows dep_id is an index into ips,
+which holds the distinct IP addresses of the file."""
+
+
+HegemonyFilter = namedtuple('HegemonyFilter',
+                            'min_hegemony max_hegemony min_peers include_global include_self valid_ixps',
+                            defaults=(0, DEFAULT_MAX_HEGEMONY, 0, False, False, None))
+HegemonyFilter.__doc__ = """Row filter for hegemony files (see filter_mask()).
+
+Rows pass if min_hegemony <= hegemony <= max_hegemony and the score is
+based on at least min_peers peers. Global scores and dependencies of
+ASes on themselves are removed unless include_global/include_self are
+set. If valid_ixps (an array of IXP ids) is given, general IXP
+dependencies on other IXPs are removed as well."""
+
+
+def parse_hegemony_frame(df: pd.DataFrame) -> HegemonyColumns:
+    """Convert the raw string/number columns of a hegemony file into
+    HegemonyColumns."""
+    n = len(df)
+    scope = df['scope'].str.removeprefix('as|').astype(np.int64).to_numpy()
+    dependency = df['dependency']
+    prefix = dependency.str[:3].to_numpy()
+    is_ix = prefix == 'ix|'
+    is_ip = prefix == 'ip|'
+    is_as = ~is_ix & ~is_ip
+
+    kind = np.full(n, KIND_AS, dtype=np.int8)
+    dep_id = np.zeros(n, dtype=np.int64)
+    member = np.full(n, NO_MEMBER, dtype=np.int64)
+
+    if is_as.any():
+        dep_id[is_as] = dependency[is_as].str.removeprefix('as|').astype(np.int64).to_numpy()
+    if is_ix.any():
+        ix_idx = np.flatnonzero(is_ix)
+        # Columns: ix_id, ';' (or empty), as|M (or empty)
+        ix_parts = dependency[is_ix].str[3:].str.partition(';')
+        per_member = (ix_parts[1] == ';').to_numpy()
+        kind[ix_idx] = np.where(per_member, KIND_IX_AS, KIND_IX)
+        dep_id[ix_idx] = ix_parts[0].astype(np.int64).to_numpy()
+        member[ix_idx[per_member]] = ix_parts[2][per_member].str.removeprefix('as|').astype(np.int64).to_numpy()
+    ips = np.empty(0, dtype=str)
+    if is_ip.any():
+        codes, uniques = pd.factorize(dependency[is_ip].str[3:])
+        kind[is_ip] = KIND_IP
+        dep_id[is_ip] = codes
+        ips = np.asarray(uniques, dtype=str)
+
+    return HegemonyColumns(scope,
+                           kind,
+                           dep_id,
+                           member,
+                           df['hegemony'].to_numpy(dtype=np.float64),
+                           df['nb_peers'].to_numpy(dtype=np.int32),
+                           ips)
+
+
+def format_scope(scope: int) -> str:
+    """Return the scope column value of a row (see parse_hegemony_frame())."""
+    if scope == GLOBAL_SCOPE:
+        return str(GLOBAL_SCOPE)
+    return f'as|{scope}'
+
+
+def format_dependency(kind: int, dep_id: int, member: int, ips: np.ndarray) -> str:
+    """Return the dependency column value of a row (see
+    parse_hegemony_frame())."""
+    if kind == KIND_AS:
+        return f'as|{dep_id}'
+    if kind == KIND_IX:
+        return f'ix|{dep_id}'
+    if kind == KIND_IX_AS:
+        return f'ix|{dep_id};as|{member}'
+    return f'ip|{ips[dep_id]}'
+
+
+def read_csv_frames(input_file, chunksize: int = None, header: int = 0):
+    """Return the raw columns of a *.hegemony.csv file (a path or file
+    object) as a DataFrame, or an iterator of DataFrames with at most
+    chunksize rows. Pass header=None if the input has no header line."""
+    return pd.read_csv(input_file,
+                       sep=DATA_DELIMITER,
+                       header=header,
+                       names=['scope', 'dependency', 'hegemony', 'nb_peers'],
+                       usecols=[0, 1, 2, 3],
+                       dtype={'scope': str, 'dependency': str, 'hegemony': np.float64, 'nb_peers': np.int32},
+                       # Parse floats exactly like float() to keep
+                       # equality checks between scores intact.
+                       float_precision='round_trip',
+                       chunksize=chunksize)
+
+
+def read_hegemony_csv(input_file: str) -> HegemonyColumns:
+    """Parse a *.hegemony.csv file into typed columns."""
+    return parse_hegemony_frame(read_csv_frames(input_file))
+
+
+def byte_ranges(input_file: str, num_ranges: int) -> list:
+    """Split the rows of a *.hegemony.csv file (without the header) into
+    at most num_ranges (start, end) byte ranges of roughly equal size.
+    Ranges start at the beginning of a line and end after a newline."""
+    size = os.path.getsize(input_file)
+    with open(input_file, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        step = (size - bounds[0]) / num_ranges
+        for idx in range(1, num_ranges):
+            pos = bounds[0] + int(idx * step)
+            if pos <= bounds[-1]:
+                continue
+            # Move to the start of the next line (or stay if pos is
+            # already at the start of one).
+            f.seek(pos - 1)
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def estimate_rows(input_file: str) -> int:
+    """Estimate the number of rows of a *.hegemony.csv file based on the
+    line length at the start of the file."""
+    size = os.path.getsize(input_file)
+    with open(input_file, 'rb') as f:
+        f.readline()
+        header_size = f.tell()
+        sample = f.read(ROW_SAMPLE_SIZE)
+    lines = sample.count(b'\n')
+    if lines == 0:
+        return 1
+    return math.ceil((size - header_size) * lines / len(sample))
+
+
+def read_hegemony_range(input_file: str, start: int, end: int) -> HegemonyColumns:
+    """Parse the rows in byte range [start, end) of a *.hegemony.csv
+    file, which must be aligned to line boundaries (see byte_ranges())."""
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return parse_hegemony_frame(read_csv_frames(io.BytesIO(data), header=None))
+
+
+def load_hegemony(input_file: str,
+                  use_cache: bool = True,
+                  cache_dir: str = None,
+                  max_cache_size: int = DEFAULT_MAX_CACHE_SIZE) -> HegemonyColumns:
+    """Read a *.hegemony.csv file into typed columns.
+
+    Unless use_cache is False, the parsed columns are stored in a binary
+    cache next to the input file (see tools.hegemony_cache) and later
+    calls for the same file content map them from there instead of
+    parsing the file again."""
+    if not use_cache:
+        return read_hegemony_csv(input_file)
+    arrays = cached_arrays(input_file,
+                           HegemonyColumns._fields,
+                           lambda f: read_hegemony_csv(f)._asdict(),
+                           cache_dir,
+                           max_cache_size)
+    return HegemonyColumns(**arrays)
+
+
+def partition_hegemony(hegemony: HegemonyColumns) -> dict:
+    """Split hegemony into one partition per dependency kind. Each
+    partition is sorted by dep_id (rows with the same dep_id keep their
+    order) and stored as '<partition>.<field>' arrays (see
+    PARTITION_FIELDS). The IP table is shared by all partitions."""
+    ret = {'ips': hegemony.ips}
+    for kind, name in PARTITION_NAMES.items():
+        rows = np.flatnonzero(hegemony.kind == kind)
+        rows = rows[np.argsort(hegemony.dep_id[rows], kind='stable')]
+        ret[f'{name}.row'] = rows.astype(np.int64)
+        for field in PARTITION_FIELDS[kind][1:]:
+            ret[f'{name}.{field}'] = getattr(hegemony, field)[rows]
+    return ret
+
+
+def partition_manifest(input_file: str, partitions: dict) -> dict:
+    """Describe the partitions of input_file for the cache manifest."""
+    ret = {'source': os.path.basename(input_file),
+           'source_size': os.path.getsize(input_file),
+           'rows': sum(len(partitions[f'{name}.row']) for name in PARTITION_NAMES.values()),
+           'ips': len(partitions['ips']),
+           'partitions': dict()}
+    for kind, name in PARTITION_NAMES.items():
+        dep_ids = partitions[f'{name}.dep_id']
+        ret['partitions'][name] = {'kind': kind,
+                                   'rows': len(dep_ids),
+                                   'sorted_by': 'dep_id',
+                                   'fields': list(PARTITION_FIELDS[kind]),
+                                   'dependencies': int(np.count_nonzero(np.diff(dep_ids))) + 1 if len(dep_ids) else 0,
+                                   'min_dep_id': int(dep_ids[0]) if len(dep_ids) else None,
+                                   'max_dep_id': int(dep_ids[-1]) if len(dep_ids) else None}
+    return ret
+
+
+def build_partitions(input_file: str, cache_dir: str = None) -> dict:
+    # Reuse the columns of the full cache entry if they exist, but do
+    # not create one just to partition the file.
+    entry_dir = find_entry(input_file, cache_dir)
+    if entry_dir is not None:
+        hegemony = HegemonyColumns(**load_entry(entry_dir, HegemonyColumns._fields))
+    else:
+        hegemony = read_hegemony_csv(input_file)
+    return partition_hegemony(hegemony)
+
+
+def partition_fields() -> tuple:
+    return ('ips',) + tuple(f'{name}.{field}'
+                            for kind, name in PARTITION_NAMES.items()
+                            for field in PARTITION_FIELDS[kind])
+
+
+def load_partitions(input_file: str,
+                    kinds: tuple,
+                    file_order: bool = True,
+                    cache_dir: str = None,
+                    max_cache_size: int = DEFAULT_MAX_CACHE_SIZE) -> HegemonyColumns:
+    """Return only the rows of the given dependency kinds of a
+    *.hegemony.csv file.
+
+    The file is split into per-kind partitions once and the partitions
+    are stored in the cache (with a manifest.json that describes them),
+    so later calls only read the partitions they need. Rows are returned
+    in file order, or, if file_order is False, grouped by kind (in the
+    order of kinds) and sorted by dep_id within each kind."""
+    partitions = cached_arrays(input_file,
+                               partition_fields(),
+                               lambda f: build_partitions(f, cache_dir),
+                               cache_dir,
+                               max_cache_size,
+                               name=PARTITION_ENTRY,
+                               manifest=lambda arrays: partition_manifest(input_file, arrays))
+    columns = {field: list() for field in ('row',) + ROW_FIELDS}
+    for kind in kinds:
+        name = PARTITION_NAMES[kind]
+        num_rows = len(partitions[f'{name}.row'])
+        columns['kind'].append(np.full(num_rows, kind, dtype=np.int8))
+        if kind != KIND_IX_AS:
+            columns['member'].append(np.full(num_rows, NO_MEMBER, dtype=np.int64))
+        for field in PARTITION_FIELDS[kind]:
+            columns[field].append(partitions[f'{name}.{field}'])
+    if len(kinds) == 1 and not file_order:
+        # Single partition, no need to copy the mapped arrays.
+        columns = {field: values[0] for field, values in columns.items()}
+    else:
+        columns = {field: np.concatenate(values) for field, values in columns.items()}
+    if file_order:
+        order = np.argsort(columns['row'], kind='stable')
+        columns = {field: values[order] for field, values in columns.items()}
+    del columns['row']
+    return HegemonyColumns(ips=partitions['ips'], **columns)
+
+
+def batch_size_for(memory_limit: int) -> int:
+    """Return the number of rows per batch that keeps the parsing of a
+    batch below memory_limit bytes."""
+    return max(1, memory_limit // BYTES_PER_ROW)
+
+
+def iter_hegemony(input_file: str,
+                  memory_limit: int = None,
+                  use_cache: bool = True,
+                  cache_dir: str = None,
+                  kinds: tuple = None) -> Iterator[HegemonyColumns]:
+    """Yield the rows of a *.hegemony.csv file as HegemonyColumns batches
+    (in file order).
+
+    Without memory_limit, the entire file is yielded as a single batch
+    via load_hegemony(), or, if kinds is given, via load_partitions(),
+    which only reads the rows of the given dependency kinds. Other kinds
+    can still be included in the batches, so consumers have to filter
+    anyway. Otherwise, the file is streamed in batches that
+    require at most roughly memory_limit bytes each, so that consumers
+    that only keep aggregated state run with flat memory usage
+    independent of the file size. Batches are read from the cache if the
+    file was cached before, but streaming never creates a cache entry
+    since that would require parsing the entire file at once.
+
+    The IP table of a batch is only valid for the rows of that batch,
+    i.e., the same IP can have different dep_ids in different batches."""
+    if memory_limit is None:
+        if kinds is not None and use_cache:
+            yield load_partitions(input_file, kinds, cache_dir=cache_dir)
+        else:
+            yield load_hegemony(input_file, use_cache, cache_dir)
+        return
+    batch_size = batch_size_for(memory_limit)
+    entry_dir = find_entry(input_file, cache_dir) if use_cache else None
+    if entry_dir is not None:
+        logging.info(f'Streaming {input_file} from cache in batches of {batch_size} rows')
+        ips = load_entry(entry_dir, ('ips',))['ips']
+        for rows in iter_entry_rows(entry_dir, ROW_FIELDS, batch_size):
+            yield HegemonyColumns(ips=ips, **rows)
+        return
+    logging.info(f'Streaming {input_file} in batches of {batch_size} rows')
+    with read_csv_frames(input_file, batch_size) as reader:
+        for df in reader:
+            yield parse_hegemony_frame(df)
+
+
+# Function applied by the worker processes of map_hegemony(). It is set
+# before the workers are forked, so the function and everything it
+# references are inherited instead of pickled for every task.
+_map_func = None
+
+
+def _map_byte_range(task: tuple):
+    input_file, start, end = task
+    return _map_func(read_hegemony_range(input_file, start, end))
+
+
+def _map_row_range(task: tuple):
+    entry_dir, start, end = task
+    rows = read_entry_rows(entry_dir, ROW_FIELDS, start, end)
+    return _map_func(HegemonyColumns(ips=load_entry(entry_dir, ('ips',))['ips'], **rows))
+
+
+def apply_filtered(hegemony: HegemonyColumns,
+                   func: Callable[[HegemonyColumns], object],
+                   hegemony_filter: HegemonyFilter,
+                   kinds: tuple = None):
+    return func(select(hegemony, filter_mask(hegemony, hegemony_filter, kinds)))
+
+
+def map_hegemony(input_file: str,
+                 func: Callable[[HegemonyColumns], object],
+                 processes: int = 1,
+                 memory_limit: int = None,
+                 use_cache: bool = True,
+                 cache_dir: str = None,
+                 kinds: tuple = None,
+                 hegemony_filter: HegemonyFilter = None) -> list:
+    """Apply func to batches of the rows of a *.hegemony.csv file and
+    return the results in file order.
+
+    func should reduce its batch to a partial result that the caller
+    merges, e.g., counters or lists of values per IXP. With more than one
+    process, the file is split into line-aligned byte ranges (or row
+    ranges, if the file is cached) that are parsed and reduced in
+    parallel by a pool of forked processes. func is inherited by the
+    workers, so it does not have to be picklable, but its results do.
+    memory_limit (bytes) is the limit for all processes together.
+
+    If kinds is given and the file was already partitioned (see
+    load_partitions()), only the partitions of these kinds are read
+    instead and func is applied to them at once.
+
+    If hegemony_filter is given, func only receives the rows (of kinds)
+    that pass the filter. Since the filter is applied as a vectorized
+    mask directly after parsing, this is much faster than filtering in
+    func row by row.
+
+    The IP table of a batch is only valid for the rows of that batch."""
+    if hegemony_filter is not None:
+        func = partial(apply_filtered, func=func, hegemony_filter=hegemony_filter, kinds=kinds)
+    if processes > 1 and kinds is not None and use_cache and memory_limit is None \
+            and find_entry(input_file, cache_dir, PARTITION_ENTRY) is not None:
+        processes = 1
+    if processes <= 1:
+        return [func(hegemony) for hegemony in iter_hegemony(input_file, memory_limit, use_cache, cache_dir, kinds)]
+
+    entry_dir = find_entry(input_file, cache_dir) if use_cache else None
+    num_rows = entry_length(entry_dir, 'scope') if entry_dir is not None else estimate_rows(input_file)
+    num_ranges = processes * RANGES_PER_PROCESS
+    if memory_limit is not None:
+        num_ranges = max(num_ranges, math.ceil(num_rows / batch_size_for(memory_limit // processes)))
+    if entry_dir is not None:
+        logging.info(f'Reading {input_file} from cache with {processes} processes')
+        step = max(1, math.ceil(num_rows / num_ranges))
+        worker = _map_row_range
+        tasks = [(entry_dir, start, start + step) for start in range(0, num_rows, step)]
+    else:
+        logging.info(f'Parsing {input_file} with {processes} processes')
+        worker = _map_byte_range
+        tasks = [(input_file, start, end) for start, end in byte_ranges(input_file, num_ranges)]
+
+    global _map_func
+    _map_func = func
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            return pool.map(worker, tasks, chunksize=1)
+    finally:
+        _map_func = None
+
+
+def select(hegemony: HegemonyColumns, mask: np.ndarray) -> HegemonyColumns:
+    """Return the rows of hegemony selected by mask. The IP table is
+    shared with the input."""
+    return HegemonyColumns(hegemony.scope[mask],
+                           hegemony.kind[mask],
+                           hegemony.dep_id[mask],
+                           hegemony.member[mask],
+                           hegemony.hegemony[mask],
+                           hegemony.nb_peers[mask],
+                           hegemony.ips)
+
+
+def valid_dependency_mask(kind: np.ndarray, dep_id: np.ndarray, valid_ixps: np.ndarray) -> np.ndarray:
+    """Return mask of dependencies that are not general IXP dependencies
+    on IXPs outside of valid_ixps. No dependency is excluded if
+    valid_ixps is None or empty."""
+    if valid_ixps is None or len(valid_ixps) == 0:
+        return np.ones(len(kind), dtype=bool)
+    return (kind != KIND_IX) | np.isin(dep_id, valid_ixps)
+
+
+def filter_mask(hegemony: HegemonyColumns,
+                hegemony_filter: HegemonyFilter,
+                kinds: tuple = None) -> np.ndarray:
+    """Return mask of the rows of hegemony that pass hegemony_filter and,
+    if given, are of one of the dependency kinds."""
+    mask = ((hegemony.hegemony >= hegemony_filter.min_hegemony)
+            & (hegemony.hegemony <= hegemony_filter.max_hegemony)
+            & (hegemony.nb_peers >= hegemony_filter.min_peers))
+    if kinds is not None:
+        mask &= np.isin(hegemony.kind, kinds)
+    if not hegemony_filter.include_global:
+        mask &= hegemony.scope != GLOBAL_SCOPE
+    if not hegemony_filter.include_self:
+        mask &= ~((hegemony.kind == KIND_AS) & (hegemony.dep_id == hegemony.scope))
+    if hegemony_filter.valid_ixps is not None:
+        mask &= valid_dependency_mask(hegemony.kind, hegemony.dep_id, hegemony_filter.valid_ixps)
+    return mask
+
+
+def filter_key(hegemony_filter: HegemonyFilter) -> str:
+    """Return a short description of hegemony_filter (without the valid
+    IXPs) that can be used in file names."""
+    ret = f'h{hegemony_filter.min_hegemony:g}-{hegemony_filter.max_hegemony:g}.p{hegemony_filter.min_peers}'
+    if hegemony_filter.include_global:
+        ret += '.global'
+    if hegemony_filter.include_self:
+        ret += '.self'
+    return ret
+
+
+def read_valid_ixps(input_file: str) -> np.ndarray:
+    """Read a list of IXP ids (one per line, e.g., from get-valid-ixps.py)
+    into a sorted array for valid_dependency_mask()."""
+    with open(input_file, 'r') as f:
+        return np.unique(np.fromiter((int(line) for line in f if line.strip()), dtype=np.int64))
+
+
+def add_filter_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line arguments of filter_from_args() to parser."""
+    group = parser.add_argument_group('hegemony filter')
+    group.add_argument('--min-hegemony', type=float, default=DEFAULT_MIN_HEGEMONY,
+                       help='minimum hegemony score of a dependency (default: %(default)s)')
+    group.add_argument('--max-hegemony', type=float, default=DEFAULT_MAX_HEGEMONY,
+                       help='maximum hegemony score of a dependency (default: %(default)s)')
+    group.add_argument('--min-peers', type=int, default=DEFAULT_MIN_PEERS,
+                       help='minimum number of peers a hegemony score is based on (default: %(default)s)')
+    group.add_argument('--include-global', action='store_true', help='keep the global hegemony scores')
+    group.add_argument('--include-self', action='store_true', help='keep dependencies of ASes on themselves')
+
+
+def filter_from_args(args: argparse.Namespace, valid_ixps: np.ndarray = None) -> HegemonyFilter:
+    return HegemonyFilter(args.min_hegemony,
+                          args.max_hegemony,
+                          args.min_peers,
+                          args.include_global,
+                          args.include_self,
+                          valid_ixps)
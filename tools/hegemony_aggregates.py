@@ -0,0 +1,257 @@
+import logging
+import os
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+
+from tools.hegemony import (KIND_AS, KIND_IX, HegemonyColumns, HegemonyFilter, filter_key, map_hegemony,
+                            valid_dependency_mask)
+from tools.hegemony_cache import DEFAULT_MAX_CACHE_SIZE, cached_arrays, find_entry
+
+AGGREGATE_ENTRY = 'aggregates'
+# Bump if metrics are added or changed, so that cached aggregates are
+# computed again.
+AGGREGATE_VERSION = 2
+DEPENDENCY_KINDS = (KIND_AS, KIND_IX)
+
+Metric = namedtuple('Metric', 'name fields kinds consume merge bounded', defaults=(True,))
+Metric.__doc__ = """A statistic that aggregate_hegemony() computes in a shared pass.
+
+consume(hegemony) reduces a batch of rows that passed the filter to a
+partial result. merge(partials) combines the partial results of all
+batches (in file order) into a dict that maps each of fields to an
+array. kinds are the dependency kinds consume() needs. Metrics that
+are not bounded keep data of every row, so their partial results grow
+with the file and they cannot be computed within a memory limit."""
+
+METRICS = dict()
+
+
+def register_metric(metric: Metric) -> None:
+    METRICS[metric.name] = metric
+
+
+def concatenate(arrays: list, dtype) -> np.ndarray:
+    return np.concatenate([np.empty(0, dtype=dtype)] + list(arrays))
+
+
+def appearance_rank(first: np.ndarray) -> np.ndarray:
+    """Return the rank of each entry when sorted by first."""
+    ret = np.empty(len(first), dtype=np.int64)
+    ret[np.argsort(first, kind='stable')] = np.arange(len(first))
+    return ret
+
+
+def merge_unique_counts(partials: list) -> tuple:
+    """Merge (values, first_index, counts) results of np.unique() of
+    consecutive batches. Return the distinct values ordered by their
+    first appearance over all batches and their total counts."""
+    values = concatenate((v for v, _, _ in partials), np.int64)
+    first = concatenate((f for _, f, _ in partials), np.int64)
+    counts = concatenate((c for _, _, c in partials), np.int64)
+    batch = concatenate((np.full(len(v), idx) for idx, (v, _, _) in enumerate(partials)), np.int64)
+    if len(values) == 0:
+        return values, counts
+    order = np.lexsort((first, batch, values))
+    values = values[order]
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    counts = np.add.reduceat(counts[order], starts)
+    appearance = np.lexsort((first[order][starts], batch[order][starts]))
+    return values[starts][appearance], counts[appearance]
+
+
+# ix-scopes: Distinct (ix_id, scope) pairs of general IXP dependencies
+# and how often each pair occurs, sorted by ix_id and scope. Pairs are
+# packed into one int64 key (see ix_scope_keys()), which is much cheaper
+# to sort than the pairs.
+IX_SCOPE_SHIFT = 33
+
+
+def ix_scope_keys(ix_id: np.ndarray, scope: np.ndarray) -> np.ndarray:
+    # Scopes are 32-bit ASNs or GLOBAL_SCOPE (-1).
+    return (ix_id.astype(np.int64) << IX_SCOPE_SHIFT) | (scope.astype(np.int64) + 1)
+
+
+def consume_ix_scopes(hegemony: HegemonyColumns) -> tuple:
+    mask = hegemony.kind == KIND_IX
+    return np.unique(ix_scope_keys(hegemony.dep_id[mask], hegemony.scope[mask]), return_counts=True)
+
+
+def merge_ix_scopes(partials: list) -> dict:
+    keys = concatenate((keys for keys, _ in partials), np.int64)
+    counts = concatenate((counts for _, counts in partials), np.int64)
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    del order
+    if len(keys):
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        keys, counts = keys[starts], np.add.reduceat(counts, starts)
+    return {'ix_id': keys >> IX_SCOPE_SHIFT,
+            'scope': (keys & ((1 << IX_SCOPE_SHIFT) - 1)) - 1,
+            'count': counts}
+
+
+# dependency-counts: Number of dependent scopes of each AS and general IXP
+# dependency. Dependencies are grouped by kind and ordered by their first
+# appearance in the file.
+def consume_dependency_counts(hegemony: HegemonyColumns) -> dict:
+    return {kind: np.unique(hegemony.dep_id[hegemony.kind == kind], return_index=True, return_counts=True)
+            for kind in DEPENDENCY_KINDS}
+
+
+def merge_dependency_counts(partials: list) -> dict:
+    ret = {'kind': list(), 'dep_id': list(), 'count': list()}
+    for kind in DEPENDENCY_KINDS:
+        dep_ids, counts = merge_unique_counts([partial[kind] for partial in partials])
+        ret['kind'].append(np.full(len(dep_ids), kind, dtype=np.int8))
+        ret['dep_id'].append(dep_ids)
+        ret['count'].append(counts)
+    return {field: np.concatenate(values) for field, values in ret.items()}
+
+
+# hegemony-lists: The hegemony scores of each AS and general IXP
+# dependency (in file order). Dependencies are ordered like for
+# dependency-counts and the scores of dependency i are
+# hegemony[offsets[i]:offsets[i + 1]].
+def consume_hegemony_lists(hegemony: HegemonyColumns) -> dict:
+    ret = dict()
+    for kind in DEPENDENCY_KINDS:
+        kind_mask = hegemony.kind == kind
+        ret[kind] = (hegemony.dep_id[kind_mask], hegemony.hegemony[kind_mask])
+    return ret
+
+
+def merge_hegemony_lists(partials: list) -> dict:
+    ret = {'kind': list(), 'dep_id': list(), 'lengths': list(), 'hegemony': list()}
+    for kind in DEPENDENCY_KINDS:
+        dep_ids = concatenate((partial[kind][0] for partial in partials), np.int64)
+        heges = concatenate((partial[kind][1] for partial in partials), np.float64)
+        uniques, first, inverse = np.unique(dep_ids, return_index=True, return_inverse=True)
+        rank = appearance_rank(first)[inverse.reshape(-1)]
+        ret['kind'].append(np.full(len(uniques), kind, dtype=np.int8))
+        ret['dep_id'].append(uniques[np.argsort(first, kind='stable')])
+        ret['lengths'].append(np.bincount(rank, minlength=len(uniques)))
+        ret['hegemony'].append(heges[np.argsort(rank, kind='stable')])
+    lengths = np.concatenate(ret.pop('lengths'))
+    ret = {field: np.concatenate(values) for field, values in ret.items()}
+    ret['offsets'] = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+    return ret
+
+
+register_metric(Metric('ix-scopes', ('ix_id', 'scope', 'count'), (KIND_IX,),
+                       consume_ix_scopes, merge_ix_scopes))
+register_metric(Metric('dependency-counts', ('kind', 'dep_id', 'count'), DEPENDENCY_KINDS,
+                       consume_dependency_counts, merge_dependency_counts))
+register_metric(Metric('hegemony-lists', ('kind', 'dep_id', 'offsets', 'hegemony'), DEPENDENCY_KINDS,
+                       consume_hegemony_lists, merge_hegemony_lists, bounded=False))
+
+
+def aggregate_fields(metrics: tuple) -> tuple:
+    return tuple(f'{name}.{field}' for name in metrics for field in METRICS[name].fields)
+
+
+def consume_metrics(hegemony: HegemonyColumns, metrics: tuple) -> dict:
+    return {name: METRICS[name].consume(hegemony) for name in metrics}
+
+
+def aggregate_hegemony(input_file: str,
+                       metrics: tuple,
+                       hegemony_filter: HegemonyFilter,
+                       processes: int = 1,
+                       memory_limit: int = None) -> dict:
+    """Compute all metrics over the rows that pass hegemony_filter in a
+    single pass over input_file and return a dict that maps
+    '<metric>.<field>' to arrays. Raise ValueError if metrics that are
+    not bounded are requested with a memory_limit."""
+    unbounded = [name for name in metrics if not METRICS[name].bounded]
+    if memory_limit is not None and unbounded:
+        raise ValueError(f'{", ".join(unbounded)} keeps every row and cannot be computed with a memory limit')
+    logging.info(f'Aggregating {", ".join(metrics)} for {input_file}')
+    kinds = tuple(sorted({kind for name in metrics for kind in METRICS[name].kinds}))
+    partials = map_hegemony(input_file,
+                            partial(consume_metrics, metrics=metrics),
+                            processes,
+                            memory_limit,
+                            kinds=kinds,
+                            hegemony_filter=hegemony_filter)
+    ret = dict()
+    for name in metrics:
+        merged = METRICS[name].merge([partial[name] for partial in partials])
+        for field in METRICS[name].fields:
+            ret[f'{name}.{field}'] = merged[field]
+    return ret
+
+
+def aggregate_manifest(input_file: str,
+                       name: str,
+                       hegemony_filter: HegemonyFilter,
+                       aggregates: dict) -> dict:
+    return {'source': os.path.basename(input_file),
+            'filter': {field: value for field, value in hegemony_filter._asdict().items() if field != 'valid_ixps'},
+            'metric': name,
+            'fields': {field: len(aggregates[f'{name}.{field}']) for field in METRICS[name].fields}}
+
+
+def aggregate_entry_name(name: str, hegemony_filter: HegemonyFilter) -> str:
+    return f'{AGGREGATE_ENTRY}.{name}.{filter_key(hegemony_filter)}.v{AGGREGATE_VERSION}'
+
+
+def load_aggregates(input_file: str,
+                    hegemony_filter: HegemonyFilter,
+                    metrics: tuple,
+                    processes: int = 1,
+                    memory_limit: int = None,
+                    cache_dir: str = None,
+                    max_cache_size: int = DEFAULT_MAX_CACHE_SIZE) -> dict:
+    """Return metrics of input_file for the rows that pass hegemony_filter
+    as a dict that maps '<metric>.<field>' to arrays.
+
+    Each metric is stored in its own cache entry. The metrics that are
+    not cached yet are computed together in a single pass over the file,
+    so scripts that use the same file and filter share one pass, but
+    only compute and hold the metrics they ask for. Metrics that are not
+    bounded can only be loaded from the cache with a memory_limit (see
+    aggregate_hegemony()). The valid IXPs of the filter are ignored
+    here, since they are cheap to apply to the metrics afterwards (see
+    valid_dependency_mask())."""
+    hegemony_filter = hegemony_filter._replace(valid_ixps=None)
+    missing = tuple(name for name in metrics
+                    if find_entry(input_file, cache_dir, aggregate_entry_name(name, hegemony_filter)) is None)
+    computed = dict()
+    if missing:
+        computed = aggregate_hegemony(input_file, missing, hegemony_filter, processes, memory_limit)
+
+    def build(source_file: str, name: str) -> dict:
+        fields = aggregate_fields((name,))
+        if name in missing:
+            return {field: computed.pop(field) for field in fields}
+        # The entry was evicted after it was found.
+        return aggregate_hegemony(source_file, (name,), hegemony_filter, processes, memory_limit)
+
+    ret = dict()
+    for name in metrics:
+        ret.update(cached_arrays(input_file,
+                                 aggregate_fields((name,)),
+                                 partial(build, name=name),
+                                 cache_dir,
+                                 max_cache_size,
+                                 name=aggregate_entry_name(name, hegemony_filter),
+                                 manifest=partial(aggregate_manifest, input_file, name, hegemony_filter)))
+    return ret
+
+
+def hegemony_lists(aggregates: dict, valid_ixps: np.ndarray = None) -> list:
+    """Return the hegemony-lists metric as a list of (kind, dep_id,
+    scores) tuples, without IXP dependencies on IXPs outside of
+    valid_ixps (if given)."""
+    offsets = aggregates['hegemony-lists.offsets']
+    kinds = aggregates['hegemony-lists.kind']
+    dep_ids = aggregates['hegemony-lists.dep_id']
+    scores = aggregates['hegemony-lists.hegemony']
+    keep = np.flatnonzero(valid_dependency_mask(kinds, dep_ids, valid_ixps))
+    return [(kind, dep_id, scores[start:end])
+            for kind, dep_id, start, end in zip(kinds[keep].tolist(),
+                                                dep_ids[keep].tolist(),
+                                                offsets[keep].tolist(),
+                                                offsets[keep + 1].tolist())]
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Callable, Iterator
+
+import numpy as np
+
+from tools.atomic_files import atomic_open, default_mode
+
+CACHE_DIR_NAME = '.hegemony-cache'
+# Bump if the layout of the cached arrays changes, so that old entries
+# are no longer used (they will be evicted eventually).
+CACHE_VERSION = 1
+DEFAULT_MAX_CACHE_SIZE = 8 * 1024 ** 3
+STAMP_FILE = 'stamps.json'
+MANIFEST_FILE = 'manifest.json'
+ARRAY_SUFFIX = '.npy'
+HASH_CHUNK_SIZE = 4 * 1024 ** 2
+
+
+def default_cache_dir(source_file: str) -> str:
+    """Return the cache directory that lives next to source_file."""
+    return os.path.join(os.path.dirname(os.path.abspath(source_file)), CACHE_DIR_NAME)
+
+
+def file_digest(source_file: str) -> str:
+    """Return the SHA-256 hex digest of the content of source_file."""
+    h = hashlib.sha256()
+    with open(source_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_stamps(cache_dir: str) -> dict:
+    stamp_file = os.path.join(cache_dir, STAMP_FILE)
+    if not os.path.exists(stamp_file):
+        return dict()
+    try:
+        with open(stamp_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logging.warning(f'Ignoring unreadable cache stamp file: {stamp_file}')
+        return dict()
+
+
+def write_stamps(cache_dir: str, stamps: dict) -> None:
+    with atomic_open(os.path.join(cache_dir, STAMP_FILE)) as f:
+        json.dump(stamps, f)
+
+
+def make_entry_dir(cache_dir: str) -> str:
+    """Create a temporary directory in cache_dir in which a new entry is
+    written before it is renamed. Unlike tempfile.mkdtemp(), give it the
+    permissions of os.mkdir(), so that everyone who can read the cache
+    can read the entry."""
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, suffix='.tmp')
+    os.chmod(tmp_dir, default_mode(directory=True))
+    return tmp_dir
+
+
+def source_key(source_file: str, cache_dir: str) -> str:
+    """Return the cache key of source_file.
+
+    The key is based on the content hash of the file. Hashing a large
+    file is still much cheaper than parsing it, but to avoid even that,
+    the last hash is remembered together with the size and modification
+    time of the file and reused as long as both are unchanged."""
+    path = os.path.abspath(source_file)
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    stamps = read_stamps(cache_dir)
+    if path in stamps and stamps[path][:2] == stamp:
+        digest = stamps[path][2]
+    else:
+        digest = file_digest(path)
+        stamps = {p: v for p, v in stamps.items() if os.path.exists(p)}
+        stamps[path] = stamp + [digest]
+        write_stamps(cache_dir, stamps)
+    return f'{digest}.v{CACHE_VERSION}'
+
+
+def entry_size(entry_dir: str) -> int:
+    return sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+
+
+def evict(cache_dir: str, max_cache_size: int, keep: str = None) -> None:
+    """Remove least recently used entries from cache_dir until the total
+    size of all entries is at most max_cache_size. The entry keep is
+    never removed."""
+    entries = list()
+    for e in os.scandir(cache_dir):
+        if not e.is_dir() or e.name.endswith('.tmp'):
+            continue
+        entries.append((e.stat().st_mtime, e.name, entry_size(e.path)))
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_cache_size:
+            break
+        if name == keep:
+            continue
+        logging.info(f'Evicting cache entry {name} ({size} bytes)')
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total -= size
+
+
+def touch_entry(entry_dir: str) -> None:
+    """Mark entry_dir as recently used for eviction. Users that can read
+    but not write the cache cannot change the time, so this is only
+    best-effort."""
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+
+
+def load_entry(entry_dir: str, fields: tuple) -> dict:
+    return {field: np.load(os.path.join(entry_dir, f'{field}{ARRAY_SUFFIX}'), mmap_mode='r')
+            for field in fields}
+
+
+def entry_key(source_file: str, cache_dir: str, name: str = None) -> str:
+    """Return the key of the cache entry of source_file. Different
+    representations of the same file are distinguished by name."""
+    key = source_key(source_file, cache_dir)
+    if name is not None:
+        key = f'{key}.{name}'
+    return key
+
+
+def find_entry(source_file: str, cache_dir: str = None, name: str = None) -> str:
+    """Return the directory of the cache entry of source_file, or None if
+    the file is not cached (or the cache is unavailable)."""
+    if cache_dir is None:
+        cache_dir = default_cache_dir(source_file)
+    if not os.path.isdir(cache_dir):
+        return None
+    try:
+        entry_dir = os.path.join(cache_dir, entry_key(source_file, cache_dir, name))
+    except OSError:
+        return None
+    if not os.path.isdir(entry_dir):
+        return None
+    touch_entry(entry_dir)
+    return entry_dir
+
+
+def read_array_header(f) -> tuple:
+    """Read the header of an .npy file and return (shape, fortran_order,
+    dtype). Afterwards, f points to the start of the data."""
+    major, _ = np.lib.format.read_magic(f)
+    if major == 1:
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def read_manifest(entry_dir: str) -> dict:
+    """Return the manifest stored with a cache entry (empty if there is
+    none)."""
+    manifest_file = os.path.join(entry_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return dict()
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def entry_length(entry_dir: str, field: str) -> int:
+    """Return the number of rows of a cached array."""
+    with open(os.path.join(entry_dir, f'{field}{ARRAY_SUFFIX}'), 'rb') as f:
+        shape, _, _ = read_array_header(f)
+    return shape[0]
+
+
+def read_entry_rows(entry_dir: str, fields: tuple, start: int, stop: int) -> dict:
+    """Read rows [start, stop) of the cached arrays in fields.
+
+    In contrast to load_entry(), the rows are read into fresh arrays, so
+    memory usage is bounded by the number of rows and does not grow with
+    the number of rows that were read before."""
+    ret = dict()
+    for field in fields:
+        with open(os.path.join(entry_dir, f'{field}{ARRAY_SUFFIX}'), 'rb') as f:
+            shape, _, dtype = read_array_header(f)
+            stop = min(stop, shape[0])
+            f.seek(start * dtype.itemsize, os.SEEK_CUR)
+            ret[field] = np.fromfile(f, dtype=dtype, count=max(0, stop - start))
+    return ret
+
+
+def iter_entry_rows(entry_dir: str, fields: tuple, batch_size: int) -> Iterator[dict]:
+    """Yield the cached arrays in fields in batches of batch_size rows.
+    All fields must have the same length."""
+    length = entry_length(entry_dir, fields[0])
+    for start in range(0, length, batch_size):
+        yield read_entry_rows(entry_dir, fields, start, start + batch_size)
+
+
+def write_manifest(entry_dir: str, manifest: dict) -> None:
+    with open(os.path.join(entry_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def cached_arrays(source_file: str,
+                  fields: tuple,
+                  build: Callable[[str], dict],
+                  cache_dir: str = None,
+                  max_cache_size: int = DEFAULT_MAX_CACHE_SIZE,
+                  name: str = None,
+                  manifest: Callable[[dict], dict] = None) -> dict:
+    """Return the arrays that build(source_file) produces, mapped from
+    the cache if possible.
+
+    On a cache miss the arrays are built and stored as .npy files in an
+    entry keyed by the content hash of source_file (and name, if given),
+    so a changed file automatically misses the cache. If manifest is
+    given, manifest(arrays) is stored as JSON next to the arrays (see
+    read_manifest()). Cached arrays are memory-mapped read-only.
+    Afterwards, old entries are evicted so that the cache directory
+    stays below max_cache_size bytes."""
+    if cache_dir is None:
+        cache_dir = default_cache_dir(source_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = entry_key(source_file, cache_dir, name)
+    except OSError as e:
+        logging.warning(f'Hegemony cache unavailable ({e}). Parsing {source_file}')
+        return build(source_file)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(entry_dir):
+        logging.info(f'Loading {source_file} from cache entry {key}')
+        touch_entry(entry_dir)
+        return load_entry(entry_dir, fields)
+
+    arrays = build(source_file)
+    tmp_dir = make_entry_dir(cache_dir)
+    try:
+        for field in fields:
+            np.save(os.path.join(tmp_dir, f'{field}{ARRAY_SUFFIX}'), np.ascontiguousarray(arrays[field]))
+        if manifest is not None:
+            write_manifest(tmp_dir, manifest(arrays))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError as e:
+        # Another process may have created the same entry in the
+        # meantime. The parsed arrays are still valid.
+        logging.warning(f'Failed to write cache entry {key}: {e}')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return arrays
+    logging.info(f'Cached {source_file} in entry {key}')
+    evict(cache_dir, max_cache_size, keep=key)
+    return load_entry(entry_dir, fields)
+
+
+def cached_files(source_file: str,
+                 fields: tuple,
+                 write: Callable[[str, str], None],
+                 cache_dir: str = None,
+                 max_cache_size: int = DEFAULT_MAX_CACHE_SIZE,
+                 name: str = None) -> dict:
+    """Return the arrays that write(source_file, entry_dir) stores in
+    entry_dir, mapped from the cache if possible.
+
+    Like cached_arrays(), but for arrays that should not be built in
+    memory: write() has to store each of fields as an .npy file in
+    entry_dir (e.g., with np.lib.format.open_memmap()) and can add a
+    manifest with write_manifest(). If the cache is unavailable, the
+    files are written to a temporary directory that is removed once the
+    arrays are mapped."""
+    if cache_dir is None:
+        cache_dir = default_cache_dir(source_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = entry_key(source_file, cache_dir, name)
+    except OSError as e:
+        logging.warning(f'Hegemony cache unavailable ({e}). Using a temporary directory for {source_file}')
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            write(source_file, tmp_dir)
+            # Mapped arrays stay valid after their files are removed.
+            return load_entry(tmp_dir, fields)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(entry_dir):
+        logging.info(f'Loading {source_file} from cache entry {key}')
+        touch_entry(entry_dir)
+        return load_entry(entry_dir, fields)
+
+    tmp_dir = make_entry_dir(cache_dir)
+    try:
+        write(source_file, tmp_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError as e:
+        # Another process may have created the same entry in the
+        # meantime.
+        logging.warning(f'Failed to write cache entry {key}: {e}')
+        arrays = load_entry(tmp_dir, fields)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return arrays
+    logging.info(f'Cached {source_file} in entry {key}')
+    evict(cache_dir, max_cache_size, keep=key)
+    return load_entry(entry_dir, fields)
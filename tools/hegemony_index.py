@@ -0,0 +1,170 @@
+import logging
+import os
+from typing import Tuple
+
+import numpy as np
+
+from tools.hegemony import ROW_FIELDS, HegemonyColumns, batch_size_for, load_hegemony
+from tools.hegemony_cache import ARRAY_SUFFIX, DEFAULT_MAX_CACHE_SIZE, cached_files, write_manifest
+
+INDEX_ENTRY = 'index'
+INDEX_ORDERS = ('scope', 'dependency')
+INDEX_ROW_FIELDS = ('row',) + ROW_FIELDS
+INDEX_FIELDS = ('keys', 'offsets', 'ips', 'ip_order') + INDEX_ROW_FIELDS
+# Memory used to sort the rows into the index if no limit is given.
+DEFAULT_INDEX_MEMORY = 256 * 1024 ** 2
+# Keys of the dependency index combine kind and dep_id (see
+# dependency_key()). dep_ids (ASNs, IXP ids, IP indexes) are smaller.
+DEP_ID_BITS = 40
+
+
+def dependency_key(kind, dep_id):
+    """Return the key of dependency (kind, dep_id) in the dependency
+    index. Works for scalars and arrays."""
+    return np.left_shift(np.asarray(kind, dtype=np.int64), DEP_ID_BITS) | np.asarray(dep_id, dtype=np.int64)
+
+
+def split_dependency_key(key) -> tuple:
+    """Return the (kind, dep_id) of dependency index keys."""
+    return np.right_shift(key, DEP_ID_BITS), key & ((1 << DEP_ID_BITS) - 1)
+
+
+def index_keys(hegemony: HegemonyColumns, order: str, start: int, stop: int) -> np.ndarray:
+    if order == 'scope':
+        return np.asarray(hegemony.scope[start:stop])
+    return dependency_key(hegemony.kind[start:stop], hegemony.dep_id[start:stop])
+
+
+def write_index(input_file: str, entry_dir: str, order: str, memory_limit: int, cache_dir: str = None) -> None:
+    """Sort the rows of input_file by the keys of order and store them in
+    entry_dir.
+
+    The rows are sorted with a two-pass counting sort over batches of
+    the parsed (and memory-mapped) columns, so memory usage depends on
+    memory_limit and the number of distinct keys, but not on the size
+    of the file: The first pass counts the rows per key, which gives the
+    offsets of each key in the index, the second moves the rows of each
+    batch to the next free slots of their keys in the memory-mapped
+    output. Rows with the same key stay in file order."""
+    hegemony = load_hegemony(input_file, cache_dir=cache_dir)
+    num_rows = len(hegemony.scope)
+    batch_size = batch_size_for(memory_limit)
+    logging.info(f'Indexing {num_rows} rows of {input_file} by {order} in batches of {batch_size} rows')
+
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    for start in range(0, num_rows, batch_size):
+        batch_keys, batch_counts = np.unique(index_keys(hegemony, order, start, start + batch_size),
+                                             return_counts=True)
+        keys, inverse = np.unique(np.concatenate((keys, batch_keys)), return_inverse=True)
+        merged = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(merged, inverse.reshape(-1), np.concatenate((counts, batch_counts)))
+        counts = merged
+    offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+
+    columns = {field: np.lib.format.open_memmap(os.path.join(entry_dir, f'{field}{ARRAY_SUFFIX}'),
+                                                mode='w+',
+                                                dtype=np.int64 if field == 'row' else getattr(hegemony, field).dtype,
+                                                shape=(num_rows,))
+               for field in INDEX_ROW_FIELDS}
+    next_slot = offsets[:-1].copy()
+    for start in range(0, num_rows, batch_size):
+        key_idx = np.searchsorted(keys, index_keys(hegemony, order, start, start + batch_size))
+        batch_order = np.argsort(key_idx, kind='stable')
+        sorted_idx = key_idx[batch_order]
+        # Position of each row among the rows of its key in this batch.
+        group_starts = np.flatnonzero(np.r_[True, sorted_idx[1:] != sorted_idx[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(sorted_idx)])
+        rank = np.arange(len(sorted_idx)) - np.repeat(group_starts, group_sizes)
+        slots = next_slot[sorted_idx] + rank
+        columns['row'][slots] = start + batch_order
+        for field in ROW_FIELDS:
+            columns[field][slots] = getattr(hegemony, field)[start:start + batch_size][batch_order]
+        next_slot += np.bincount(key_idx, minlength=len(keys))
+    for values in columns.values():
+        values.flush()
+    del columns
+
+    ips = np.asarray(hegemony.ips)
+    np.save(os.path.join(entry_dir, f'keys{ARRAY_SUFFIX}'), keys)
+    np.save(os.path.join(entry_dir, f'offsets{ARRAY_SUFFIX}'), offsets)
+    np.save(os.path.join(entry_dir, f'ips{ARRAY_SUFFIX}'), ips)
+    np.save(os.path.join(entry_dir, f'ip_order{ARRAY_SUFFIX}'), np.argsort(ips, kind='stable').astype(np.int64))
+    write_manifest(entry_dir, {'source': os.path.basename(input_file),
+                               'order': order,
+                               'rows': num_rows,
+                               'keys': len(keys),
+                               'max_rows_per_key': int(counts.max(initial=0)),
+                               'ips': len(ips)})
+
+
+class HegemonyIndex:
+    """Rows of a hegemony file sorted by scope or by dependency (see
+    load_index()).
+
+    Keys are sorted and the rows of keys[i] are rows offsets[i] to
+    offsets[i + 1], so the rows of a key are found with a binary search.
+    All arrays are memory-mapped, i.e., only the rows that are looked up
+    are read from disk."""
+
+    def __init__(self, order: str, arrays: dict) -> None:
+        self.order = order
+        self.keys = arrays['keys']
+        self.offsets = arrays['offsets']
+        self.ips = arrays['ips']
+        self.ip_order = arrays['ip_order']
+        self.columns = {field: arrays[field] for field in INDEX_ROW_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def key_range(self, key: int) -> Tuple[int, int]:
+        """Return the (start, stop) rows of key, which are empty if the
+        key does not exist."""
+        idx = int(np.searchsorted(self.keys, key))
+        if idx == len(self.keys) or self.keys[idx] != key:
+            return 0, 0
+        return int(self.offsets[idx]), int(self.offsets[idx + 1])
+
+    def rows(self, start: int, stop: int) -> HegemonyColumns:
+        return HegemonyColumns(ips=self.ips, **{field: self.columns[field][start:stop] for field in ROW_FIELDS})
+
+    def row_numbers(self, start: int, stop: int) -> np.ndarray:
+        """Return the positions of rows [start, stop) in the file."""
+        return self.columns['row'][start:stop]
+
+    def lookup(self, key: int) -> HegemonyColumns:
+        return self.rows(*self.key_range(key))
+
+    def ip_id(self, ip: str) -> int:
+        """Return the dep_id of ip, or None if the file does not contain
+        ip."""
+        idx = int(np.searchsorted(self.ips, ip, sorter=self.ip_order))
+        if idx == len(self.ips) or self.ips[self.ip_order[idx]] != ip:
+            return None
+        return int(self.ip_order[idx])
+
+
+def load_index(input_file: str,
+               order: str,
+               memory_limit: int = None,
+               cache_dir: str = None,
+               max_cache_size: int = DEFAULT_MAX_CACHE_SIZE) -> HegemonyIndex:
+    """Return the rows of a *.hegemony.csv file sorted by scope (order
+    'scope') or by dependency (order 'dependency', with keys from
+    dependency_key()).
+
+    The index is built once from the cached columns of the file (see
+    write_index()) and stored in the cache. memory_limit (in bytes)
+    bounds the memory used for sorting."""
+    if order not in INDEX_ORDERS:
+        raise ValueError(f'Invalid index order: {order}')
+    if memory_limit is None:
+        memory_limit = DEFAULT_INDEX_MEMORY
+    arrays = cached_files(input_file,
+                          INDEX_FIELDS,
+                          lambda f, entry_dir: write_index(f, entry_dir, order, memory_limit, cache_dir),
+                          cache_dir,
+                          max_cache_size,
+                          name=f'{INDEX_ENTRY}.{order}')
+    return HegemonyIndex(order, arrays)
@@ -0,0 +1,110 @@
+import logging
+import os
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from tools.atomic_files import atomic_open
+
+DATA_DELIMITER = ','
+ENTITY_TYPES = ('asn', 'ix', 'ip', 'cc')
+# Marker for values without an id (e.g., in lookup tables).
+NO_ID = -1
+
+
+class Interner:
+    """Map values of each entity type (ASNs, IXP ids, IPs, country codes)
+    to dense integer ids, starting at 0 for each type.
+
+    Values are stored in their canonical string form, i.e., the ASN 3356
+    and the string '3356' get the same id. The id assignment can be
+    saved to and loaded from a file so that ids are stable across
+    scripts and runs."""
+
+    def __init__(self) -> None:
+        self.ids = {entity_type: dict() for entity_type in ENTITY_TYPES}
+        self.values = {entity_type: list() for entity_type in ENTITY_TYPES}
+
+    def intern(self, entity_type: str, value) -> int:
+        """Return the id of value, assigning a new one if required."""
+        ids = self.ids[entity_type]
+        value = str(value)
+        if value not in ids:
+            ids[value] = len(ids)
+            self.values[entity_type].append(value)
+        return ids[value]
+
+    def intern_array(self, entity_type: str, values: Iterable) -> np.ndarray:
+        """Return an int32 array with the ids of values, assigning new ids
+        if required. Each distinct value is only hashed once."""
+        uniques, inverse = np.unique(np.asarray(values), return_inverse=True)
+        unique_ids = np.fromiter((self.intern(entity_type, value) for value in uniques.tolist()),
+                                 dtype=np.int32,
+                                 count=len(uniques))
+        return unique_ids[inverse.reshape(-1)]
+
+    def get(self, entity_type: str, value, default: int = NO_ID) -> int:
+        """Return the id of value or default if it was never interned."""
+        return self.ids[entity_type].get(str(value), default)
+
+    def value(self, entity_type: str, entity_id: int) -> str:
+        return self.values[entity_type][entity_id]
+
+    def value_array(self, entity_type: str) -> np.ndarray:
+        """Return an array of all values of entity_type indexed by id."""
+        return np.asarray(self.values[entity_type], dtype=str)
+
+    def size(self, entity_type: str) -> int:
+        return len(self.values[entity_type])
+
+    def save(self, output_file: str) -> None:
+        """Write the id assignment to output_file (atomically)."""
+        with atomic_open(output_file) as f:
+            headers = ('type', 'id', 'value')
+            f.write(DATA_DELIMITER.join(headers) + '\n')
+            for entity_type in ENTITY_TYPES:
+                for entity_id, value in enumerate(self.values[entity_type]):
+                    f.write(DATA_DELIMITER.join((entity_type, str(entity_id), value)) + '\n')
+
+    @classmethod
+    def load(cls, input_file: str) -> 'Interner':
+        """Read an id assignment written by save(). Return an empty
+        interner if input_file does not exist yet."""
+        ret = cls()
+        if input_file is None or not os.path.exists(input_file):
+            return ret
+        logging.info(f'Reading interned ids from {input_file}')
+        with open(input_file, 'r') as f:
+            f.readline()
+            for line in f:
+                entity_type, entity_id, value = line.rstrip('\n').split(DATA_DELIMITER)
+                if ret.intern(entity_type, value) != int(entity_id):
+                    logging.error(f'Non-dense id in interner file {input_file}: {line.strip()}')
+                    raise ValueError(f'Invalid interner file: {input_file}')
+        return ret
+
+
+def lookup_array(keys: np.ndarray, values: np.ndarray, size: int, fill: int = NO_ID) -> np.ndarray:
+    """Return an int32 array of length size with array[keys] = values and
+    fill everywhere else, i.e., a join table that can be indexed by
+    ids."""
+    ret = np.full(size, fill, dtype=np.int32)
+    ret[keys] = values
+    return ret
+
+
+def read_asn_country_ids(asn_cc_map: str, interner: Interner) -> Tuple[np.ndarray, np.ndarray]:
+    """Read an AS -> country map (asn,count,cc) and return the interned
+    ASN and country code ids. ASes that are mapped to more than one
+    country get the country code '**'."""
+    asns = list()
+    ccs = list()
+    with open(asn_cc_map, 'r') as f:
+        f.readline()
+        for line in f:
+            asn, count, cc = line.strip().split(DATA_DELIMITER)
+            if int(count) > 1:
+                cc = '**'
+            asns.append(asn)
+            ccs.append(cc)
+    return interner.intern_array('asn', asns), interner.intern_array('cc', ccs)
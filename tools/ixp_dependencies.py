@@ -0,0 +1,1001 @@
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+from collections import defaultdict, namedtuple
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from tools.atomic_files import atomic_open
+from tools.hegemony import (GLOBAL_SCOPE, KIND_IP, KIND_IX, KIND_IX_AS, HegemonyFilter, filter_mask,
+                            iter_hegemony)
+from tools.interning import NO_ID, Interner
+from tools.member_index import MemberIndex, save_member_index
+from tools.per_scope_interfaces import PerScopeInterfaces, pair_keys
+from tools.residual_index import ResidualIndex, save_residual_index
+from tools.scope_details import intern_sets, write_scope_details
+
+DATA_DELIMITER = ','
+AS0 = 0
+
+DependencyRows = namedtuple('DependencyRows', 'scope kind ix_id member ip hegemony')
+DependencyRows.__doc__ = """IXP-related rows of a hegemony file, one array entry per row (in
+file order).
+
+kind is KIND_IX, KIND_IX_AS, or KIND_IP. ix_id is only set for
+KIND_IX/KIND_IX_AS rows and ip (an interned IP id) only for KIND_IP
+rows, both are NO_ID otherwise. scope and member are int64, kind is
+int8, ix_id and ip are int32, and hegemony is float64. Global scores
+and general IXP dependencies that do not pass the filter are already
+removed, so the number of peers is not kept."""
+
+Check = namedtuple('Check', 'name fatal message')
+Check.__doc__ = """An invariant of the inputs of extract-per-as-ixp-dependencies.py.
+Fatal violations stop the script, others are only logged."""
+
+CHECK_UNREACHED_IP = Check('unreached-ip', True, 'Scope was never reached via ip, but has dependency')
+CHECK_DUPLICATE_GENERAL = Check('duplicate-general', False, 'Duplicate general IXP dependency')
+CHECK_DUPLICATE_PER_AS = Check('duplicate-per-as', False, 'Duplicate per-AS dependency')
+CHECK_NO_INTERFACES = Check('no-interfaces', True, 'Scope not in per_scope_interfaces or no entry for ix_id')
+CHECK_NO_AS0_INTERFACES = Check('no-as0-interfaces', True, 'No AS0 interfaces for scope/ix_id')
+CHECK_NO_DIRECT = Check('no-direct', True, 'Direct AS hegemony value is None')
+CHECK_AS0_SUM = Check('as0-sum', True, 'Sum of AS0 interface dependencies larger than general')
+CHECK_ONLY_AS0 = Check('only-as0', True, 'Only AS0 interfaces, but no AS0 dependency')
+CHECK_UNKNOWN_MEMBER = Check('unknown-member', True, 'Per-AS dependency not in per_scope_interfaces')
+CHECK_NO_OTHER_ASES = Check('no-other-ases', True, 'There should be other ASes / AS0 interfaces')
+CHECK_NO_OTHER_SHARED_ASES = Check('no-other-shared-ases', False,
+                                   'There should be other ASes / AS0 interfaces (multiple per-AS dependencies)')
+# All checks in the order in which validate_dependencies() reports them.
+CHECKS = (CHECK_UNREACHED_IP, CHECK_DUPLICATE_GENERAL, CHECK_DUPLICATE_PER_AS, CHECK_NO_DIRECT,
+          CHECK_NO_INTERFACES, CHECK_NO_AS0_INTERFACES, CHECK_AS0_SUM, CHECK_ONLY_AS0, CHECK_UNKNOWN_MEMBER,
+          CHECK_NO_OTHER_ASES, CHECK_NO_OTHER_SHARED_ASES)
+
+# Categories of (ix_id, scope) pairs (see classify_pairs()).
+CATEGORY_SINGLE = 0
+CATEGORY_MULTIPLE = 1
+CATEGORY_MIXED = 2
+CATEGORY_UNKNOWN = 3
+CATEGORY_NAMES = ('single', 'multiple', 'mixed', 'unknown')
+NO_CATEGORY = -1
+# On which ASes a scope depends if its per-AS scores add up to less than
+# the general score (see ClassificationPolicy).
+LESS_KNOWN = 'known'
+LESS_PER_AS = 'per-as'
+# Sources of the ASes and interfaces a scope depends on.
+SOURCE_NONE = 0
+# All ASes (except AS0) over which the scope reached the IXP.
+AS_SOURCE_KNOWN = 1
+# The ASes with a per-AS dependency.
+AS_SOURCE_PER_AS = 2
+# All AS0 interfaces over which the scope reached the IXP.
+INTERFACE_SOURCE_AS0 = 1
+# The AS0 interfaces with an IP dependency.
+INTERFACE_SOURCE_AS0_VIA_IP = 2
+# Fields of DependencyTables with interned ids of these entity types.
+# They are stored as values by save_tables().
+TABLE_VALUE_FIELDS = {'pair_cc': 'cc', 'interface_ip': 'ip'}
+TABLE_METADATA = 'metadata'
+# First row of pairs that no row refers to.
+NEVER = np.iinfo(np.int64).max
+
+DependencyTables = namedtuple('DependencyTables', 'pair_ix pair_cc pair_category pair_scope pair_first pair_asn '
+                                                  'pair_general_residual pair_interface_residual '
+                                                  'as_first as_asn interface_first interface_ip')
+DependencyTables.__doc__ = """Classified (ix_id, scope) pairs with a general dependency, which is
+all that is needed to summarize them (see summarize_tables()).
+
+The pair_* arrays have one entry per pair: its IXP, the country id of
+its scope, its category (CATEGORY_* or NO_CATEGORY), scope, the first
+row that refers to it (which orders and identifies the pair), for
+singles, the member ASN, and the residuals of its decomposition (see
+pair_residuals()). The ASes and interfaces (IP ids) a pair
+depends on are listed as rows of as_* and interface_*, whose *_first
+refers to the pair_first of their pair."""
+
+DependencyDetails = namedtuple('DependencyDetails', 'scopes participant_sets members residuals')
+DependencyDetails.__doc__ = """Scopes of the single and multiple dependencies per IXP and country
+(see map_dependencies()). Multiple dependencies are keyed by the id
+of their set of ASes in participant_sets (ParticipantSets). members
+(MemberIndex) maps each IXP member to the scopes that depend on it and
+residuals (ResidualIndex) holds the residuals of all pairs."""
+
+ClassificationPolicy = namedtuple('ClassificationPolicy', 'name rtol atol less_ases',
+                                  defaults=('default', 1e-05, 1e-08, LESS_KNOWN))
+ClassificationPolicy.__doc__ = """Parameters of classify_pairs() (see parse_policy()).
+
+Several per-AS scores, or the scores of the IP dependencies of AS0,
+add up to the general score if their sum is within rtol and atol of it
+(see np.isclose()), a single per-AS score has to be equal. If the
+per-AS scores add up to less, the scope depends on all known ASes over
+which it reached the IXP (LESS_KNOWN), or only on the ASes with a
+per-AS score (LESS_PER_AS)."""
+DEFAULT_POLICY = ClassificationPolicy()
+
+IdBitmaps = namedtuple('IdBitmaps', 'key word bits')
+IdBitmaps.__doc__ = """Sets of non-negative integer ids, one per key, as sparse bitmaps (see
+id_bitmaps()).
+
+Only the non-zero 64-bit words of each set are stored, sorted by (key,
+word): bits has bit j set if id word * 64 + j is part of the set of
+key. Sets of dense ids (interned or ranked) take a fraction of the
+memory of the ids themselves, and unions are bitwise ORs of the words."""
+
+Violation = namedtuple('Violation', 'check ix_id scope detail')
+Violation.__doc__ = """All violations of one check. ix_id, scope, and detail are arrays
+with one entry per violating (ix_id, scope) pair. detail is the member
+ASN for per-AS checks and the interned IP id for CHECK_UNREACHED_IP
+(ix_id is NO_ID then), and NO_ID for all other checks."""
+
+
+def iter_dependency_rows(input_file: str,
+                         interner: Interner,
+                         hegemony_filter: HegemonyFilter,
+                         memory_limit: int = None) -> Iterator[DependencyRows]:
+    """Yield the IXP, IXP member, and IP dependencies of a hegemony file
+    as DependencyRows batches (in file order, see iter_hegemony()).
+
+    General IXP dependencies are filtered here, because if the general
+    dependency is already filtered, the scope does not need to be
+    processed for this IXP later. Per-AS dependencies should be smaller
+    or equal."""
+    ips = None
+    for hegemony in iter_hegemony(input_file, memory_limit, kinds=(KIND_IX, KIND_IX_AS, KIND_IP)):
+        # Batches read from the cache share the IP table of the file.
+        if hegemony.ips is not ips:
+            ips = hegemony.ips
+            ip_ids = interner.intern_array('ip', ips)
+        general_mask = filter_mask(hegemony, hegemony_filter, (KIND_IX,))
+        mask = ((hegemony.kind == KIND_IX_AS) | (hegemony.kind == KIND_IP) | general_mask) \
+            & (hegemony.scope != GLOBAL_SCOPE)
+        kind = hegemony.kind[mask]
+        dep_id = hegemony.dep_id[mask]
+        is_ip = kind == KIND_IP
+        ip = np.full(len(kind), NO_ID, dtype=np.int32)
+        ip[is_ip] = ip_ids[dep_id[is_ip]]
+        yield DependencyRows(hegemony.scope[mask],
+                             kind,
+                             np.where(is_ip, NO_ID, dep_id).astype(np.int32),
+                             hegemony.member[mask],
+                             ip,
+                             hegemony.hegemony[mask])
+
+
+def load_dependency_rows(input_file: str,
+                         interner: Interner,
+                         hegemony_filter: HegemonyFilter,
+                         memory_limit: int = None) -> DependencyRows:
+    """Read the IXP, IXP member, and IP dependencies of a hegemony file
+    (see iter_dependency_rows())."""
+    parts = list(iter_dependency_rows(input_file, interner, hegemony_filter, memory_limit))
+    if len(parts) == 1:
+        return parts[0]
+    return DependencyRows(*(np.concatenate(columns) for columns in zip(*parts)))
+
+
+def interface_keys(rows: DependencyRows) -> tuple:
+    """Return the sorted pair_keys() of the (scope, ix_id) pairs of the
+    general IXP dependencies and of the (scope, ip) pairs of the IP
+    dependencies in rows. Only per-scope interfaces that match these
+    keys are needed to process rows."""
+    general = rows.kind == KIND_IX
+    ip = rows.kind == KIND_IP
+    return (np.unique(pair_keys(rows.scope[general], rows.ix_id[general])),
+            np.unique(pair_keys(rows.scope[ip], rows.ip[ip])))
+
+
+def group_keys(tables: list) -> list:
+    """Return dense int64 keys for the rows of each table in tables (a
+    list of tuples of columns). Rows with equal values in all columns
+    get the same key, also across tables."""
+    lengths = [len(columns[0]) for columns in tables]
+    keys = np.zeros(sum(lengths), dtype=np.int64)
+    for columns in zip(*tables):
+        values, codes = np.unique(np.concatenate(columns), return_inverse=True)
+        # Make the combined keys dense again, so they never overflow.
+        _, keys = np.unique(keys * len(values) + codes.reshape(-1), return_inverse=True)
+        keys = keys.reshape(-1)
+    return np.split(keys, np.cumsum(lengths)[:-1])
+
+
+def last_row(keys: np.ndarray, size: int) -> np.ndarray:
+    """Return the index of the last row with each key (NO_ID for keys
+    without rows)."""
+    ret = np.full(size, NO_ID, dtype=np.int64)
+    np.maximum.at(ret, keys, np.arange(len(keys)))
+    return ret
+
+
+def digit_masks(values: np.ndarray) -> np.ndarray:
+    """Return a bit mask of the decimal digits of each value."""
+    ret = np.where(values == 0, 1, 0).astype(np.int64)
+    values = values.copy()
+    while (values > 0).any():
+        positive = values > 0
+        ret[positive] |= np.left_shift(1, values[positive] % 10)
+        values //= 10
+    return ret
+
+
+class DependencyGroups:
+    """DependencyRows and PerScopeInterfaces grouped by (ix_id, scope)
+    pairs and by (ix_id, scope, member) triples ("members").
+
+    Pairs and members get dense ids and the pair_* and member_*
+    attributes, as well as the aggregates below, are arrays indexed by
+    these ids. IP dependencies are mapped to their (ix_id, member) via
+    the last interface of the scope with the same IP.
+
+    The order of the rows is kept where extract-per-as-ixp-dependencies.py
+    depends on it: pair_first and member_first are the first rows that
+    refer to a pair/member, and sums are computed in the order in which
+    the values appear, so that they are identical to summing them one
+    by one."""
+
+    def __init__(self, rows: DependencyRows, interfaces: PerScopeInterfaces) -> None:
+        ip_rows = np.flatnonzero(rows.kind == KIND_IP)
+        interface_ip_keys, ip_keys = group_keys([(interfaces.scope, interfaces.ip),
+                                                 (rows.scope[ip_rows], rows.ip[ip_rows])])
+        last_interface = last_row(interface_ip_keys, max(interface_ip_keys.max(initial=-1),
+                                                         ip_keys.max(initial=-1)) + 1)[ip_keys]
+        unreached = last_interface == NO_ID
+        self.unreached_scope = rows.scope[ip_rows[unreached]]
+        self.unreached_ip = rows.ip[ip_rows[unreached]]
+        self.via_ip_rows = ip_rows[~unreached]
+        self.via_ip_ip = rows.ip[self.via_ip_rows]
+        self.via_ip_asn = interfaces.asn[last_interface[~unreached]]
+        via_ip_ix = interfaces.ix_id[last_interface[~unreached]]
+
+        general_rows = np.flatnonzero(rows.kind == KIND_IX)
+        direct_rows = np.flatnonzero(rows.kind == KIND_IX_AS)
+        general_pairs, direct_pairs, self.via_ip_pairs, self.interface_pairs = group_keys(
+            [(rows.ix_id[general_rows], rows.scope[general_rows]),
+             (rows.ix_id[direct_rows], rows.scope[direct_rows]),
+             (via_ip_ix, rows.scope[self.via_ip_rows]),
+             (interfaces.ix_id, interfaces.scope)])
+        direct_members, via_ip_members, self.interface_members = group_keys(
+            [(rows.ix_id[direct_rows], rows.scope[direct_rows], rows.member[direct_rows]),
+             (via_ip_ix, rows.scope[self.via_ip_rows], self.via_ip_asn),
+             (interfaces.ix_id, interfaces.scope, interfaces.asn)])
+        self.interface_asn = interfaces.asn
+        self.interface_ip = interfaces.ip
+        num_pairs = max(keys.max(initial=-1)
+                        for keys in (general_pairs, direct_pairs, self.via_ip_pairs, self.interface_pairs)) + 1
+        num_members = max(keys.max(initial=-1)
+                          for keys in (direct_members, via_ip_members, self.interface_members)) + 1
+        self.num_pairs = num_pairs
+        self.num_members = num_members
+
+        self.pair_ix = np.zeros(num_pairs, dtype=np.int64)
+        self.pair_scope = np.zeros(num_pairs, dtype=np.int64)
+        self.member_pair = np.zeros(num_members, dtype=np.int64)
+        self.member_asn = np.zeros(num_members, dtype=np.int64)
+        for pairs, members, ix_id, scope, asn in (
+                (direct_pairs, direct_members, rows.ix_id[direct_rows], rows.scope[direct_rows],
+                 rows.member[direct_rows]),
+                (self.via_ip_pairs, via_ip_members, via_ip_ix, rows.scope[self.via_ip_rows], self.via_ip_asn),
+                (self.interface_pairs, self.interface_members, interfaces.ix_id, interfaces.scope,
+                 interfaces.asn)):
+            self.pair_ix[pairs] = ix_id
+            self.pair_scope[pairs] = scope
+            self.member_pair[members] = pairs
+            self.member_asn[members] = asn
+        self.pair_ix[general_pairs] = rows.ix_id[general_rows]
+        self.pair_scope[general_pairs] = rows.scope[general_rows]
+
+        # Pairs and members that only appear in the interfaces are
+        # never referred to.
+        self.pair_first = np.full(num_pairs, NEVER, dtype=np.int64)
+        self.member_first = np.full(num_members, NEVER, dtype=np.int64)
+        for first, keys, key_rows in ((self.pair_first, general_pairs, general_rows),
+                                      (self.pair_first, direct_pairs, direct_rows),
+                                      (self.pair_first, self.via_ip_pairs, self.via_ip_rows),
+                                      (self.member_first, direct_members, direct_rows),
+                                      (self.member_first, via_ip_members, self.via_ip_rows)):
+            np.minimum.at(first, keys, key_rows)
+
+        # General dependency (the last one if there are duplicates).
+        self.general_count = np.bincount(general_pairs, minlength=num_pairs)
+        self.has_general = self.general_count > 0
+        self.general_hege = np.zeros(num_pairs)
+        self.general_hege[self.has_general] = \
+            rows.hegemony[general_rows[last_row(general_pairs, num_pairs)[self.has_general]]]
+
+        # Per-AS dependencies: members with a direct or via-IP dependency.
+        self.direct_count = np.bincount(direct_members, minlength=num_members)
+        self.has_direct = self.direct_count > 0
+        self.direct_hege = np.zeros(num_members)
+        self.direct_hege[self.has_direct] = \
+            rows.hegemony[direct_rows[last_row(direct_members, num_members)[self.has_direct]]]
+        self.per_as = self.has_direct.copy()
+        self.per_as[via_ip_members] = True
+        self.per_as_count = np.bincount(self.member_pair[self.per_as], minlength=num_pairs)
+        self.no_direct = np.bincount(self.member_pair[self.per_as & ~self.has_direct], minlength=num_pairs) > 0
+        by_first = np.argsort(self.member_first, kind='stable')
+        summed = by_first[self.has_direct[by_first]]
+        self.hege_sum = np.bincount(self.member_pair[summed], weights=self.direct_hege[summed], minlength=num_pairs)
+        self.single_asn = np.zeros(num_pairs, dtype=np.int64)
+        self.single_asn[self.member_pair[self.per_as]] = self.member_asn[self.per_as]
+        self.as0_per_as = np.zeros(num_pairs, dtype=bool)
+        self.as0_per_as[self.member_pair[self.per_as & (self.member_asn == AS0)]] = True
+        # IP dependencies per member, which should add up to its per-AS
+        # score (see pair_residuals()).
+        self.has_ips = np.bincount(via_ip_members, minlength=num_members) > 0
+        self.ip_sum = np.bincount(via_ip_members, weights=rows.hegemony[self.via_ip_rows], minlength=num_members)
+        as0_via_ip = self.via_ip_asn == AS0
+        self.as0_ip_count = np.bincount(self.via_ip_pairs[as0_via_ip], minlength=num_pairs)
+        self.as0_ip_sum = np.bincount(self.via_ip_pairs[as0_via_ip],
+                                      weights=rows.hegemony[self.via_ip_rows[as0_via_ip]],
+                                      minlength=num_pairs)
+
+        # Interfaces over which the scope was reached.
+        self.has_interfaces = np.bincount(self.interface_pairs, minlength=num_pairs) > 0
+        self.has_as0_interfaces = np.zeros(num_pairs, dtype=bool)
+        self.has_as0_interfaces[self.interface_pairs[interfaces.asn == AS0]] = True
+        self.known = np.zeros(num_members, dtype=bool)
+        self.known[self.interface_members[interfaces.asn != AS0]] = True
+        self.known_count = np.bincount(self.member_pair[self.known], minlength=num_pairs)
+        # Whether there are no known ASes besides the per-AS dependencies.
+        # For a single per-AS dependency, the known ASes are compared to
+        # the digits of the ASN (a leftover of string ASNs).
+        single_digits = digit_masks(self.single_asn)[self.member_pair]
+        covered = np.where(self.per_as_count[self.member_pair] == 1,
+                           (self.member_asn < 10)
+                           & (np.right_shift(single_digits, np.minimum(self.member_asn, 9)) & 1 == 1),
+                           self.per_as)
+        self.only_covered = np.bincount(self.member_pair[self.known & covered], minlength=num_pairs) \
+            == self.known_count
+        self.single_known = np.zeros(num_pairs, dtype=bool)
+        self.single_known[self.member_pair[self.known & self.per_as]] = True
+
+
+def validate_dependencies(groups: DependencyGroups) -> list:
+    """Check all invariants that classify_pairs() relies on at once and
+    return a list of Violations.
+
+    The checks follow the decisions of classify_pairs() for all pairs at
+    once, so that all violating pairs are reported and not only the
+    first one."""
+    ret = [Violation(CHECK_UNREACHED_IP,
+                     np.full(len(groups.unreached_scope), NO_ID, dtype=np.int64),
+                     groups.unreached_scope,
+                     groups.unreached_ip)]
+
+    def violation(check: Check, mask: np.ndarray, detail: np.ndarray = None) -> None:
+        pairs = np.flatnonzero(mask)
+        if detail is None:
+            detail = np.full(groups.num_pairs, NO_ID, dtype=np.int64)
+        ret.append(Violation(check, groups.pair_ix[pairs], groups.pair_scope[pairs], detail[pairs]))
+
+    # Duplicates are only logged and the last value is used.
+    violation(CHECK_DUPLICATE_GENERAL, groups.general_count > 1)
+    duplicates = np.flatnonzero(groups.direct_count > 1)
+    ret.append(Violation(CHECK_DUPLICATE_PER_AS,
+                         groups.pair_ix[groups.member_pair[duplicates]],
+                         groups.pair_scope[groups.member_pair[duplicates]],
+                         groups.member_asn[duplicates]))
+
+    general = groups.has_general
+    general_hege = groups.general_hege
+    per_as_count = groups.per_as_count
+    hege_sum = groups.hege_sum
+    known_count = groups.known_count
+    has_as0_interfaces = groups.has_as0_interfaces
+    need_interfaces = general & (per_as_count == 0)
+    need_as0_interfaces = np.zeros(groups.num_pairs, dtype=bool)
+    violation(CHECK_NO_DIRECT, general & (per_as_count > 0) & groups.no_direct)
+    as0_close = np.isclose(groups.as0_ip_sum, general_hege)
+    as0_larger = ~as0_close & (groups.as0_ip_sum > general_hege)
+    as0_sum = np.zeros(groups.num_pairs, dtype=bool)
+
+    single = general & (per_as_count == 1) & ~groups.no_direct
+    single_as0 = single & (hege_sum == general_hege) & (groups.single_asn == AS0)
+    need_as0_interfaces |= single_as0 & ((groups.as0_ip_count == 0) | (~as0_close & ~as0_larger))
+    as0_sum |= single_as0 & (groups.as0_ip_count > 0) & as0_larger
+    single_less = single & (hege_sum < general_hege)
+    need_interfaces |= single_less
+    only_as0 = single_less & (known_count == 0)
+    unknown_member = single_less & (known_count > 0) & (groups.single_asn != AS0) & ~groups.single_known
+    no_other_ases = single_less & (known_count > 0) & ((groups.single_asn == AS0) | groups.single_known) \
+        & groups.only_covered & ~has_as0_interfaces
+
+    multiple = general & (per_as_count > 1) & ~groups.no_direct
+    multiple_close = np.isclose(hege_sum, general_hege)
+    multiple_as0 = multiple & multiple_close & groups.as0_per_as
+    need_as0_interfaces |= multiple_as0 & ((groups.as0_ip_count == 0) | (~as0_close & ~as0_larger))
+    as0_sum |= multiple_as0 & (groups.as0_ip_count > 0) & as0_larger
+    multiple_less = multiple & ~multiple_close & (hege_sum < general_hege)
+    need_interfaces |= multiple_less
+    only_as0 |= multiple_less & (known_count == 0)
+    no_other_shared_ases = multiple_less & (known_count > 0) & groups.only_covered & ~has_as0_interfaces
+
+    has_interfaces = groups.has_interfaces
+    need_interfaces |= need_as0_interfaces
+    violation(CHECK_NO_INTERFACES, need_interfaces & ~has_interfaces)
+    violation(CHECK_NO_AS0_INTERFACES, need_as0_interfaces & has_interfaces & ~has_as0_interfaces)
+    violation(CHECK_AS0_SUM, as0_sum)
+    violation(CHECK_ONLY_AS0, only_as0 & has_interfaces)
+    violation(CHECK_UNKNOWN_MEMBER, unknown_member & has_interfaces, groups.single_asn)
+    violation(CHECK_NO_OTHER_ASES, no_other_ases & has_interfaces, groups.single_asn)
+    violation(CHECK_NO_OTHER_SHARED_ASES, no_other_shared_ases & has_interfaces)
+    return [v for v in ret if len(v.scope) > 0]
+
+
+def parse_policy(spec: str) -> ClassificationPolicy:
+    """Parse a ClassificationPolicy from NAME[:FIELD=VALUE,...], e.g.,
+    "loose:rtol=0.01,less_ases=per-as". Fields that are not given keep
+    their default."""
+    name, _, params = spec.partition(':')
+    if not name or name == DEFAULT_POLICY.name or os.sep in name:
+        raise ValueError(f'Invalid policy name: {name}')
+    values = dict()
+    for param in filter(None, params.split(',')):
+        field, sep, value = param.partition('=')
+        field = field.replace('-', '_')
+        if not sep or field not in ClassificationPolicy._fields[1:]:
+            raise ValueError(f'Invalid policy parameter: {param}')
+        values[field] = value if field == 'less_ases' else float(value)
+    if values.get('less_ases', LESS_KNOWN) not in (LESS_KNOWN, LESS_PER_AS):
+        raise ValueError(f'Invalid less_ases: {values["less_ases"]}')
+    return ClassificationPolicy(name, **values)
+
+
+def classify_pairs(groups: DependencyGroups, policy: ClassificationPolicy = DEFAULT_POLICY) -> tuple:
+    """Return the category (CATEGORY_*, or NO_CATEGORY) of each pair
+    and where the ASes and the interfaces the scope depends on come
+    from (AS_SOURCE_* and INTERFACE_SOURCE_*).
+
+    Pairs without a general dependency (i.e., it was filtered) get no
+    category. The inputs have to pass validate_dependencies().
+
+    No per-AS dependency: Depending on the interfaces over which the
+    scope reached the IXP, the scope depends on all AS0 interfaces
+    (only AS0, unknown), shared over all known ASes (only known ASes,
+    multiple), or both (mixed).
+
+    One per-AS dependency with the same score as the general one: The
+    scope depends entirely on this AS (single) or, for AS0, on its IP
+    dependencies if their scores add up to the general one, or on all
+    AS0 interfaces otherwise (unknown). With a smaller score, there are
+    other dependencies that may be too small to be listed, so the scope
+    depends on all known ASes (multiple), and all AS0 interfaces if there
+    are any (mixed).
+
+    Multiple per-AS dependencies that add up to the general score: The
+    scope depends on these ASes (multiple), and, if AS0 is one of them,
+    on its IP dependencies or all AS0 interfaces (like above, mixed). If
+    they add up to less, it is handled like a single smaller score.
+
+    Per-AS scores larger than the general score are ignored (and
+    logged). How scores are compared and how smaller scores are handled
+    can be changed with policy."""
+    category = np.full(groups.num_pairs, NO_CATEGORY, dtype=np.int8)
+    as_source = np.full(groups.num_pairs, SOURCE_NONE, dtype=np.int8)
+    interface_source = np.full(groups.num_pairs, SOURCE_NONE, dtype=np.int8)
+
+    def assign(mask: np.ndarray, pair_category: int, ases: int = SOURCE_NONE, interfaces=SOURCE_NONE) -> None:
+        category[mask] = pair_category
+        as_source[mask] = ases
+        interface_source[mask] = np.broadcast_to(interfaces, mask.shape)[mask]
+
+    general = groups.has_general
+    general_hege = groups.general_hege
+    hege_sum = groups.hege_sum
+
+    def close(values: np.ndarray) -> np.ndarray:
+        return np.isclose(values, general_hege, rtol=policy.rtol, atol=policy.atol)
+
+    as0_interfaces = np.where((groups.as0_ip_count > 0) & close(groups.as0_ip_sum),
+                              INTERFACE_SOURCE_AS0_VIA_IP,
+                              INTERFACE_SOURCE_AS0)
+    has_as0_interfaces = groups.has_as0_interfaces
+
+    none = general & (groups.per_as_count == 0)
+    assign(none & has_as0_interfaces & (groups.known_count == 0), CATEGORY_UNKNOWN,
+           interfaces=INTERFACE_SOURCE_AS0)
+    assign(none & ~has_as0_interfaces, CATEGORY_MULTIPLE, AS_SOURCE_KNOWN)
+    assign(none & has_as0_interfaces & (groups.known_count > 0), CATEGORY_MIXED, AS_SOURCE_KNOWN,
+           INTERFACE_SOURCE_AS0)
+
+    single = general & (groups.per_as_count == 1)
+    single_equal = single & (hege_sum == general_hege)
+    multiple = general & (groups.per_as_count > 1)
+    multiple_close = multiple & close(hege_sum)
+    less = (single & (hege_sum < general_hege)) | (multiple & ~multiple_close & (hege_sum < general_hege))
+    if policy.less_ases == LESS_PER_AS:
+        # Handle smaller scores as if they added up.
+        single_equal |= less & single
+        multiple_close |= less & multiple
+        less = np.zeros_like(less)
+
+    assign(single_equal & (groups.single_asn != AS0), CATEGORY_SINGLE, AS_SOURCE_PER_AS)
+    assign(single_equal & (groups.single_asn == AS0), CATEGORY_UNKNOWN, interfaces=as0_interfaces)
+    assign(multiple_close & ~groups.as0_per_as, CATEGORY_MULTIPLE, AS_SOURCE_PER_AS)
+    assign(multiple_close & groups.as0_per_as, CATEGORY_MIXED, AS_SOURCE_PER_AS, as0_interfaces)
+    assign(less & ~has_as0_interfaces, CATEGORY_MULTIPLE, AS_SOURCE_KNOWN)
+    assign(less & has_as0_interfaces, CATEGORY_MIXED, AS_SOURCE_KNOWN, INTERFACE_SOURCE_AS0)
+
+    weird = np.flatnonzero(general & (category == NO_CATEGORY))
+    if len(weird) > 0:
+        logging.warning(f'Weird case were per-AS hegemony is larger than general: {len(weird)} (ix_id, scope) '
+                        f'pairs')
+        for pair in weird.tolist():
+            logging.debug(f'ix_id:{groups.pair_ix[pair]} scope:{groups.pair_scope[pair]} '
+                          f'general:{groups.general_hege[pair]} per-as:{groups.hege_sum[pair]}')
+    return category, as_source, interface_source
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """Return the number of set bits of each uint64 word."""
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = (words & np.uint64(0x3333333333333333)) + ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return ((words * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def union_bitmaps(bitmaps: IdBitmaps, key_map: np.ndarray = None) -> IdBitmaps:
+    """Return the union of the sets of bitmaps per key_map[key], which
+    defaults to the key itself (to merge words of the same key)."""
+    keys = bitmaps.key if key_map is None else key_map[bitmaps.key]
+    order = np.lexsort((bitmaps.word, keys))
+    keys, words, bits = keys[order], bitmaps.word[order], bitmaps.bits[order]
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (words[1:] != words[:-1])])
+    if not len(bits):
+        return IdBitmaps(keys, words, bits)
+    return IdBitmaps(keys[starts], words[starts], np.bitwise_or.reduceat(bits, starts))
+
+
+def id_bitmaps(keys: np.ndarray, ids: np.ndarray) -> IdBitmaps:
+    """Return the set of ids of each key."""
+    return union_bitmaps(IdBitmaps(keys,
+                                   ids >> 6,
+                                   np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64))))
+
+
+def bitmap_sizes(bitmaps: IdBitmaps, num_keys: int) -> np.ndarray:
+    """Return the number of ids in the set of each key."""
+    return np.bincount(bitmaps.key, weights=popcount(bitmaps.bits), minlength=num_keys).astype(np.int64)
+
+
+def map_dependencies(groups: DependencyGroups,
+                     pair_cc: np.ndarray,
+                     processes: int = 1,
+                     policy: ClassificationPolicy = DEFAULT_POLICY) -> tuple:
+    """Classify all pairs with policy (see classify_pairs()) and
+    summarize them per IXP and country (pair_cc is the country id of
+    each pair's scope). Since groups only depend on the inputs, they
+    can be shared by the runs for several policies.
+
+    Return (ixp_dependencies, ix_summary, details):
+      ixp_dependencies[ix_id][cc]:
+        'general': count
+        'single': {asn: count} (in the order in which the ASes appear)
+        'multiple': (count, number of ASes)
+        'mixed': (count, number of ASes, number of interfaces)
+        'unknown': (count, number of interfaces)
+      ix_summary[ix_id]: The same for all countries combined, with
+        'general' as (count, number of ASes, number of interfaces),
+        'single' as (count, number of ASes), and 'mixed' as (count,
+        number of ASes) (the per-IXP interfaces of mixed dependencies
+        are only part of 'general').
+      details: DependencyDetails with scopes[ix_id][cc]:
+        'single': asn -> list of scopes
+        'multiple': participant set id -> list of scopes
+    ASes and interfaces are counted distinctly, scopes are listed in the
+    order in which they appear in the hegemony file.
+
+    With more than one process, the IXPs are split into one shard per
+    process (see shard_ixps()) that are summarized by a pool of forked
+    processes. The groups are inherited by the workers instead of
+    pickled. Since all results are per IXP, the merged results are the
+    same as with a single process."""
+    classes = classify_pairs(groups, policy)
+    pairs = np.flatnonzero(groups.has_general)
+    if processes <= 1:
+        return summarize_tables(dependency_tables(groups, pair_cc, classes, pairs))
+
+    shards = shard_ixps(groups.pair_ix[pairs], pair_weights(groups, classes)[pairs], processes)
+    logging.info(f'Summarizing {len(pairs)} (ix_id, scope) pairs of {len(np.unique(groups.pair_ix[pairs]))} IXPs '
+                 f'with {len(shards)} processes')
+    global _shard_state
+    _shard_state = (groups, pair_cc, classes, pairs)
+    try:
+        with multiprocessing.get_context('fork').Pool(len(shards)) as pool:
+            results = pool.map(_summarize_shard, shards, chunksize=1)
+    finally:
+        _shard_state = None
+    # Merge in IXP order, i.e., in the same order as a single process.
+    ixp_dependencies, ix_summary, details = zip(*results)
+    ret = (defaultdict(dict), dict())
+    for merged, parts in zip(ret, (ixp_dependencies, ix_summary)):
+        merged.update(sorted((item for part in parts for item in part.items()), key=lambda t: t[0]))
+    return (*ret, merge_details(details))
+
+
+def merge_details(parts: list) -> DependencyDetails:
+    """Merge the DependencyDetails of disjoint sets of IXPs. The participant
+    sets are interned again, so the set ids are the same as if the
+    details were computed at once."""
+    offsets = [part.participant_sets.offsets for part in parts]
+    bases = np.cumsum([0] + [part[-1] for part in offsets[:-1]])
+    set_ids, participant_sets = intern_sets(np.concatenate([part[:-1] + base for part, base in zip(offsets, bases)]),
+                                            np.concatenate([part[1:] + base for part, base in zip(offsets, bases)]),
+                                            np.concatenate([part.participant_sets.asns for part in parts]))
+    set_base = 0
+    for part in parts:
+        num_sets = len(part.participant_sets.offsets) - 1
+        new_ids = set_ids[set_base:set_base + num_sets].tolist()
+        set_base += num_sets
+        for ccs in part.scopes.values():
+            for per_cc_data in ccs.values():
+                per_cc_data['multiple'] = defaultdict(list, ((new_ids[set_id], cc_scopes)
+                                                             for set_id, cc_scopes in per_cc_data['multiple'].items()))
+    scopes = defaultdict(dict)
+    scopes.update(sorted((item for part in parts for item in part.scopes.items()), key=lambda t: t[0]))
+    return DependencyDetails(scopes,
+                             participant_sets,
+                             MemberIndex.merge([part.members for part in parts]),
+                             ResidualIndex.merge([part.residuals for part in parts]))
+
+
+def pair_weights(groups: DependencyGroups, classes: tuple) -> np.ndarray:
+    """Return the approximate cost of summarizing each pair: one for the
+    pair plus its ASes and interfaces."""
+    _, as_source, interface_source = classes
+    ret = np.ones(groups.num_pairs, dtype=np.int64)
+    ret += np.bincount(groups.member_pair[groups.known | groups.per_as], minlength=groups.num_pairs) \
+        * (as_source != SOURCE_NONE)
+    ret += np.bincount(groups.interface_pairs[groups.interface_asn == AS0], minlength=groups.num_pairs) \
+        * (interface_source != SOURCE_NONE)
+    return ret
+
+
+def shard_ixps(pair_ix: np.ndarray, weights: np.ndarray, num_shards: int) -> list:
+    """Split pairs (given by their IXP ids and weights) into at most
+    num_shards shards of whole IXPs and return the positions of the
+    pairs of each shard.
+
+    IXPs are assigned from the largest to the smallest to the shard with
+    the smallest total weight so far (longest processing time first), so
+    large IXPs end up in different shards and no shard lags behind."""
+    ix_ids, ix_codes = np.unique(pair_ix, return_inverse=True)
+    ix_codes = ix_codes.reshape(-1)
+    ix_weights = np.bincount(ix_codes, weights=weights, minlength=len(ix_ids))
+    num_shards = max(1, min(num_shards, len(ix_ids)))
+    loads = [(0, shard) for shard in range(num_shards)]
+    ix_shard = np.zeros(len(ix_ids), dtype=np.int64)
+    for ix_code in np.argsort(-ix_weights, kind='stable').tolist():
+        load, shard = heapq.heappop(loads)
+        ix_shard[ix_code] = shard
+        heapq.heappush(loads, (load + ix_weights[ix_code], shard))
+    pair_shard = ix_shard[ix_codes]
+    return [np.flatnonzero(pair_shard == shard) for shard in range(num_shards)]
+
+
+# State of map_dependencies() for the worker processes. It is set before
+# the workers are forked, so it is inherited instead of pickled.
+_shard_state = None
+
+
+def _summarize_shard(positions: np.ndarray) -> tuple:
+    groups, pair_cc, classes, pairs = _shard_state
+    return summarize_tables(dependency_tables(groups, pair_cc, classes, pairs[positions]))
+
+
+def pair_residuals(groups: DependencyGroups) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the residuals of the decomposition of each pair's general
+    score: the general score minus the sum of the per-AS scores, and the
+    per-AS scores of the members with IP dependencies minus the sum of
+    these IP dependencies. Residuals are NaN if there are no parts.
+
+    classify_pairs() only needs to know whether they are close to zero,
+    the residuals show by how much they are not."""
+    general = np.where(groups.per_as_count > 0, groups.general_hege - groups.hege_sum, np.nan)
+    via_ip = groups.has_ips & groups.has_direct
+    via_ip_pairs = groups.member_pair[via_ip]
+    has_parts = np.bincount(via_ip_pairs, minlength=groups.num_pairs) > 0
+    interface = np.full(groups.num_pairs, np.nan)
+    interface[has_parts] = np.bincount(via_ip_pairs,
+                                       weights=groups.direct_hege[via_ip] - groups.ip_sum[via_ip],
+                                       minlength=groups.num_pairs)[has_parts]
+    return general, interface
+
+
+def dependency_tables(groups: DependencyGroups,
+                      pair_cc: np.ndarray,
+                      classes: tuple,
+                      pairs: np.ndarray,
+                      row_numbers: np.ndarray = None) -> DependencyTables:
+    """Return the DependencyTables of pairs (ids of pairs with a general
+    dependency). classes is the result of classify_pairs().
+
+    If the DependencyRows of groups are a subset of all rows, the
+    positions of the rows in the complete DependencyRows (row_numbers)
+    are used to order the pairs instead."""
+    category, as_source, interface_source = classes
+    selected = np.zeros(groups.num_pairs, dtype=bool)
+    selected[pairs] = True
+    member_source = np.where(selected[groups.member_pair], as_source[groups.member_pair], SOURCE_NONE)
+    as_members = (groups.known & (member_source == AS_SOURCE_KNOWN)) \
+        | (groups.per_as & (member_source == AS_SOURCE_PER_AS))
+    interface_as0 = (groups.interface_asn == AS0) & selected[groups.interface_pairs] \
+        & (interface_source[groups.interface_pairs] == INTERFACE_SOURCE_AS0)
+    via_ip_as0 = (groups.via_ip_asn == AS0) & selected[groups.via_ip_pairs] \
+        & (interface_source[groups.via_ip_pairs] == INTERFACE_SOURCE_AS0_VIA_IP)
+    first = groups.pair_first
+    general_residual, interface_residual = pair_residuals(groups)
+    ret = DependencyTables(groups.pair_ix[pairs],
+                           pair_cc[pairs],
+                           category[pairs],
+                           groups.pair_scope[pairs],
+                           first[pairs],
+                           groups.single_asn[pairs],
+                           general_residual[pairs],
+                           interface_residual[pairs],
+                           first[groups.member_pair[as_members]],
+                           groups.member_asn[as_members],
+                           np.concatenate((first[groups.interface_pairs[interface_as0]],
+                                           first[groups.via_ip_pairs[via_ip_as0]])),
+                           np.concatenate((groups.interface_ip[interface_as0], groups.via_ip_ip[via_ip_as0])))
+    if row_numbers is not None:
+        ret = ret._replace(pair_first=row_numbers[ret.pair_first],
+                           as_first=row_numbers[ret.as_first],
+                           interface_first=row_numbers[ret.interface_first])
+    return ret
+
+
+def merge_tables(tables: list) -> DependencyTables:
+    """Merge DependencyTables of disjoint sets of pairs. The merge is
+    associative and the order of tables does not matter for
+    summarize_tables()."""
+    return DependencyTables(*(np.concatenate(columns) for columns in zip(*tables)))
+
+
+def summarize_tables(tables: DependencyTables) -> tuple:
+    """Summarize the pairs of tables like map_dependencies().
+
+    All results are per IXP, so the results for disjoint sets of IXPs
+    can be merged without changing them."""
+    category = tables.pair_category
+    # Pairs in the order of the hegemony file, grouped by IXP.
+    ix_ids, ix_codes = np.unique(tables.pair_ix, return_inverse=True)
+    ix_codes = ix_codes.reshape(-1)
+    pairs = np.lexsort((tables.pair_first, ix_codes))
+    (ix_cc_codes,) = group_keys([(tables.pair_ix[pairs], tables.pair_cc[pairs])])
+    num_ix_cc = ix_cc_codes.max(initial=-1) + 1
+    pair_ix_cc = np.full(len(pairs), NO_ID, dtype=np.int64)
+    pair_ix_cc[pairs] = ix_cc_codes
+    ix_cc_ix = np.zeros(num_ix_cc, dtype=np.int64)
+    ix_cc_ix[ix_cc_codes] = tables.pair_ix[pairs]
+    ix_cc_cc = np.zeros(num_ix_cc, dtype=np.int64)
+    ix_cc_cc[ix_cc_codes] = tables.pair_cc[pairs]
+    ix_cc_ix_code = np.searchsorted(ix_ids, ix_cc_ix)
+
+    # Map the ASes and interfaces to their pairs.
+    by_first = np.argsort(tables.pair_first)
+    as_pairs = by_first[np.searchsorted(tables.pair_first, tables.as_first, sorter=by_first)]
+    as_values = tables.as_asn
+    members = MemberIndex.build(tables.pair_ix[as_pairs], as_values, tables.pair_scope[as_pairs], category[as_pairs])
+    interface_pairs = by_first[np.searchsorted(tables.pair_first, tables.interface_first, sorter=by_first)]
+    interface_values = tables.interface_ip
+
+    num_categories = len(CATEGORY_NAMES)
+    counts = np.bincount(pair_ix_cc * num_categories + category.clip(0),
+                         weights=category != NO_CATEGORY,
+                         minlength=num_ix_cc * num_categories).astype(np.int64).reshape(-1, num_categories)
+    general_counts = np.bincount(ix_cc_codes, minlength=num_ix_cc)
+    # The sets of ASes and interfaces per (IXP, country, category) are
+    # rolled up into the sets per (IXP, category) and per IXP. ASNs are
+    # replaced by their rank to get dense ids, IPs are interned already.
+    as_ids = np.unique(as_values, return_inverse=True)[1].reshape(-1)
+    as_sets = id_bitmaps(pair_ix_cc[as_pairs] * num_categories + category[as_pairs], as_ids)
+    interface_sets = id_bitmaps(pair_ix_cc[interface_pairs] * num_categories + category[interface_pairs],
+                                interface_values)
+    ases = bitmap_sizes(as_sets, num_ix_cc * num_categories).reshape(-1, num_categories)
+    interfaces = bitmap_sizes(interface_sets, num_ix_cc * num_categories).reshape(-1, num_categories)
+    # Per IXP, over all countries.
+    num_ix = len(ix_ids)
+    ix_counts = np.zeros((num_ix, num_categories), dtype=np.int64)
+    np.add.at(ix_counts, ix_cc_ix_code, counts)
+    ix_general_counts = np.bincount(ix_cc_ix_code, weights=general_counts, minlength=num_ix).astype(np.int64)
+    ix_keys = (np.repeat(ix_cc_ix_code, num_categories) * num_categories
+               + np.tile(np.arange(num_categories), num_ix_cc))
+    ix_as_sets = union_bitmaps(as_sets, ix_keys)
+    ix_interface_sets = union_bitmaps(interface_sets, ix_keys)
+    ix_ases = bitmap_sizes(ix_as_sets, num_ix * num_categories).reshape(-1, num_categories)
+    ix_interfaces = bitmap_sizes(ix_interface_sets, num_ix * num_categories).reshape(-1, num_categories)
+    ix_general_ases = bitmap_sizes(union_bitmaps(ix_as_sets, np.repeat(np.arange(num_ix), num_categories)), num_ix)
+    ix_general_interfaces = bitmap_sizes(union_bitmaps(ix_interface_sets,
+                                                       np.repeat(np.arange(num_ix), num_categories)),
+                                         num_ix)
+
+    # Singles and details need the order of the scopes.
+    singles = [dict() for _ in range(num_ix_cc)]
+    details = defaultdict(dict)
+    listed = pairs[(category[pairs] == CATEGORY_SINGLE) | (category[pairs] == CATEGORY_MULTIPLE)]
+    multiple_pairs = as_pairs[category[as_pairs] == CATEGORY_MULTIPLE]
+    multiple_ases = as_values[category[as_pairs] == CATEGORY_MULTIPLE]
+    order = np.lexsort((multiple_ases, multiple_pairs))
+    multiple_pairs = multiple_pairs[order]
+    multiple_ases = multiple_ases[order]
+    # Many scopes share the same set of ASes, so each set is stored once.
+    multiple = listed[category[listed] == CATEGORY_MULTIPLE]
+    set_ids, participant_sets = intern_sets(np.searchsorted(multiple_pairs, multiple, 'left'),
+                                            np.searchsorted(multiple_pairs, multiple, 'right'),
+                                            multiple_ases)
+    pair_set = np.full(len(category), NO_ID, dtype=np.int64)
+    pair_set[multiple] = set_ids
+    for ix_cc, pair_category, scope, asn, set_id in zip(pair_ix_cc[listed].tolist(),
+                                                        category[listed].tolist(),
+                                                        tables.pair_scope[listed].tolist(),
+                                                        tables.pair_asn[listed].tolist(),
+                                                        pair_set[listed].tolist()):
+        ix_id = int(ix_cc_ix[ix_cc])
+        cc = int(ix_cc_cc[ix_cc])
+        if cc not in details[ix_id]:
+            details[ix_id][cc] = {'single': defaultdict(list), 'multiple': defaultdict(list)}
+        if pair_category == CATEGORY_SINGLE:
+            singles[ix_cc][asn] = singles[ix_cc].get(asn, 0) + 1
+            details[ix_id][cc]['single'][asn].append(scope)
+        else:
+            details[ix_id][cc]['multiple'][set_id].append(scope)
+
+    ixp_dependencies = defaultdict(dict)
+    for ix_cc in range(num_ix_cc):
+        c, a, i = counts[ix_cc].tolist(), ases[ix_cc].tolist(), interfaces[ix_cc].tolist()
+        ixp_dependencies[int(ix_cc_ix[ix_cc])][int(ix_cc_cc[ix_cc])] = {
+            'general': int(general_counts[ix_cc]),
+            'single': singles[ix_cc],
+            'multiple': (c[CATEGORY_MULTIPLE], a[CATEGORY_MULTIPLE]),
+            'mixed': (c[CATEGORY_MIXED], a[CATEGORY_MIXED], i[CATEGORY_MIXED]),
+            'unknown': (c[CATEGORY_UNKNOWN], i[CATEGORY_UNKNOWN])}
+    ix_summary = dict()
+    for ix_code, ix_id in enumerate(ix_ids.tolist()):
+        c, a, i = ix_counts[ix_code].tolist(), ix_ases[ix_code].tolist(), ix_interfaces[ix_code].tolist()
+        ix_summary[ix_id] = {
+            'general': (int(ix_general_counts[ix_code]), int(ix_general_ases[ix_code]),
+                        int(ix_general_interfaces[ix_code])),
+            'single': (c[CATEGORY_SINGLE], a[CATEGORY_SINGLE]),
+            'multiple': (c[CATEGORY_MULTIPLE], a[CATEGORY_MULTIPLE]),
+            'mixed': (c[CATEGORY_MIXED], a[CATEGORY_MIXED]),
+            'unknown': (c[CATEGORY_UNKNOWN], i[CATEGORY_UNKNOWN])}
+    residuals = ResidualIndex.build(tables.pair_ix,
+                                    tables.pair_scope,
+                                    category,
+                                    tables.pair_general_residual,
+                                    tables.pair_interface_residual)
+    return ixp_dependencies, ix_summary, DependencyDetails(details, participant_sets, members, residuals)
+
+
+def save_tables(output_file: str,
+                tables: DependencyTables,
+                interner: Interner,
+                metadata: dict,
+                extra_arrays: dict = None) -> None:
+    """Write tables and metadata (see load_tables()) to output_file
+    (atomically), together with extra_arrays (name -> array), if given.
+
+    Country codes and IPs are stored as strings, since their ids are
+    only valid for the interner of this run."""
+    arrays = tables._asdict()
+    if extra_arrays:
+        arrays.update(extra_arrays)
+    for field, entity_type in TABLE_VALUE_FIELDS.items():
+        arrays[field] = interner.value_array(entity_type)[arrays[field]]
+    arrays[TABLE_METADATA] = np.asarray(json.dumps(metadata))
+    with atomic_open(output_file, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_tables(input_file: str, interner: Interner) -> Tuple[DependencyTables, dict]:
+    """Read tables written by save_tables() and return them (with the
+    country codes and IPs interned by interner) and their metadata."""
+    with np.load(input_file) as f:
+        # Tables written before the residuals were added have none.
+        arrays = {field: f[field] if field in f.files else np.full(len(f['pair_ix']), np.nan)
+                  for field in DependencyTables._fields}
+        metadata = json.loads(str(f[TABLE_METADATA]))
+    for field, entity_type in TABLE_VALUE_FIELDS.items():
+        arrays[field] = interner.intern_array(entity_type, arrays[field]).astype(np.int64)
+    return DependencyTables(**arrays), metadata
+
+
+def write_dependencies(output_file: str,
+                       detail_output_file: str,
+                       member_output_file: str,
+                       residual_output_file: str,
+                       ixp_dependencies: dict,
+                       ix_summary: dict,
+                       details: DependencyDetails,
+                       interner: Interner) -> None:
+    """Write the results of map_dependencies() or summarize_tables() as
+    a CSV file (per IXP overview and per country counts), a details
+    file with the scopes of the single and multiple dependencies (see
+    write_scope_details()), and the MemberIndex and ResidualIndex of
+    the details."""
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    # Convert ids back to strings for the details output.
+    out = dict()
+    for ix_id, ix_data in details.scopes.items():
+        ix_id = str(ix_id)
+        out[ix_id] = dict()
+        for cc, per_cc_data in ix_data.items():
+            cc = interner.value('cc', cc)
+            out[ix_id][cc] = dict()
+            # Literal keys, so that the pickled blocks are the same no
+            # matter where the details were computed.
+            for k in ('single', 'multiple'):
+                out[ix_id][cc][k] = defaultdict(list)
+                for key, scopes in per_cc_data[k].items():
+                    # Participant set ids stay ids.
+                    if k == 'single':
+                        key = str(key)
+                    out[ix_id][cc][k][key] = list(map(str, scopes))
+            if not out[ix_id][cc]:
+                out[ix_id].pop(cc)
+        if not out[ix_id]:
+            out.pop(ix_id)
+    write_scope_details(detail_output_file, out, details.participant_sets)
+    save_member_index(member_output_file, details.members)
+    save_residual_index(residual_output_file, details.residuals)
+
+    with open(output_file, 'w') as f:
+        headers = ('ix_id', 'cc', 'asn', 'scopes', 'asn_count', 'interface_count')
+        f.write(DATA_DELIMITER.join(headers) + '\n')
+        for ix_id, ccs in sorted(ixp_dependencies.items(), key=lambda t: int(t[0])):
+            overview = ix_summary[ix_id]
+            line = (ix_id, 'overview', 'general', *overview['general'])
+            f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+            line = (ix_id, 'overview', 'single', *overview['single'], 0)
+            f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+            line = (ix_id, 'overview', 'unknown', overview['unknown'][0], 0, overview['unknown'][1])
+            f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+            line = (ix_id, 'overview', 'mixed', *overview['mixed'], 0)
+            f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+            line = (ix_id, 'overview', 'multiple', *overview['multiple'], 0)
+            f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+            for cc_id, cc in sorted(((cc_id, interner.value('cc', cc_id)) for cc_id in ccs), key=lambda t: t[1]):
+                single = ccs[cc_id]['single']
+                multiple = ccs[cc_id]['multiple']
+                mixed = ccs[cc_id]['mixed']
+                unknown = ccs[cc_id]['unknown']
+                general = ccs[cc_id]['general']
+                line = (ix_id, cc, 'general', general, 0, 0)
+                f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+                line = (ix_id, cc, 'unknown', unknown[0], 0, unknown[1])
+                f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+                line = (ix_id, cc, 'mixed', *mixed)
+                f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+                line = (ix_id, cc, 'multiple', *multiple, 0)
+                f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+                for asn in single:
+                    line = (ix_id, cc, asn, single[asn], 1, 0)
+                    f.write(DATA_DELIMITER.join(map(str, line)) + '\n')
+
+
+def merge_violations(parts: list) -> list:
+    """Merge the results of validate_dependencies() for disjoint sets of
+    scopes into one list with one Violation per check."""
+    ret = list()
+    for check in CHECKS:
+        violations = [v for violations in parts for v in violations if v.check is check]
+        if violations:
+            ret.append(Violation(check, *(np.concatenate(columns) for columns in list(zip(*violations))[1:])))
+    return ret
+
+
+def report_violations(violations: list, interner: Interner) -> bool:
+    """Log all violations sorted by (ix_id, scope). Return True if any
+    of them is fatal."""
+    for check, ix_ids, scopes, details in violations:
+        log = logging.error if check.fatal else logging.warning
+        log(f'{check.message}: {len(scopes)} occurrences [{check.name}]')
+        for idx in np.lexsort((details, scopes, ix_ids)).tolist():
+            line = f'ix_id:{ix_ids[idx]} scope:{scopes[idx]}'
+            if check is CHECK_UNREACHED_IP:
+                line = f'scope:{scopes[idx]} ip:{interner.value("ip", details[idx])}'
+            elif details[idx] != NO_ID:
+                line += f' ix_asn:{details[idx]}'
+            log(line)
+    return any(v.check.fatal for v in violations)
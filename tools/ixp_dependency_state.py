@@ -0,0 +1,140 @@
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+
+from tools.interning import NO_ID, Interner
+from tools.ixp_dependencies import DependencyRows, DependencyTables, load_tables, save_tables
+from tools.per_scope_interfaces import PerScopeInterfaces
+
+STATE_FIELDS = ('digest_scope', 'digest', 'first_rank')
+# Tags that keep rows and interfaces with the same values apart.
+ROW_TAG = 1
+INTERFACE_TAG = 2
+
+DependencyState = namedtuple('DependencyState', 'tables metadata digest_scope digest first_rank')
+DependencyState.__doc__ = """Classification state of a snapshot for incremental runs of
+extract-per-as-ixp-dependencies.py.
+
+tables are the DependencyTables of all pairs. digest is the digest of
+the inputs (see scope_digests()) of each scope in digest_scope (sorted)
+and first_rank the rank of each pair's first row among the rows of its
+scope, which is independent of the other scopes (see rebase_tables())."""
+
+
+def mix(values: np.ndarray) -> np.ndarray:
+    """Scramble uint64 values (splitmix64 finalizer)."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def hash_columns(*columns: np.ndarray) -> np.ndarray:
+    """Return a uint64 hash of each row of columns."""
+    ret = np.zeros(len(columns[0]), dtype=np.uint64)
+    for values in columns:
+        ret = mix(ret ^ values.astype(np.int64).view(np.uint64))
+    return ret
+
+
+def ip_hashes(interner: Interner) -> np.ndarray:
+    """Return a hash of each interned IP that, unlike the id, does not
+    depend on the interner."""
+    return np.fromiter((int.from_bytes(hashlib.blake2b(ip.encode(), digest_size=8).digest(), 'little')
+                        for ip in interner.values['ip']),
+                       dtype=np.uint64,
+                       count=interner.size('ip'))
+
+
+def scope_ranks(scope: np.ndarray) -> np.ndarray:
+    """Return the rank of each row among the rows with the same scope."""
+    order = np.argsort(scope, kind='stable')
+    starts = np.r_[0, np.flatnonzero(scope[order][1:] != scope[order][:-1]) + 1]
+    ret = np.empty(len(scope), dtype=np.int64)
+    ret[order] = np.arange(len(scope)) - np.repeat(starts, np.diff(np.r_[starts, len(scope)]))
+    return ret
+
+
+def scope_digests(rows: DependencyRows, interfaces: PerScopeInterfaces, interner: Interner) -> tuple:
+    """Return the scopes of rows and interfaces (sorted) and a digest of
+    the inputs of each scope.
+
+    All pairs of a scope are classified from the rows and interfaces of
+    the scope only (IP dependencies are mapped to their IXP via the
+    interfaces of the scope), so scopes with the same digest in two
+    snapshots have the same pairs and classification. The digest covers
+    the values and the order of the rows, which decides the order of the
+    pairs and of the per-AS scores that are summed."""
+    ips = ip_hashes(interner)
+    row_ip = np.where(rows.ip == NO_ID, np.uint64(0), ips[rows.ip.clip(min=0)])
+    row_hashes = hash_columns(np.full(len(rows.scope), ROW_TAG),
+                              scope_ranks(rows.scope),
+                              rows.kind,
+                              rows.ix_id,
+                              rows.member,
+                              row_ip,
+                              rows.hegemony.astype(np.float64).view(np.int64))
+    interface_hashes = hash_columns(np.full(len(interfaces.scope), INTERFACE_TAG),
+                                    scope_ranks(interfaces.scope),
+                                    interfaces.ix_id,
+                                    interfaces.asn,
+                                    ips[interfaces.ip])
+    scopes, inverse = np.unique(np.concatenate((rows.scope, interfaces.scope)), return_inverse=True)
+    digests = np.zeros(len(scopes), dtype=np.uint64)
+    np.add.at(digests, inverse.reshape(-1), np.concatenate((row_hashes, interface_hashes)))
+    return scopes, digests
+
+
+def first_ranks(tables: DependencyTables, scope: np.ndarray) -> np.ndarray:
+    """Return the rank of the first row of each pair of tables among the
+    rows of its scope (scope of all DependencyRows)."""
+    return scope_ranks(scope)[tables.pair_first]
+
+
+def rebase_tables(tables: DependencyTables, first_rank: np.ndarray, scope: np.ndarray) -> DependencyTables:
+    """Return tables with the first rows of the pairs moved to the rows
+    with the same rank in the scope of the pair in new DependencyRows
+    (scope). The rows of the scopes of tables have to be unchanged."""
+    order = np.argsort(scope, kind='stable')
+    scopes, starts = np.unique(scope[order], return_index=True)
+    pair_first = order[starts[np.searchsorted(scopes, tables.pair_scope)] + first_rank]
+    by_first = np.argsort(tables.pair_first)
+    return tables._replace(
+        pair_first=pair_first,
+        as_first=pair_first[by_first[np.searchsorted(tables.pair_first, tables.as_first, sorter=by_first)]],
+        interface_first=pair_first[by_first[np.searchsorted(tables.pair_first, tables.interface_first,
+                                                            sorter=by_first)]])
+
+
+def select_pairs(tables: DependencyTables, mask: np.ndarray) -> DependencyTables:
+    """Return the pairs of tables selected by mask, with their ASes and
+    interfaces."""
+    first = tables.pair_first[mask]
+    as_mask = np.isin(tables.as_first, first)
+    interface_mask = np.isin(tables.interface_first, first)
+    return tables._replace(**{field: getattr(tables, field)[mask]
+                              for field in tables._fields if field.startswith('pair_')},
+                           as_first=tables.as_first[as_mask],
+                           as_asn=tables.as_asn[as_mask],
+                           interface_first=tables.interface_first[interface_mask],
+                           interface_ip=tables.interface_ip[interface_mask])
+
+
+def unchanged_since(state: DependencyState, scopes: np.ndarray, digests: np.ndarray) -> np.ndarray:
+    """Return the scopes (sorted, with digests from scope_digests()) that
+    have the same digest in state."""
+    common, idx, state_idx = np.intersect1d(scopes, state.digest_scope, assume_unique=True, return_indices=True)
+    return common[digests[idx] == state.digest[state_idx]]
+
+
+def save_state(output_file: str, state: DependencyState, interner: Interner) -> None:
+    save_tables(output_file, state.tables, interner, state.metadata,
+                {field: getattr(state, field) for field in STATE_FIELDS})
+
+
+def load_state(input_file: str, interner: Interner) -> DependencyState:
+    tables, metadata = load_tables(input_file, interner)
+    with np.load(input_file) as f:
+        return DependencyState(tables, metadata, **{field: f[field] for field in STATE_FIELDS})
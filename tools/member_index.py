@@ -0,0 +1,112 @@
+from typing import Tuple
+
+import numpy as np
+
+from tools.atomic_files import atomic_open
+from tools.per_scope_interfaces import group_starts
+
+MEMBER_INDEX_FIELDS = ('ix_id', 'asn', 'offsets', 'scope', 'category', 'by_asn')
+
+
+class MemberIndex:
+    """Reverse map from IXP members to the scopes that depend on them.
+
+    Members (ix_id, asn) are sorted and the dependent scopes of member i
+    are scope[offsets[i]:offsets[i + 1]] (sorted), with the category of
+    each dependency (see CATEGORY_NAMES in ixp_dependencies) in
+    category. by_asn holds the members sorted by (asn, ix_id), so the
+    members with an ASN at all IXPs are found with a binary search as
+    well."""
+
+    def __init__(self, arrays: dict) -> None:
+        self.ix_id = arrays['ix_id']
+        self.asn = arrays['asn']
+        self.offsets = arrays['offsets']
+        self.scope = arrays['scope']
+        self.category = arrays['category']
+        self.by_asn = arrays['by_asn']
+        self.asn_sorted = self.asn[self.by_asn]
+
+    @classmethod
+    def build(cls, ix_id: np.ndarray, asn: np.ndarray, scope: np.ndarray, category: np.ndarray):
+        """Return the index of records with one entry per dependency of
+        scope on member asn at ix_id."""
+        order = np.lexsort((scope, asn, ix_id))
+        ix_id, asn = ix_id[order], asn[order]
+        starts = np.flatnonzero(group_starts(ix_id, asn))
+        return cls({'ix_id': ix_id[starts],
+                    'asn': asn[starts],
+                    'offsets': np.r_[starts, len(order)].astype(np.int64),
+                    'scope': scope[order],
+                    'category': category[order].astype(np.int8),
+                    'by_asn': np.lexsort((ix_id[starts], asn[starts]))})
+
+    @classmethod
+    def merge(cls, indexes: list):
+        """Merge the indexes of disjoint sets of dependencies."""
+        return cls.build(*(np.concatenate(columns) for columns in zip(*(index.records() for index in indexes))))
+
+    def __len__(self) -> int:
+        return len(self.ix_id)
+
+    def records(self) -> tuple:
+        """Return the (ix_id, asn, scope, category) of all dependencies."""
+        sizes = np.diff(self.offsets)
+        return np.repeat(self.ix_id, sizes), np.repeat(self.asn, sizes), self.scope, self.category
+
+    def member(self, ix_id: int, asn: int) -> int:
+        """Return the position of member (ix_id, asn), or None if it has no
+        dependent scopes."""
+        lo = int(np.searchsorted(self.ix_id, ix_id, 'left'))
+        hi = int(np.searchsorted(self.ix_id, ix_id, 'right'))
+        idx = lo + int(np.searchsorted(self.asn[lo:hi], asn))
+        if idx == hi or self.asn[idx] != asn:
+            return None
+        return idx
+
+    def lookup(self, ix_id: int, asn: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the dependent scopes of member (ix_id, asn) and their
+        categories."""
+        idx = self.member(ix_id, asn)
+        if idx is None:
+            return self.scope[:0], self.category[:0]
+        return self.scopes(idx)
+
+    def scopes(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the dependent scopes of the member at position idx and
+        their categories."""
+        start, stop = self.offsets[idx], self.offsets[idx + 1]
+        return self.scope[start:stop], self.category[start:stop]
+
+    def asn_members(self, asn: int) -> np.ndarray:
+        """Return the positions of the members with asn at all IXPs (sorted
+        by ix_id)."""
+        return self.by_asn[np.searchsorted(self.asn_sorted, asn, 'left'):np.searchsorted(self.asn_sorted, asn, 'right')]
+
+    def counts(self, category: int = None) -> np.ndarray:
+        """Return the number of dependent scopes of each member, only
+        counting dependencies of the given category, if any."""
+        if category is None:
+            return np.diff(self.offsets)
+        member = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        return np.bincount(member, weights=self.category == category, minlength=len(self)).astype(np.int64)
+
+    def top_members(self, k: int, category: int = None) -> np.ndarray:
+        """Return the positions of the (at most) k members with the most
+        dependent scopes (of category), most critical first. Ties are
+        broken by (ix_id, asn)."""
+        counts = self.counts(category)
+        order = np.lexsort((self.asn, self.ix_id, -counts))[:k]
+        return order[counts[order] > 0]
+
+
+def save_member_index(output_file: str, index: MemberIndex) -> None:
+    """Write index to output_file (atomically). The arrays are not
+    compressed, so loading them is fast."""
+    with atomic_open(output_file, 'wb') as f:
+        np.savez(f, **{field: getattr(index, field) for field in MEMBER_INDEX_FIELDS})
+
+
+def load_member_index(input_file: str) -> MemberIndex:
+    with np.load(input_file) as f:
+        return MemberIndex({field: f[field] for field in MEMBER_INDEX_FIELDS})
@@ -0,0 +1,87 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from tools.interning import NO_ID, Interner
+
+DATA_DELIMITER = ','
+# Rows per chunk if only some rows of the file are read.
+INTERFACE_CHUNK_SIZE = 1024 ** 2
+
+PerScopeInterfaces = namedtuple('PerScopeInterfaces', 'ix_id asn ip scope')
+PerScopeInterfaces.__doc__ = """Parsed per-scope interfaces file, one array entry per row (in file
+order).
+
+Each row states that scope was reached via interface ip of member asn
+at IXP ix_id. ix_id, asn, and scope are int64, ip holds interned IP
+ids (int32)."""
+
+
+def pair_keys(scope: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Combine scopes and values (IXP ids or interned IP ids, both below
+    2^32) into uint64 keys for fast membership tests."""
+    return np.left_shift(scope.astype(np.uint64), np.uint64(32)) | values.astype(np.uint64)
+
+
+def read_csv_chunks(input_file: str, chunksize: int = None):
+    return pd.read_csv(input_file,
+                       sep=DATA_DELIMITER,
+                       header=0,
+                       names=['ix_id', 'asn', 'ip', 'scope'],
+                       usecols=[0, 1, 2, 3],
+                       dtype={'ix_id': np.int64, 'asn': np.int64, 'ip': str, 'scope': np.int64},
+                       chunksize=chunksize)
+
+
+def read_per_scope_interfaces(input_file: str,
+                              interner: Interner,
+                              ix_keys: np.ndarray = None,
+                              ip_keys: np.ndarray = None,
+                              chunksize: int = INTERFACE_CHUNK_SIZE) -> PerScopeInterfaces:
+    """Parse a per-scope interfaces file.
+
+    If ix_keys or ip_keys (sorted pair_keys() of (scope, ix_id) and
+    (scope, interned IP id)) are given, only rows that match one of them
+    are kept. The file is then streamed in chunks of chunksize rows and
+    only the IPs of the kept rows are interned, so memory usage depends
+    on the number of matching rows instead of the size of the file."""
+    if ix_keys is None and ip_keys is None:
+        df = read_csv_chunks(input_file)
+        return PerScopeInterfaces(df['ix_id'].to_numpy(),
+                                  df['asn'].to_numpy(),
+                                  interner.intern_array('ip', df['ip'].to_numpy()),
+                                  df['scope'].to_numpy())
+    parts = list()
+    with read_csv_chunks(input_file, chunksize) as reader:
+        for df in reader:
+            scope = df['scope'].to_numpy()
+            ix_id = df['ix_id'].to_numpy()
+            ips = df['ip'].to_numpy()
+            keep = np.zeros(len(df), dtype=bool)
+            if ix_keys is not None:
+                keep |= np.isin(pair_keys(scope, ix_id), ix_keys)
+            if ip_keys is not None:
+                # IPs that were never interned can not match.
+                uniques, inverse = np.unique(ips, return_inverse=True)
+                ip_ids = np.fromiter((interner.get('ip', ip) for ip in uniques.tolist()),
+                                     dtype=np.int64,
+                                     count=len(uniques))[inverse.reshape(-1)]
+                keep |= (ip_ids != NO_ID) & np.isin(pair_keys(scope, ip_ids), ip_keys)
+            parts.append((ix_id[keep], df['asn'].to_numpy()[keep], ips[keep], scope[keep]))
+    if not parts:
+        parts.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=object),
+                      np.empty(0, dtype=np.int64)))
+    ix_id, asn, ips, scope = (np.concatenate(values) for values in zip(*parts))
+    return PerScopeInterfaces(ix_id, asn, interner.intern_array('ip', ips), scope)
+
+
+def group_starts(*columns: np.ndarray) -> np.ndarray:
+    """Return a mask of the rows of the (sorted) columns that differ from
+    the previous row in any column."""
+    ret = np.zeros(len(columns[0]), dtype=bool)
+    if len(ret):
+        ret[0] = True
+    for values in columns:
+        ret[1:] |= values[1:] != values[:-1]
+    return ret
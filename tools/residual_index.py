@@ -0,0 +1,148 @@
+from typing import Tuple
+
+import numpy as np
+
+from tools.atomic_files import atomic_open
+from tools.per_scope_interfaces import group_starts
+
+RESIDUAL_INDEX_FIELDS = ('ix_id', 'offsets', 'scope', 'category', 'general', 'interface', 'summary')
+RESIDUAL_KINDS = ('general', 'interface')
+# Residuals within this distance of zero count as adding up.
+RESIDUAL_TOLERANCE = 1e-05
+SUMMARY_STATS = ('count', 'over', 'under', 'min', 'median', 'max', 'mean')
+SUMMARY_DTYPE = np.dtype([('ix_id', '<i8'), ('pairs', '<i8')]
+                         + [(f'{kind}_{stat}', '<i8' if stat in ('count', 'over', 'under') else '<f8')
+                            for kind in RESIDUAL_KINDS
+                            for stat in SUMMARY_STATS])
+
+
+def summarize_residuals(offsets: np.ndarray, values: np.ndarray) -> dict:
+    """Return the SUMMARY_STATS of the residuals of each group
+    values[offsets[i]:offsets[i + 1]], ignoring NaNs.
+
+    over and under count the residuals below -RESIDUAL_TOLERANCE (the
+    parts add up to more than the whole) and above RESIDUAL_TOLERANCE.
+    The other stats are NaN for groups without residuals."""
+    num_groups = len(offsets) - 1
+    group = np.repeat(np.arange(num_groups), np.diff(offsets))
+    defined = ~np.isnan(values)
+    group, values = group[defined], values[defined].astype(np.float64)
+    order = np.lexsort((values, group))
+    group, values = group[order], values[order]
+    count = np.bincount(group, minlength=num_groups)
+    starts = np.r_[0, np.cumsum(count)[:-1]].astype(np.int64)
+    ret = {'count': count,
+           'over': np.bincount(group, weights=values < -RESIDUAL_TOLERANCE, minlength=num_groups).astype(np.int64),
+           'under': np.bincount(group, weights=values > RESIDUAL_TOLERANCE, minlength=num_groups).astype(np.int64)}
+    for stat in ('min', 'median', 'max', 'mean'):
+        ret[stat] = np.full(num_groups, np.nan)
+    some = count > 0
+    first, last = starts[some], starts[some] + count[some] - 1
+    ret['min'][some] = values[first]
+    ret['max'][some] = values[last]
+    ret['median'][some] = (values[first + (count[some] - 1) // 2] + values[first + count[some] // 2]) / 2
+    ret['mean'][some] = np.bincount(group, weights=values, minlength=num_groups)[some] / count[some]
+    return ret
+
+
+class ResidualIndex:
+    """Residuals of the decomposition of the general dependency of each
+    (ix_id, scope) pair.
+
+    general is the general score minus the sum of the per-AS scores (NaN
+    without per-AS scores), and interface the per-AS scores of the
+    members with IP dependencies minus the sum of these IP dependencies
+    (NaN without IP dependencies). Negative residuals mean that the
+    parts add up to more than the whole. Pairs are sorted by (ix_id,
+    scope), the pairs of IXP ix_id[i] are offsets[i]:offsets[i + 1], and
+    summary holds the distribution of both residuals per IXP (see
+    summarize_residuals())."""
+
+    def __init__(self, arrays: dict) -> None:
+        self.ix_id = arrays['ix_id']
+        self.offsets = arrays['offsets']
+        self.scope = arrays['scope']
+        self.category = arrays['category']
+        self.general = arrays['general']
+        self.interface = arrays['interface']
+        self.summary = arrays['summary']
+
+    @classmethod
+    def build(cls,
+              ix_id: np.ndarray,
+              scope: np.ndarray,
+              category: np.ndarray,
+              general: np.ndarray,
+              interface: np.ndarray):
+        """Return the index of pairs (ix_id, scope) with their category and
+        residuals."""
+        order = np.lexsort((scope, ix_id))
+        ix_id = ix_id[order]
+        starts = np.flatnonzero(group_starts(ix_id))
+        offsets = np.r_[starts, len(order)].astype(np.int64)
+        general = general[order].astype(np.float32)
+        interface = interface[order].astype(np.float32)
+        summary = np.zeros(len(starts), dtype=SUMMARY_DTYPE)
+        summary['ix_id'] = ix_id[starts]
+        summary['pairs'] = np.diff(offsets)
+        for kind, values in (('general', general), ('interface', interface)):
+            for stat, stat_values in summarize_residuals(offsets, values).items():
+                summary[f'{kind}_{stat}'] = stat_values
+        return cls({'ix_id': ix_id[starts],
+                    'offsets': offsets,
+                    'scope': scope[order],
+                    'category': category[order].astype(np.int8),
+                    'general': general,
+                    'interface': interface,
+                    'summary': summary})
+
+    @classmethod
+    def merge(cls, indexes: list):
+        """Merge the indexes of disjoint sets of pairs."""
+        return cls.build(*(np.concatenate(columns) for columns in zip(*(index.records() for index in indexes))))
+
+    def __len__(self) -> int:
+        return len(self.scope)
+
+    def records(self) -> tuple:
+        """Return the (ix_id, scope, category, general, interface) of all
+        pairs."""
+        return np.repeat(self.ix_id, np.diff(self.offsets)), self.scope, self.category, self.general, self.interface
+
+    def ix_range(self, ix_id: int) -> Tuple[int, int]:
+        """Return the (start, stop) positions of the pairs of ix_id, which
+        are empty if the IXP has no pairs."""
+        idx = int(np.searchsorted(self.ix_id, ix_id))
+        if idx == len(self.ix_id) or self.ix_id[idx] != ix_id:
+            return 0, 0
+        return int(self.offsets[idx]), int(self.offsets[idx + 1])
+
+    def lookup(self, ix_id: int, scope: int) -> int:
+        """Return the position of pair (ix_id, scope), or None if it does
+        not exist."""
+        start, stop = self.ix_range(ix_id)
+        idx = start + int(np.searchsorted(self.scope[start:stop], scope))
+        if idx == stop or self.scope[idx] != scope:
+            return None
+        return idx
+
+    def outliers(self, min_residual: float, positions: np.ndarray = None) -> np.ndarray:
+        """Return the positions (of all pairs or of positions) with an
+        absolute residual of at least min_residual."""
+        if positions is None:
+            positions = np.arange(len(self))
+        # NaN compares False, so undefined residuals are never outliers.
+        mask = (np.abs(self.general[positions]) >= min_residual) | (np.abs(self.interface[positions]) >= min_residual)
+        return positions[mask]
+
+
+def save_residual_index(output_file: str, index: ResidualIndex) -> None:
+    """Write index to output_file (atomically). The arrays are not
+    compressed, so loading them is fast."""
+    with atomic_open(output_file, 'wb') as f:
+        np.savez(f, **{field: getattr(index, field) for field in RESIDUAL_INDEX_FIELDS})
+
+
+def load_residual_index(input_file: str) -> ResidualIndex:
+    with np.load(input_file) as f:
+        return ResidualIndex({field: f[field] for field in RESIDUAL_INDEX_FIELDS})
@@ -0,0 +1,199 @@
+import bz2
+import io
+import os
+import pickle
+import struct
+import zlib
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+from tools.atomic_files import atomic_open
+
+MAGIC = b'PSDETAIL'
+# Offset and length of the (zlib-compressed) index, followed by MAGIC, at
+# the end of the file.
+FOOTER = struct.Struct('<QQ8s')
+
+ParticipantSets = namedtuple('ParticipantSets', 'offsets asns')
+ParticipantSets.__doc__ = """Distinct sets of member ASNs of multiple dependencies (see
+intern_sets()). The (sorted) ASNs of set id i are
+asns[offsets[i]:offsets[i + 1]]."""
+
+
+def intern_sets(starts: np.ndarray, ends: np.ndarray, values: np.ndarray) -> tuple:
+    """Return the set id of each group values[starts[i]:ends[i]] (sorted
+    and distinct values) and the distinct sets as ParticipantSets.
+
+    Sets are ordered by size and then by their values, so the ids only
+    depend on which sets exist. Groups of the same size are compared as
+    rows of a matrix, i.e., with one np.unique() per distinct size."""
+    lengths = ends - starts
+    ids = np.empty(len(starts), dtype=np.int64)
+    sizes = list()
+    parts = [np.empty(0, dtype=np.int64)]
+    for length in np.unique(lengths).tolist():
+        groups = np.flatnonzero(lengths == length)
+        uniques, inverse = np.unique(values[starts[groups, np.newaxis] + np.arange(length)],
+                                     axis=0,
+                                     return_inverse=True)
+        ids[groups] = len(sizes) + inverse.reshape(-1)
+        sizes.extend([length] * len(uniques))
+        parts.append(uniques.reshape(-1))
+    return ids, ParticipantSets(np.r_[0, np.cumsum(sizes, dtype=np.int64)], np.concatenate(parts))
+
+
+def write_scope_details(output_file: str, details: dict, participant_sets: ParticipantSets) -> None:
+    """Write details (ix_id -> cc -> {'single': ..., 'multiple': ...})
+    to output_file (atomically). The keys of 'multiple' are ids of
+    participant_sets, which are stored once for all IXPs.
+
+    The details of each IXP are stored as one independently compressed
+    block of the pickled details of its countries (sorted by cc), with
+    IXPs sorted by id. An index at the end of the file states for each
+    (ix_id, cc) the offset and length of the block of the IXP and the
+    range of the country in the decompressed block (see ScopeDetails).
+    Most countries only have a few scopes, so they are not compressed
+    individually."""
+    ix_ids = sorted(map(int, details))
+    index = list()
+    with atomic_open(output_file, 'wb') as f:
+        f.write(MAGIC)
+        for ix_id in ix_ids:
+            parts = [(cc, pickle.dumps(per_cc_data)) for cc, per_cc_data in sorted(details[str(ix_id)].items())]
+            block = bz2.compress(b''.join(data for _, data in parts))
+            ends = np.cumsum([len(data) for _, data in parts]).tolist()
+            for (cc, data), end in zip(parts, ends):
+                index.append((ix_id, cc, f.tell(), len(block), end - len(data), end))
+            f.write(block)
+        ccs = np.asarray([entry[1] for entry in index], dtype=str)
+        index = np.array(index, dtype=[('ix_id', '<i8'),
+                                       ('cc', ccs.dtype if len(ccs) else '<U2'),
+                                       ('offset', '<i8'),
+                                       ('length', '<i8'),
+                                       ('start', '<i8'),
+                                       ('stop', '<i8')])
+        data = io.BytesIO()
+        for array in (index, participant_sets.offsets, participant_sets.asns):
+            np.lib.format.write_array(data, array, allow_pickle=False)
+        data = zlib.compress(data.getvalue())
+        f.write(data)
+        f.write(FOOTER.pack(f.tell() - len(data), len(data), MAGIC))
+
+
+def convert_pickle_details(details: dict) -> tuple:
+    """Convert details read from a *.per_scope_details.pickle.bz2 file,
+    where the keys of 'multiple' are tuples of member ASNs, to the input
+    of write_scope_details(). Return the details with participant set
+    ids as keys of 'multiple' and the ParticipantSets."""
+    keys = sorted({key for ix_data in details.values() for per_cc_data in ix_data.values()
+                   for key in per_cc_data['multiple']})
+    groups = [np.unique(np.asarray(key, dtype=np.int64)) for key in keys]
+    lengths = np.array([len(group) for group in groups], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    set_ids, participant_sets = intern_sets(ends - lengths,
+                                            ends,
+                                            np.concatenate([np.empty(0, dtype=np.int64)] + groups))
+    key_ids = dict(zip(keys, set_ids.tolist()))
+    ret = dict()
+    for ix_id, ix_data in details.items():
+        ret[str(ix_id)] = dict()
+        for cc, per_cc_data in ix_data.items():
+            ret[str(ix_id)][cc] = {
+                'single': defaultdict(list, ((str(asn), list(map(str, scopes)))
+                                             for asn, scopes in per_cc_data['single'].items())),
+                'multiple': defaultdict(list, ((key_ids[key], list(map(str, scopes)))
+                                               for key, scopes in per_cc_data['multiple'].items()))
+            }
+    return ret, participant_sets
+
+
+class ScopeDetails:
+    """Random access to a per-scope details file written by
+    write_scope_details().
+
+    Opening the file only reads its index and the participant sets
+    (see participants()). The block of an IXP is read
+    and decompressed on demand, and only the requested countries are
+    unpickled, so the time to look up an IXP or an (ix_id, cc) slice
+    does not depend on the size of the file."""
+
+    def __init__(self, input_file: str) -> None:
+        self.f = open(input_file, 'rb')
+        try:
+            if self.f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'Not a per-scope details file: {input_file}')
+            self.f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_length, magic = FOOTER.unpack(self.f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f'Truncated per-scope details file: {input_file}')
+            self.f.seek(index_offset)
+            data = io.BytesIO(zlib.decompress(self.f.read(index_length)))
+            self.index = np.lib.format.read_array(data, allow_pickle=False)
+            self.participant_sets = ParticipantSets(*(np.lib.format.read_array(data, allow_pickle=False)
+                                                      for _ in ParticipantSets._fields))
+        except BaseException:
+            self.f.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.f.close()
+
+    def ixps(self) -> list:
+        """Return the (sorted) ids of all IXPs."""
+        return np.unique(self.index['ix_id']).tolist()
+
+    def slice_range(self, ix_id) -> tuple:
+        """Return the (start, stop) index entries of ix_id, which are empty
+        if the IXP does not exist."""
+        ix_id = int(ix_id)
+        return (int(np.searchsorted(self.index['ix_id'], ix_id, 'left')),
+                int(np.searchsorted(self.index['ix_id'], ix_id, 'right')))
+
+    def countries(self, ix_id) -> list:
+        """Return the (sorted) country codes of ix_id."""
+        start, stop = self.slice_range(ix_id)
+        return self.index['cc'][start:stop].tolist()
+
+    def read_slices(self, start: int, stop: int) -> list:
+        """Return the details of index entries start to stop, which have to
+        belong to the same IXP."""
+        if start == stop:
+            return list()
+        self.f.seek(int(self.index['offset'][start]))
+        block = bz2.decompress(self.f.read(int(self.index['length'][start])))
+        return [pickle.loads(block[first:last])
+                for first, last in zip(self.index['start'][start:stop].tolist(),
+                                       self.index['stop'][start:stop].tolist())]
+
+    def ix(self, ix_id) -> dict:
+        """Return the details of ix_id as cc -> {'single': ...,
+        'multiple': ...}, or an empty dict if the IXP does not exist."""
+        start, stop = self.slice_range(ix_id)
+        return dict(zip(self.index['cc'][start:stop].tolist(), self.read_slices(start, stop)))
+
+    def country(self, ix_id, cc: str) -> dict:
+        """Return the details of the scopes in country cc at ix_id, or None
+        if there are none."""
+        start, stop = self.slice_range(ix_id)
+        idx = start + int(np.searchsorted(self.index['cc'][start:stop], cc))
+        if idx == stop or self.index['cc'][idx] != cc:
+            return None
+        return self.read_slices(idx, idx + 1)[0]
+
+    def participants(self, set_id: int) -> tuple:
+        """Return the (sorted) member ASNs of a participant set id (the keys
+        of 'multiple')."""
+        offsets = self.participant_sets.offsets
+        return tuple(self.participant_sets.asns[offsets[set_id]:offsets[set_id + 1]].tolist())
+
+    def read_all(self) -> dict:
+        """Return all details as ix_id (str) -> cc -> {'single': ...,
+        'multiple': ...}."""
+        return {str(ix_id): self.ix(ix_id) for ix_id in self.ixps()}